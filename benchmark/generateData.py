@@ -0,0 +1,713 @@
+#!/usr/bin/python3
+#
+# Synthetic data for the benchmarks
+#
+# Generates, from a random seed, the files the scripts work on: a DVB
+# channels list, one XMLTV EPG file per channel with a realistic day of
+# news, series, films and documentaries, the all-channels guide as written
+# by epgrab, a rule set, a schedule of past recordings and the transport
+# stream of a multiplex with its PAT, PMTs, SDT and EIT schedule.
+#
+# The same seed and sizes always give the same data, so that the benchmark
+# results of different runs can be compared.
+#
+import argparse
+import os
+import sys
+import re
+import random
+import struct
+import datetime
+import xmltodict
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'epg'
+))
+import eit
+
+# ------------------------------------------------------------------------------
+# constants
+#
+EPG_HEADER = (
+    '<?xml version="1.0" encoding="utf-8"?>\n' +
+    '<!DOCTYPE tv SYSTEM "xmltv.dtd">\n' +
+    '<tv generator-info-name="epg-grab">\n'
+)
+EPG_FOOTER = "</tv>\n"
+CHANNELS_FILE_NAME = 'channels-dvb.txt'
+GRAB_FILE_NAME = 'epg.xml'
+RULES_FILE_NAME = 'ruleSet.xml'
+SCHEDULE_FILE_NAME = 'schedule.xml'
+TS_FILE_NAME = 'multiplex.ts'
+KNOWN_CHANNELS = (
+    'TF1', 'France 2', 'France 3', 'Arte', 'France 5', 'M6', 'RTS 1',
+    'RTS 2', 'TV5 Monde', 'LCI', 'Franceinfo', 'France 4'
+)
+SERVICES_PER_MULTIPLEX = 6
+FIRST_FREQUENCY = 474000000
+FREQUENCY_STEP = 8000000
+LANGUAGE = 'fr'
+EIT_LANGUAGE = b'fre'
+                                                            # programme contents
+NEWS_TITLES = ('Le journal', 'Journal de 20h', 'Météo', 'Le 12:45')
+SERIES_TITLES = (
+    'Les Enquêtes du commissaire', 'Plus belle la vie', 'Un village français',
+    'Capitaine Marleau', 'Les Experts', 'Hôpital central', 'Fais pas ça',
+    'Le Bureau des légendes', 'Scènes de ménages', 'Mère et fille'
+)
+FILM_WORDS = (
+    ('Le', 'La', 'Les', "L'", 'Un', 'Une'),
+    (
+        'secret', 'voyage', 'été', 'mémoire', 'forêt', 'île', 'chemin',
+        'cœur', 'fleuve', 'étoile', 'hiver', 'héritage', 'ombre'
+    ),
+    (
+        'perdu', 'oublié', 'des Alpes', 'du Nord', 'de minuit',
+        'du bout du monde', 'éternel', 'sauvage', 'de Genève'
+    )
+)
+DOCUMENTARY_TITLES = (
+    'Invitation au voyage', "L'Europe des merveilles", 'Le dessous des images',
+    'nano', 'Des trains pas comme les autres', 'Faut pas rêver', 'Thalassa',
+    'Échappées belles', 'Silence, ça pousse !', "C'est pas sorcier"
+)
+DESCRIPTION_WORDS = (
+    'une', 'enquête', 'au', 'cœur', 'de', 'la', 'ville', 'où', 'les',
+    'habitants', 'découvrent', 'un', 'secret', 'bien', 'gardé', 'depuis',
+    'des', 'années', 'pendant', 'que', 'son', 'équipe', 'à', 'travers',
+    'montagnes', 'rivières', 'et', 'villages', 'histoire', 'famille',
+    'été', 'hiver', 'rencontre', 'portrait', 'réalisateur', 'témoignages'
+)
+                                                            # programme schedule
+NEWS_HOURS = (7, 12.75, 20)
+PRIME_TIME_HOUR = 21
+SERIES_DURATIONS = (26, 45, 52)
+DOCUMENTARY_DURATIONS = (13, 26, 52, 90)
+FILM_DURATIONS = (90, 100, 110, 125)
+                                                       # transport stream layout
+PAT_PID = 0x00
+PMT_TABLE_ID = 0x02
+PAT_TABLE_ID = 0x00
+SDT_TABLE_ID = eit.SDT_ACTUAL
+EIT_TABLE_ID = eit.EIT_SCHEDULE_ACTUAL[0]
+TRANSPORT_STREAM_ID = 1
+ORIGINAL_NETWORK_ID = 0x20FA
+SEGMENT_HOURS = 3
+SEGMENTS_PER_TABLE = 32
+EIT_SECTION_SIZE = 4000
+TABLES_PERIOD = 2000
+EIT_REPEATS = 2
+TEXT_SIZE = 240
+UTF_8_TABLE = b'\x15'
+MEGABYTE = 1024 * 1024
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Channel names, the known ones first
+#
+def channel_names(count) :
+    names = list(KNOWN_CHANNELS[:count])
+    for index in range(len(names), count) :
+        names.append("Chaîne %d" % (index + 1))
+
+    return(names)
+
+#-------------------------------------------------------------------------------
+# Service id of a channel
+#
+def service_id(channel_index) :
+    return(0x101 + channel_index)
+
+#-------------------------------------------------------------------------------
+# Channels of a multiplex
+#
+def multiplex_channels(channels, multiplex_index) :
+    first = multiplex_index * SERVICES_PER_MULTIPLEX
+
+    return(channels[first:first + SERVICES_PER_MULTIPLEX])
+
+#-------------------------------------------------------------------------------
+# XMLTV time string of a datetime
+#
+def to_xmltv_time(datetime_object) :
+    return(datetime_object.strftime('%Y%m%d%H%M%S %z'))
+
+#-------------------------------------------------------------------------------
+# Random text of a number of words
+#
+def random_text(generator, word_count) :
+    text = ' '.join(
+        generator.choice(DESCRIPTION_WORDS) for index in range(word_count)
+    )
+
+    return(text[0].upper() + text[1:] + '.')
+
+#-------------------------------------------------------------------------------
+# Random programme content for a start time
+#
+# Returns the title, the duration in minutes and the optional sub-title
+# and episode number.
+#
+def programme_content(generator, start) :
+    hour = start.hour + start.minute / 60
+                                                           # news at fixed hours
+    for news_hour in NEWS_HOURS :
+        if news_hour <= hour < news_hour + 0.25 :
+            return((generator.choice(NEWS_TITLES), 30, None, None))
+                                                               # prime time film
+    if PRIME_TIME_HOUR <= hour < PRIME_TIME_HOUR + 0.5 :
+        title = ' '.join(generator.choice(words) for words in FILM_WORDS)
+        title = title.replace("L' ", "L'")
+        return((title, generator.choice(FILM_DURATIONS), None, None))
+                                                      # series and documentaries
+    if generator.random() < 0.5 :
+        season = generator.randint(1, 12)
+        episode = generator.randint(1, 24)
+        return((
+            generator.choice(SERIES_TITLES),
+            generator.choice(SERIES_DURATIONS),
+            random_text(generator, generator.randint(2, 5))[:-1],
+            "%d.%d." % (season - 1, episode - 1)
+        ))
+
+    return((
+        generator.choice(DOCUMENTARY_TITLES),
+        generator.choice(DOCUMENTARY_DURATIONS), None, None
+    ))
+
+# ==============================================================================
+# EPG files
+#
+
+#-------------------------------------------------------------------------------
+# Programmes of a channel
+#
+# The programmes follow each other without gap from the start time, and
+# have the shape of the xmltodict-parsed XMLTV programmes.
+#
+def channel_programmes(generator, channel_name, start, days) :
+    programmes = []
+    stop_time = start + datetime.timedelta(days=days)
+    programme_start = start
+    while programme_start < stop_time :
+        (title, duration, sub_title, episode) = programme_content(
+            generator, programme_start
+        )
+        programme_stop = programme_start + datetime.timedelta(minutes=duration)
+        programme = {
+            '@start' : to_xmltv_time(programme_start),
+            '@stop' : to_xmltv_time(programme_stop),
+            '@channel' : channel_name.replace(' ', '_'),
+            'title' : {'@lang' : LANGUAGE, '#text' : title}
+        }
+        if sub_title is not None :
+            programme['sub-title'] = {'@lang' : LANGUAGE, '#text' : sub_title}
+        programme['desc'] = {
+            '@lang' : LANGUAGE,
+            '#text' : random_text(generator, generator.randint(10, 60))
+        }
+        if episode is not None :
+            programme['episode-num'] = {
+                '@system' : 'xmltv_ns', '#text' : episode
+            }
+        programmes.append(programme)
+        programme_start = programme_stop
+
+    return(programmes)
+
+#-------------------------------------------------------------------------------
+# Write an XMLTV file
+#
+def write_epg_file(file_spec, programmes) :
+    with open(file_spec, 'w') as epg_file :
+        epg_file.write(EPG_HEADER)
+        for programme in programmes :
+            epg_file.write(xmltodict.unparse(
+                {'programme' : programme},
+                full_document=False, pretty=True, depth=1
+            ))
+        epg_file.write(EPG_FOOTER)
+
+#-------------------------------------------------------------------------------
+# Write the DVB channels list
+#
+def write_channels_list(file_spec, channels) :
+    with open(file_spec, 'w') as channels_file :
+        for (channel_index, channel_name) in enumerate(channels) :
+            multiplex_index = channel_index // SERVICES_PER_MULTIPLEX
+            pmt_pid = 0x100 * (channel_index % SERVICES_PER_MULTIPLEX + 1)
+            channels_file.write("[%s]\n" % channel_name)
+            for (key, value) in (
+                ('SERVICE_ID', service_id(channel_index)),
+                ('VIDEO_PID', pmt_pid + 1),
+                ('AUDIO_PID', pmt_pid + 2),
+                ('FREQUENCY', FIRST_FREQUENCY + multiplex_index*FREQUENCY_STEP),
+                ('DELIVERY_SYSTEM', 'DVBT'),
+                ('BANDWIDTH_HZ', 8000000)
+            ) :
+                channels_file.write("\t%s = %s\n" % (key, value))
+            channels_file.write("\n")
+
+# ==============================================================================
+# Rules and schedule
+#
+
+#-------------------------------------------------------------------------------
+# Write a rule set
+#
+# Most rules are made of words which are seldom or never found, as on a
+# box with many wishes, and a few match the generated titles.
+#
+def write_rule_set(file_spec, generator, count, channels) :
+    titles = list(NEWS_TITLES + SERIES_TITLES + DOCUMENTARY_TITLES)
+    rules = []
+    for rule_index in range(count) :
+        rule = {}
+        if generator.random() < 0.3 :
+            rule['channel'] = {'@name' : generator.choice(channels)}
+        kind = generator.random()
+        if generator.random() < 0.05 :
+            title = generator.choice(titles)
+            word = max(title.split(), key=len)
+        else :
+            title = "%s %d" % (generator.choice(DESCRIPTION_WORDS), rule_index)
+            word = title
+        if kind < 0.4 :
+            rule['title'] = {'@is' : title}
+        elif kind < 0.8 :
+            rule['title'] = {'@contains' : word}
+            if generator.random() < 0.5 :
+                rule['title']['@fold'] = 'yes'
+        else :
+            rule['title'] = {'@matches' : "^%s\\b" % re.escape(title)}
+        if generator.random() < 0.2 :
+            rule['time'] = {'@from' : '18:00', '@to' : '23:30'}
+        if generator.random() < 0.1 :
+            rule['days'] = {'@is' : 'sat,sun'}
+        if generator.random() < 0.1 :
+            rule['@priority'] = str(generator.randint(1, 5))
+        rules.append(rule)
+    with open(file_spec, 'w') as rules_file :
+        rules_file.write(xmltodict.unparse(
+            {'ruleSet' : {'rule' : rules}}, pretty=True
+        ))
+        rules_file.write("\n")
+
+#-------------------------------------------------------------------------------
+# Write a schedule of past recordings
+#
+# The recordings control script removes them one by one as overrun, which
+# measures its schedule reload loop.
+#
+def write_schedule(file_spec, count, channels, now) :
+    recordings = []
+    start = now - datetime.timedelta(days=2)
+    for index in range(count) :
+        recording_start = start + datetime.timedelta(minutes=index)
+        recordings.append({
+            'start' : to_xmltv_time(recording_start),
+            'stop' : to_xmltv_time(
+                recording_start + datetime.timedelta(minutes=30)
+            ),
+            'channel' : channels[index % len(channels)],
+            'title' : "Enregistrement %d" % index,
+            'tuner' : str(index % 2)
+        })
+    with open(file_spec, 'w') as schedule_file :
+        schedule_file.write(xmltodict.unparse(
+            {'schedule' : {'recording' : recordings}}, pretty=True
+        ))
+        schedule_file.write("\n")
+
+# ==============================================================================
+# Transport stream
+#
+
+#-------------------------------------------------------------------------------
+# Long form PSI/SI section
+#
+def build_section(
+    table_id, extension, section_number, last_section_number, body, version=0
+) :
+    header = struct.pack(
+        '>HBBB', extension, 0xC1 | (version << 1),
+        section_number, last_section_number
+    )
+    length = len(header) + len(body) + 4
+    section = struct.pack('>BH', table_id, 0xB000 | length) + header + body
+
+    return(section + struct.pack('>I', eit.crc32_mpeg(section)))
+
+#-------------------------------------------------------------------------------
+# DVB text in UTF-8, cut to a maximal size
+#
+def dvb_text(text, size=TEXT_SIZE) :
+    data = text.encode('utf-8')[:size]
+
+    return(UTF_8_TABLE + data.decode('utf-8', errors='ignore').encode('utf-8'))
+
+#-------------------------------------------------------------------------------
+# Descriptor
+#
+def descriptor(tag, data) :
+    return(bytes([tag, len(data)]) + data)
+
+#-------------------------------------------------------------------------------
+# Binary coded decimal byte
+#
+def bcd(value) :
+    return(((value // 10) << 4) | (value % 10))
+
+#-------------------------------------------------------------------------------
+# EIT event loop entry of a programme
+#
+def eit_event(event_id, programme) :
+    start = datetime.datetime.strptime(
+        programme['@start'], '%Y%m%d%H%M%S %z'
+    ).astimezone(datetime.timezone.utc)
+    stop = datetime.datetime.strptime(programme['@stop'], '%Y%m%d%H%M%S %z')
+    duration = int((stop - start).total_seconds())
+    mjd = (start.date() - eit.MJD_EPOCH).days
+                                                 # title, sub-title, description
+    title = dvb_text(programme['title']['#text'], TEXT_SIZE // 2)
+    short_text = b''
+    if 'sub-title' in programme :
+        short_text = dvb_text(
+            programme['sub-title']['#text'], TEXT_SIZE // 2
+        )
+    loop = descriptor(
+        eit.SHORT_EVENT_DESCRIPTOR,
+        EIT_LANGUAGE + bytes([len(title)]) + title +
+            bytes([len(short_text)]) + short_text
+    )
+    description = dvb_text(programme['desc']['#text'])
+    loop += descriptor(
+        eit.EXTENDED_EVENT_DESCRIPTOR,
+        b'\x00' + EIT_LANGUAGE + b'\x00' +
+            bytes([len(description)]) + description
+    )
+
+    return(
+        struct.pack('>HH', event_id, mjd) +
+        bytes([bcd(start.hour), bcd(start.minute), bcd(start.second)]) +
+        bytes([
+            bcd(duration // 3600), bcd(duration // 60 % 60),
+            bcd(duration % 60)
+        ]) +
+        struct.pack('>H', 0x8000 | len(loop)) + loop
+    )
+
+#-------------------------------------------------------------------------------
+# EIT schedule sections of a service
+#
+# Every 3 hour segment gets its sections, empty or not, so that the tables
+# are complete. A table covers 4 days.
+#
+def eit_sections(service, programmes, start, days) :
+    utc_start = start.astimezone(datetime.timezone.utc).replace(
+        hour=0, minute=0, second=0
+    )
+    segment_count = (days + 1) * 24 // SEGMENT_HOURS
+    table_count = (segment_count - 1) // SEGMENTS_PER_TABLE + 1
+    segments = [[] for segment in range(segment_count)]
+    for (event_id, programme) in enumerate(programmes) :
+        programme_start = datetime.datetime.strptime(
+            programme['@start'], '%Y%m%d%H%M%S %z'
+        )
+        hours = (programme_start - utc_start).total_seconds() / 3600
+        segment = int(hours // SEGMENT_HOURS)
+        if 0 <= segment < segment_count :
+            segments[segment].append(eit_event(event_id, programme))
+                                               # split full segments in sections
+    sections = []
+    for table in range(table_count) :
+        table_segments = segments[
+            table * SEGMENTS_PER_TABLE:(table + 1) * SEGMENTS_PER_TABLE
+        ]
+        last_section_number = (len(table_segments) - 1) * 8
+        segment_sections = []
+        for (segment, events) in enumerate(table_segments) :
+            bodies = [b'']
+            for event in events :
+                if len(bodies[-1]) + len(event) > EIT_SECTION_SIZE :
+                    bodies.append(b'')
+                bodies[-1] += event
+            segment_sections.append(bodies[:8])
+        last_section_number += len(segment_sections[-1]) - 1
+        for (segment, bodies) in enumerate(segment_sections) :
+            segment_last = segment * 8 + len(bodies) - 1
+            for (index, body) in enumerate(bodies) :
+                sections.append(build_section(
+                    EIT_TABLE_ID + table, service, segment * 8 + index,
+                    last_section_number,
+                    struct.pack(
+                        '>HHBB', TRANSPORT_STREAM_ID, ORIGINAL_NETWORK_ID,
+                        segment_last, EIT_TABLE_ID + table_count - 1
+                    ) + body
+                ))
+
+    return(sections)
+
+#-------------------------------------------------------------------------------
+# SDT section of the services of a multiplex
+#
+def sdt_section(services) :
+    body = struct.pack('>HB', ORIGINAL_NETWORK_ID, 0xFF)
+    for (service, channel_name) in services :
+        name = dvb_text(channel_name)
+        loop = descriptor(
+            eit.SERVICE_DESCRIPTOR,
+            b'\x01' + bytes([len(b'benchmark')]) + b'benchmark' +
+                bytes([len(name)]) + name
+        )
+        body += struct.pack('>HBH', service, 0xFC, 0x8000 | len(loop)) + loop
+
+    return(build_section(SDT_TABLE_ID, TRANSPORT_STREAM_ID, 0, 0, body))
+
+#-------------------------------------------------------------------------------
+# PAT and PMT sections of the services of a multiplex
+#
+def program_sections(services) :
+    pat_body = b''
+    pmts = []
+    for (index, (service, channel_name)) in enumerate(services) :
+        pmt_pid = 0x100 * (index + 1)
+        pat_body += struct.pack('>HH', service, 0xE000 | pmt_pid)
+        pmt_body = struct.pack('>HH', 0xE000 | pmt_pid + 1, 0xF000)
+        for (stream_type, pid) in ((0x1B, pmt_pid + 1), (0x03, pmt_pid + 2)) :
+            pmt_body += bytes([stream_type]) + struct.pack(
+                '>HH', 0xE000 | pid, 0xF000
+            )
+        pmts.append((pmt_pid, build_section(
+            PMT_TABLE_ID, service, 0, 0, pmt_body
+        )))
+    pat = build_section(PAT_TABLE_ID, TRANSPORT_STREAM_ID, 0, 0, pat_body)
+
+    return([(PAT_PID, pat)] + pmts)
+
+#-------------------------------------------------------------------------------
+# Payloads of the packets carrying a section
+#
+def section_payloads(section) :
+    data = b'\x00' + section
+    payloads = []
+    for offset in range(0, len(data), eit.TS_PACKET_SIZE - 4) :
+        payload = data[offset:offset + eit.TS_PACKET_SIZE - 4]
+        payloads.append((
+            offset == 0,
+            payload + b'\xFF' * (eit.TS_PACKET_SIZE - 4 - len(payload))
+        ))
+
+    return(payloads)
+
+#-------------------------------------------------------------------------------
+# Write the transport stream of a multiplex
+#
+# The elementary streams of the services are interleaved with the program
+# tables, repeated regularly, and with the EIT schedule, sent EIT_REPEATS
+# times over the stream as the broadcasters do. Returns the numbers of
+# packets and of EIT sections.
+#
+def write_transport_stream(file_spec, services, service_programmes, size) :
+    packet_count = max(int(size // eit.TS_PACKET_SIZE), 1)
+    tables = []
+    for (pid, section) in program_sections(services) + [
+        (eit.SDT_PID, sdt_section(services))
+    ] :
+        tables += [(pid, payload) for payload in section_payloads(section)]
+    eit_packets = []
+    section_count = 0
+    for sections in service_programmes :
+        for section in sections :
+            eit_packets += [
+                (eit.EIT_PID, payload) for payload in section_payloads(section)
+            ]
+            section_count += 1
+    eit_packets *= EIT_REPEATS
+    eit_period = max(packet_count // max(len(eit_packets), 1), 1)
+                                                   # elementary streams payloads
+    elementary_pids = []
+    for (index, service) in enumerate(services) :
+        pmt_pid = 0x100 * (index + 1)
+        elementary_pids += [pmt_pid + 1, pmt_pid + 1, pmt_pid + 1, pmt_pid + 2]
+    elementary_payload = bytes(range(184))
+    continuity = {}
+    def packet(pid, payload, unit_start=False) :
+        counter = continuity.get(pid, -1) + 1 & 0x0F
+        continuity[pid] = counter
+        return(bytes([
+            eit.TS_SYNC_BYTE, (0x40 if unit_start else 0) | (pid >> 8),
+            pid & 0xFF, 0x10 | counter
+        ]) + payload)
+                                                         # write by large blocks
+    with open(file_spec, 'wb') as ts_file :
+        block = bytearray()
+        eit_index = 0
+        elementary_index = 0
+        for packet_index in range(packet_count) :
+            if packet_index % TABLES_PERIOD < len(tables) :
+                (pid, (unit_start, payload)) = \
+                    tables[packet_index % TABLES_PERIOD]
+                block += packet(pid, payload, unit_start)
+            elif packet_index % eit_period == 0 and \
+                eit_index < len(eit_packets) :
+                (pid, (unit_start, payload)) = eit_packets[eit_index]
+                block += packet(pid, payload, unit_start)
+                eit_index += 1
+            else :
+                pid = elementary_pids[elementary_index % len(elementary_pids)]
+                block += packet(pid, elementary_payload)
+                elementary_index += 1
+            if len(block) >= MEGABYTE :
+                ts_file.write(block)
+                block = bytearray()
+        ts_file.write(block)
+
+    return((packet_count, section_count))
+
+# ==============================================================================
+# Data set
+#
+
+#-------------------------------------------------------------------------------
+# Generate the whole data set in a directory
+#
+# Returns the description of the data set, with the file specs and the
+# sizes used to compute the throughputs.
+#
+def generate(
+    directory, channel_count=30, days=7, rule_count=500, ts_size=64,
+    schedule_count=200, seed=1, verbose=False
+) :
+    generator = random.Random(seed)
+    now = datetime.datetime.now().astimezone()
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    epg_directory = os.sep.join([directory, 'www'])
+    os.makedirs(epg_directory, exist_ok=True)
+    for file_name in os.listdir(epg_directory) :
+        os.remove(os.sep.join([epg_directory, file_name]))
+    channels = channel_names(channel_count)
+    data = {
+        'directory' : directory,
+        'epg directory' : epg_directory,
+        'channels file' : os.sep.join([epg_directory, CHANNELS_FILE_NAME]),
+        'grab file' : os.sep.join([directory, GRAB_FILE_NAME]),
+        'rules file' : os.sep.join([directory, RULES_FILE_NAME]),
+        'schedule file' : os.sep.join([directory, SCHEDULE_FILE_NAME]),
+        'ts file' : os.sep.join([directory, TS_FILE_NAME]),
+        'channels' : channels,
+        'start' : start.strftime('%Y%m%d%H%M'),
+        'stop' : (start + datetime.timedelta(days=days)).strftime(
+            '%Y%m%d%H%M'
+        ),
+        'days' : days,
+        'rules' : rule_count,
+        'recordings' : schedule_count
+    }
+    write_channels_list(data['channels file'], channels)
+                                                   # EPG files and epgrab output
+    programme_count = 0
+    multiplex_sections = []
+    with open(data['grab file'], 'w') as grab_file :
+        grab_file.write(EPG_HEADER)
+        for (channel_index, channel_name) in enumerate(channels) :
+            programmes = channel_programmes(
+                generator, channel_name, start, days
+            )
+            programme_count += len(programmes)
+            write_epg_file(
+                os.sep.join([
+                    epg_directory, channel_name.replace(' ', '_') + '.xml'
+                ]), programmes
+            )
+            if channel_index < SERVICES_PER_MULTIPLEX :
+                multiplex_sections.append(eit_sections(
+                    service_id(channel_index), programmes, start, days
+                ))
+            for programme in programmes :
+                programme = dict(programme)
+                programme['@channel'] = "%d.dvb.guide" % service_id(
+                    channel_index
+                )
+                grab_file.write(xmltodict.unparse(
+                    {'programme' : programme},
+                    full_document=False, pretty=True, depth=1
+                ))
+        grab_file.write(EPG_FOOTER)
+    data['programmes'] = programme_count
+    if verbose :
+        print(INDENT + "%d channels, %d programmes over %d days" % (
+            channel_count, programme_count, days
+        ))
+                                                            # rules and schedule
+    write_rule_set(data['rules file'], generator, rule_count, channels)
+    write_schedule(data['schedule file'], schedule_count, channels, now)
+                                                              # transport stream
+    services = [
+        (service_id(index), channel_name) for (index, channel_name) in
+            enumerate(multiplex_channels(channels, 0))
+    ]
+    (packet_count, section_count) = write_transport_stream(
+        data['ts file'], services, multiplex_sections, ts_size * MEGABYTE
+    )
+    data['services'] = [service for (service, channel_name) in services]
+    data['ts size'] = packet_count * eit.TS_PACKET_SIZE
+    if verbose :
+        print(INDENT + "%d rules, %d past recordings" % (
+            rule_count, schedule_count
+        ))
+        print(INDENT + "%.1f MB transport stream, %d services, " % (
+            data['ts size'] / MEGABYTE, len(services)
+        ) + "%d EIT sections" % section_count)
+
+    return(data)
+
+# ==============================================================================
+# main script
+#
+if __name__ == '__main__' :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='generate synthetic EPG, rules and transport streams'
+    )
+    parser.add_argument(
+        '-o', '--output', default='/tmp/rpi-tv-box-benchmark',
+        help = 'the output directory'
+    )
+    parser.add_argument(
+        '-c', '--channels', default=30,
+        help = 'the number of channels'
+    )
+    parser.add_argument(
+        '-D', '--days', default=7,
+        help = 'the number of days of programmes'
+    )
+    parser.add_argument(
+        '-r', '--rules', default=500,
+        help = 'the number of rules'
+    )
+    parser.add_argument(
+        '-k', '--recordings', default=200,
+        help = 'the number of past recordings in the schedule'
+    )
+    parser.add_argument(
+        '-s', '--size', default=64,
+        help = 'the transport stream size in MB'
+    )
+    parser.add_argument(
+        '-S', '--seed', default=1,
+        help = 'the random generator seed'
+    )
+    parser_arguments = parser.parse_args()
+                                                                      # generate
+    print("Generating data in \"%s\"" % parser_arguments.output)
+    generate(
+        parser_arguments.output, int(parser_arguments.channels),
+        int(parser_arguments.days), int(parser_arguments.rules),
+        float(parser_arguments.size), int(parser_arguments.recordings),
+        int(parser_arguments.seed), verbose=True
+    )
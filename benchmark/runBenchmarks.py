@@ -0,0 +1,407 @@
+#!/usr/bin/python3
+#
+# Benchmarks of the processing stages
+#
+# Generates a synthetic data set and runs every stage on it as the box
+# does: the scripts are started as separate processes, and each run is
+# measured for its wall time, its peak memory and its throughput.
+#
+# The results can be saved as the baseline of a box, and later runs are
+# compared to it: a stage slower or larger than the baseline by more than
+# the tolerance is reported as a regression, and the script then ends with
+# an error code. This allows to check a new software version or a system
+# upgrade before installing it on the box.
+#
+import argparse
+import os
+import sys
+import json
+import shutil
+import subprocess
+import time
+import generateData
+
+# ------------------------------------------------------------------------------
+# constants
+#
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+EPG_DIR = os.path.join(SCRIPT_DIR, '..', 'epg')
+RECORDING_DIR = os.path.join(SCRIPT_DIR, '..', 'recording')
+BASELINE_FILE_NAME = 'baseline.json'
+GRABBER_COMMAND = 'epgrab'
+SEARCH_QUERY = 'enquete commissaire'
+TIME_TOLERANCE = 25
+MEMORY_TOLERANCE = 10
+MEGABYTE = 1024 * 1024
+STAGES = (
+    'grab', 'demux', 'index', 'schedule', 'display', 'grid', 'search',
+    'reload', 'split', 'record'
+)
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Write the replay grabber
+#
+# The grabber stands for epgrab and writes the generated all-channels guide,
+# so that the demultiplexing of epg-grab.py can be measured without tuner.
+#
+def write_replay_grabber(bin_directory, grab_file_spec) :
+    os.makedirs(bin_directory, exist_ok=True)
+    grabber_spec = os.sep.join([bin_directory, GRABBER_COMMAND])
+    with open(grabber_spec, 'w') as grabber_file :
+        grabber_file.write("#!/bin/sh\nexec cat \"%s\"\n" % grab_file_spec)
+    os.chmod(grabber_spec, 0o755)
+
+#-------------------------------------------------------------------------------
+# Empty a working directory
+#
+def clean_directory(directory) :
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+#-------------------------------------------------------------------------------
+# Stage commands
+#
+# Returns, per stage, the command, the amount of work and its unit for the
+# throughput, and a preparation function run before every measure.
+#
+def stage_commands(data) :
+    directory = data['directory']
+    epg_directory = data['epg directory']
+    channels_file_spec = data['channels file']
+    grab_directory = os.sep.join([directory, 'grab'])
+    recordings_directory = os.sep.join([directory, 'recordings'])
+    index_file_spec = os.sep.join([directory, 'epg-index.sqlite'])
+    schedule_file_spec = os.sep.join([directory, 'reload-schedule.xml'])
+    ts_megabytes = data['ts size'] / MEGABYTE
+    first_channel = data['channels'][0].replace(' ', '_')
+    channel_programmes = data['programmes'] // len(data['channels'])
+    grab_options = [
+        '-d', grab_directory, '-c', channels_file_spec, '-a', '0',
+        '-o', os.sep.join([grab_directory, 'epg.xml']),
+        '-l', os.sep.join([grab_directory, 'epg-grab.log'])
+    ]
+    def remove_index() :
+        if os.path.exists(index_file_spec) :
+            os.remove(index_file_spec)
+    def copy_schedule() :
+        clean_directory(recordings_directory)
+        shutil.copyfile(data['schedule file'], schedule_file_spec)
+    return({
+        'grab' : (
+            [
+                sys.executable, os.sep.join([EPG_DIR, 'epg-grab.py']),
+                first_channel, '-n', '-D', data['ts file'],
+                '-t', '3600', '-s', '3600'
+            ] + grab_options,
+            ts_megabytes, 'MB', lambda : clean_directory(grab_directory)
+        ),
+        'demux' : (
+            [
+                sys.executable, os.sep.join([EPG_DIR, 'epg-grab.py']),
+                first_channel, '-D', data['grab file']
+            ] + grab_options,
+            data['programmes'], 'programmes',
+            lambda : clean_directory(grab_directory)
+        ),
+        'index' : (
+            [
+                sys.executable, os.sep.join([EPG_DIR, 'epgIndex.py']),
+                '-d', epg_directory, '-i', index_file_spec
+            ],
+            data['programmes'], 'programmes', remove_index
+        ),
+        'schedule' : (
+            [
+                sys.executable,
+                os.sep.join([RECORDING_DIR, 'buildSchedule.py']),
+                os.path.relpath(data['rules file'], RECORDING_DIR),
+                '-d', epg_directory, '-c', channels_file_spec,
+                '-i', index_file_spec, '-r', recordings_directory,
+                '-l', os.sep.join([directory, 'built-schedule.xml']),
+                '-s'
+            ],
+            data['programmes'], 'programmes',
+            lambda : clean_directory(recordings_directory)
+        ),
+        'display' : (
+            [
+                sys.executable, os.sep.join([EPG_DIR, 'epg-display.py']),
+                first_channel, '-d', epg_directory, '-i', index_file_spec,
+                '--from', data['start'], '--to', data['stop'], '-f', 'tsv'
+            ],
+            channel_programmes, 'programmes', None
+        ),
+        'grid' : (
+            [
+                sys.executable, os.sep.join([EPG_DIR, 'epg-display.py']),
+                '-g', '-d', epg_directory,
+                '--from', data['start'], '--to', data['stop'], '-f', 'tsv'
+            ],
+            data['programmes'], 'programmes', None
+        ),
+        'search' : (
+            [
+                sys.executable, os.sep.join([EPG_DIR, 'epg-display.py']),
+                '-q', SEARCH_QUERY, '-d', epg_directory,
+                '-i', index_file_spec, '--from', data['start']
+            ],
+            data['programmes'], 'programmes', None
+        ),
+        'reload' : (
+            [
+                sys.executable,
+                os.sep.join([RECORDING_DIR, 'recordProgrammes.py']),
+                '-e', epg_directory, '-l', schedule_file_spec,
+                '-d', recordings_directory, '-c', channels_file_spec,
+                '-q', os.sep.join([directory, 'post-processing.json'])
+            ],
+            data['recordings'], 'recordings', copy_schedule
+        ),
+        'split' : (
+            [
+                sys.executable, os.sep.join([RECORDING_DIR, 'tsSplitter.py']),
+                data['ts file']
+            ] + [
+                "-s%d:%s" % (service, os.sep.join([
+                    recordings_directory, "service-%d.ts" % service
+                ])) for service in data['services']
+            ],
+            ts_megabytes, 'MB', lambda : clean_directory(recordings_directory)
+        ),
+        'record' : (
+            [
+                sys.executable, os.sep.join([RECORDING_DIR, 'tsRecorder.py']),
+                data['ts file'],
+                '-o', os.sep.join([recordings_directory, 'recording.ts'])
+            ],
+            ts_megabytes, 'MB', lambda : clean_directory(recordings_directory)
+        )
+    })
+
+#-------------------------------------------------------------------------------
+# Run a command and measure it
+#
+# The peak memory is the maximal resident size of the process, as given
+# by the kernel when it ends.
+#
+def measure(command, log_file, environment) :
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, stdin=subprocess.DEVNULL, stdout=log_file,
+        stderr=subprocess.STDOUT, env=environment
+    )
+    (pid, status, usage) = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    return((process.returncode, wall_time, usage.ru_maxrss * 1024))
+
+#-------------------------------------------------------------------------------
+# Run a stage, keeping the fastest of its runs
+#
+def run_stage(name, stage, runs, log_file, environment) :
+    (command, amount, unit, prepare) = stage
+    best = None
+    for run in range(runs) :
+        if prepare is not None :
+            prepare()
+        log_file.write("\n%s\n%s\n" % (name, ' '.join(command)))
+        log_file.flush()
+        (return_code, wall_time, peak_memory) = measure(
+            command, log_file, environment
+        )
+        if return_code != 0 :
+            return({'error' : return_code})
+        if best is None or wall_time < best['seconds'] :
+            best = {
+                'seconds' : round(wall_time, 3),
+                'memory' : round(peak_memory / MEGABYTE, 1),
+                'throughput' : round(amount / max(wall_time, 1E-6), 1),
+                'unit' : "%s/s" % unit
+            }
+        else :
+            best['memory'] = max(
+                best['memory'], round(peak_memory / MEGABYTE, 1)
+            )
+
+    return(best)
+
+#-------------------------------------------------------------------------------
+# Regressions of the results with respect to a baseline
+#
+def regressions(results, baseline, time_tolerance, memory_tolerance) :
+    found = []
+    for (name, result) in results.items() :
+        reference = baseline.get(name)
+        if reference is None or 'error' in reference :
+            continue
+        if 'error' in result :
+            found.append("%s failed with code %d" % (name, result['error']))
+            continue
+        for (key, tolerance, unit) in (
+            ('seconds', time_tolerance, 'sec'),
+            ('memory', memory_tolerance, 'MB')
+        ) :
+            limit = reference[key] * (1 + tolerance / 100)
+            if result[key] > limit :
+                found.append("%s : %g %s instead of %g %s (+%d%%)" % (
+                    name, result[key], unit, reference[key], unit,
+                    round(100 * (result[key] / reference[key] - 1))
+                ))
+
+    return(found)
+
+# ==============================================================================
+# main script
+#
+if __name__ == '__main__' :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='benchmark the processing stages on synthetic data'
+    )
+    parser.add_argument(
+        'stages', nargs='*', default=[],
+        help = "the stages to run, among %s (default: all)" % ', '.join(STAGES)
+    )
+    parser.add_argument(
+        '-d', '--dir', default='/tmp/rpi-tv-box-benchmark',
+        help = 'the working directory'
+    )
+    parser.add_argument(
+        '-c', '--channels', default=30,
+        help = 'the number of channels'
+    )
+    parser.add_argument(
+        '-D', '--days', default=7,
+        help = 'the number of days of programmes'
+    )
+    parser.add_argument(
+        '-r', '--rules', default=500,
+        help = 'the number of rules'
+    )
+    parser.add_argument(
+        '-k', '--recordings', default=200,
+        help = 'the number of past recordings in the schedule'
+    )
+    parser.add_argument(
+        '-s', '--size', default=64,
+        help = 'the transport stream size in MB'
+    )
+    parser.add_argument(
+        '-n', '--runs', default=3,
+        help = 'the number of runs per stage, the fastest one being kept'
+    )
+    parser.add_argument(
+        '-b', '--baseline', default=os.sep.join([
+            SCRIPT_DIR, BASELINE_FILE_NAME
+        ]),
+        help = 'the baseline results file'
+    )
+    parser.add_argument(
+        '-w', '--write', action='store_true', dest='write',
+        help = 'save the results as the new baseline'
+    )
+    parser.add_argument(
+        '-t', '--tolerance', default=TIME_TOLERANCE,
+        help = 'the allowed slowdown in percent'
+    )
+    parser.add_argument(
+        '-m', '--memory', default=MEMORY_TOLERANCE,
+        help = 'the allowed memory increase in percent'
+    )
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
+    )
+    parser_arguments = parser.parse_args()
+    directory = parser_arguments.dir
+    stage_names = parser_arguments.stages or list(STAGES)
+    for name in stage_names :
+        if name not in STAGES :
+            parser.error("unknown stage \"%s\"" % name)
+    verbose = parser_arguments.verbose
+    parameters = {
+        'channels' : int(parser_arguments.channels),
+        'days' : int(parser_arguments.days),
+        'rules' : int(parser_arguments.rules),
+        'recordings' : int(parser_arguments.recordings),
+        'size' : float(parser_arguments.size)
+    }
+                                                                 # generate data
+    print("Generating data in \"%s\"" % directory)
+    start = time.perf_counter()
+    data = generateData.generate(
+        directory, parameters['channels'], parameters['days'],
+        parameters['rules'], parameters['size'], parameters['recordings'],
+        verbose=verbose
+    )
+    print(INDENT + "done in %.1f sec" % (time.perf_counter() - start))
+    stages = stage_commands(data)
+    environment = dict(os.environ)
+    environment['PATH'] = os.pathsep.join(
+        [os.sep.join([directory, 'bin']), environment.get('PATH', '')]
+    )
+    write_replay_grabber(os.sep.join([directory, 'bin']), data['grab file'])
+                                                                    # run stages
+    print()
+    print("%-10s %10s %10s %24s" % ('stage', 'time', 'memory', 'throughput'))
+    results = {}
+    log_file_spec = os.sep.join([directory, 'benchmark.log'])
+    with open(log_file_spec, 'w') as log_file :
+        for name in stage_names :
+            result = run_stage(
+                name, stages[name], int(parser_arguments.runs),
+                log_file, environment
+            )
+            results[name] = result
+            if 'error' in result :
+                print("%-10s failed with code %d, see %s" % (
+                    name, result['error'], log_file_spec
+                ))
+                continue
+            print("%-10s %6.3f sec %7.1f MB %13.1f %s" % (
+                name, result['seconds'], result['memory'],
+                result['throughput'], result['unit']
+            ))
+                                                         # compare with baseline
+    baseline_file_spec = parser_arguments.baseline
+    return_code = 0
+    if parser_arguments.write :
+        with open(baseline_file_spec, 'w') as baseline_file :
+            json.dump(
+                {'parameters' : parameters, 'results' : results},
+                baseline_file, indent=2
+            )
+            baseline_file.write("\n")
+        print()
+        print("Baseline saved to \"%s\"" % baseline_file_spec)
+    elif os.path.exists(baseline_file_spec) :
+        with open(baseline_file_spec, 'r') as baseline_file :
+            baseline = json.load(baseline_file)
+        print()
+        if baseline['parameters'] != parameters :
+            print("No comparison with a baseline made for %s" % ', '.join(
+                "%s=%g" % item for item in baseline['parameters'].items()
+            ))
+        else :
+            found = regressions(
+                results, baseline['results'],
+                float(parser_arguments.tolerance),
+                float(parser_arguments.memory)
+            )
+            if found :
+                print('Regressions:')
+                for regression in found :
+                    print(INDENT + regression)
+                return_code = 1
+            else :
+                print('No regression')
+    if any('error' in result for result in results.values()) :
+        return_code = 1
+    sys.exit(return_code)
@@ -0,0 +1,764 @@
+#!/usr/bin/python3
+#
+# DVB Event Information Table (EIT) sections
+#
+# Reads EIT sections from a tuner demux or from a recorded transport stream
+# file, tracks which parts of the programme guide have been received and
+# decodes the events into XMLTV programmes.
+#
+import argparse
+import os
+import select
+import struct
+import fcntl
+import time
+import datetime
+import unicodedata
+
+# ------------------------------------------------------------------------------
+# constants
+#
+EIT_PID = 0x12
+SDT_PID = 0x11
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+TS_READ_PACKETS = 1024
+SECTION_MAX_SIZE = 4096
+                                                   # linux/dvb/dmx.h definitions
+DMX_SET_FILTER = 0x403c6f2b
+DMX_STOP = 0x6f2a
+DMX_CHECK_CRC = 1
+DMX_IMMEDIATE_START = 4
+DMX_FILTER_SIZE = 16
+                                                                     # table ids
+EIT_PRESENT_FOLLOWING = (0x4E, 0x4F)
+EIT_SCHEDULE_ACTUAL = range(0x50, 0x60)
+EIT_SCHEDULE_OTHER = range(0x60, 0x70)
+SDT_ACTUAL = 0x42
+SDT_OTHER = 0x46
+SECTIONS_PER_SEGMENT = 8
+                                                                   # descriptors
+SERVICE_DESCRIPTOR = 0x48
+SHORT_EVENT_DESCRIPTOR = 0x4D
+EXTENDED_EVENT_DESCRIPTOR = 0x4E
+RUNNING_STATUS = (
+    'undefined', 'not running', 'starts in a few seconds', 'pausing',
+    'running', 'off-air', 'reserved', 'reserved'
+)
+MJD_EPOCH = datetime.date(1858, 11, 17)
+                                                  # ISO/IEC 6937 character table
+ISO_6937_DIACRITICS = {
+    0xC1 : '\u0300', 0xC2 : '\u0301', 0xC3 : '\u0302', 0xC4 : '\u0303',
+    0xC5 : '\u0304', 0xC6 : '\u0306', 0xC7 : '\u0307', 0xC8 : '\u0308',
+    0xCA : '\u030A', 0xCB : '\u0327', 0xCD : '\u030B', 0xCE : '\u0328',
+    0xCF : '\u030C'
+}
+ISO_6937_CHARACTERS = dict(zip(
+    range(0xA0, 0x100),
+    '\u00A0¡¢£$¥#§¤‘“«←↑→↓°±²³×µ¶·÷’”»¼½¾¿' +
+    16 * '\uFFFD' +
+    '―¹®©™♪¬¦\uFFFD\uFFFD\uFFFD\uFFFD⅛⅜⅝⅞' +
+    'ΩÆĐªĦ\uFFFDĲĿŁØŒºÞŦŊŉ' +
+    'ĸæđðħıĳŀłøœßþŧŋ\u00AD'
+))
+DVB_CHARACTER_TABLES = {
+    0x01 : 'iso-8859-5', 0x02 : 'iso-8859-6', 0x03 : 'iso-8859-7',
+    0x04 : 'iso-8859-8', 0x05 : 'iso-8859-9', 0x06 : 'iso-8859-10',
+    0x07 : 'iso-8859-11', 0x09 : 'iso-8859-13', 0x0A : 'iso-8859-14',
+    0x0B : 'iso-8859-15', 0x11 : 'utf-16-be', 0x15 : 'utf-8'
+}
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# MPEG-2 CRC32 of a section
+#
+def _build_crc_table() :
+    table = []
+    for index in range(256) :
+        crc = index << 24
+        for bit in range(8) :
+            if crc & 0x80000000 :
+                crc = ((crc << 1) ^ 0x04C11DB7) & 0xFFFFFFFF
+            else :
+                crc = (crc << 1) & 0xFFFFFFFF
+        table.append(crc)
+
+    return(table)
+
+CRC_TABLE = _build_crc_table()
+
+def crc32_mpeg(data) :
+    crc = 0xFFFFFFFF
+    for byte in data :
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ CRC_TABLE[(crc >> 24) ^ byte]
+
+    return(crc)
+
+#-------------------------------------------------------------------------------
+# Check if a table id is an EIT
+#
+def is_eit(table_id) :
+    return(0x4E <= table_id <= 0x6F)
+
+#-------------------------------------------------------------------------------
+# Parse the header of an EIT section
+#
+def eit_header(section) :
+    return({
+        'table_id' : section[0],
+        'service_id' : (section[3] << 8) | section[4],
+        'version' : (section[5] >> 1) & 0x1F,
+        'current' : section[5] & 0x01,
+        'section_number' : section[6],
+        'last_section_number' : section[7],
+        'transport_stream_id' : (section[8] << 8) | section[9],
+        'original_network_id' : (section[10] << 8) | section[11],
+        'segment_last_section_number' : section[12],
+        'last_table_id' : section[13]
+    })
+
+#-------------------------------------------------------------------------------
+# Table family : present/following, actual schedule or other schedule
+#
+def table_family(table_id) :
+    if table_id in EIT_PRESENT_FOLLOWING :
+        return(table_id)
+    if table_id in EIT_SCHEDULE_ACTUAL :
+        return(EIT_SCHEDULE_ACTUAL[0])
+
+    return(EIT_SCHEDULE_OTHER[0])
+
+# ==============================================================================
+# Section sources
+#
+
+#-------------------------------------------------------------------------------
+# Reassemble sections from transport stream packets of one PID
+#
+class SectionAssembler :
+
+    def __init__(self, pid=EIT_PID, check_crc=True) :
+        self.pid = pid
+        self.check_crc = check_crc
+        self.buffer = bytearray()
+        self.continuity = None
+        self.crc_errors = 0
+
+    def _complete_sections(self) :
+        sections = []
+        while len(self.buffer) >= 3 :
+                                                     # stuffing ends the payload
+            if self.buffer[0] == 0xFF :
+                self.buffer.clear()
+                break
+            length = 3 + (((self.buffer[1] & 0x0F) << 8) | self.buffer[2])
+            if len(self.buffer) < length :
+                break
+            section = bytes(self.buffer[:length])
+            del self.buffer[:length]
+            if self.check_crc and crc32_mpeg(section) != 0 :
+                self.crc_errors += 1
+            else :
+                sections.append(section)
+
+        return(sections)
+
+    def feed(self, packet) :
+                                                                  # check packet
+        if packet[0] != TS_SYNC_BYTE :
+            return([])
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if pid != self.pid :
+            return([])
+        adaptation_control = (packet[3] >> 4) & 0x03
+        if not adaptation_control & 0x01 :
+            return([])
+                                                              # check continuity
+        continuity = packet[3] & 0x0F
+        if self.continuity is not None :
+                                                               # repeated packet
+            if continuity == self.continuity :
+                return([])
+            if continuity != (self.continuity + 1) & 0x0F :
+                self.buffer.clear()
+        self.continuity = continuity
+                                                                  # find payload
+        offset = 4
+        if adaptation_control & 0x02 :
+            offset += 1 + packet[4]
+        if offset >= TS_PACKET_SIZE :
+            return([])
+        payload = packet[offset:]
+                                                           # reassemble sections
+        sections = []
+        if packet[1] & 0x40 :
+            pointer = payload[0]
+            if self.buffer :
+                self.buffer += payload[1:1+pointer]
+                sections += self._complete_sections()
+            self.buffer = bytearray(payload[1+pointer:])
+        elif self.buffer :
+            self.buffer += payload
+        sections += self._complete_sections()
+
+        return(sections)
+
+#-------------------------------------------------------------------------------
+# Read sections from a transport stream file
+#
+# None is yielded between reads so that the caller can check its timeouts
+# as it does with a live demux.
+#
+def read_ts_sections(ts_file_spec, pids=(EIT_PID,)) :
+    assemblers = {}
+    for pid in pids :
+        assemblers[pid] = SectionAssembler(pid)
+    with open(ts_file_spec, 'rb') as ts_file :
+        while True :
+            data = ts_file.read(TS_READ_PACKETS * TS_PACKET_SIZE)
+            if len(data) < TS_PACKET_SIZE :
+                break
+            last_offset = len(data) - TS_PACKET_SIZE
+            for offset in range(0, last_offset + 1, TS_PACKET_SIZE) :
+                pid = ((data[offset+1] & 0x1F) << 8) | data[offset+2]
+                if pid not in assemblers :
+                    continue
+                packet = data[offset:offset+TS_PACKET_SIZE]
+                for section in assemblers[pid].feed(packet) :
+                    yield(section)
+            yield(None)
+
+#-------------------------------------------------------------------------------
+# Read sections from a tuner demux
+#
+# The kernel section filters deliver one complete, CRC-checked section per
+# read. None is yielded after each second without data.
+#
+def read_demux_sections(demux_spec, pids=(EIT_PID,)) :
+    demuxes = []
+    try :
+                                                  # set a section filter per pid
+        for pid in pids :
+            demux = os.open(demux_spec, os.O_RDONLY | os.O_NONBLOCK)
+            demuxes.append(demux)
+            filter_parameters = struct.pack(
+                '=H%ds%ds%dsxxII' % ((DMX_FILTER_SIZE,) * 3),
+                pid, bytes(DMX_FILTER_SIZE), bytes(DMX_FILTER_SIZE),
+                bytes(DMX_FILTER_SIZE), 0, DMX_CHECK_CRC | DMX_IMMEDIATE_START
+            )
+            fcntl.ioctl(demux, DMX_SET_FILTER, filter_parameters)
+                                                                 # read sections
+        while True :
+            (readable, writable, failed) = select.select(demuxes, [], [], 1)
+            if not readable :
+                yield(None)
+                continue
+            for demux in readable :
+                try :
+                    section = os.read(demux, SECTION_MAX_SIZE)
+                except (BlockingIOError, TimeoutError) :
+                    continue
+                                                       # buffer overflow : go on
+                except OSError :
+                    continue
+                if section :
+                    yield(section)
+    finally :
+        for demux in demuxes :
+            try :
+                fcntl.ioctl(demux, DMX_STOP)
+            except OSError :
+                pass
+            os.close(demux)
+
+#-------------------------------------------------------------------------------
+# Read sections from a demux device or a transport stream file
+#
+def read_sections(source_spec, pids=(EIT_PID,)) :
+    if source_spec.startswith('/dev/') :
+        return(read_demux_sections(source_spec, pids))
+
+    return(read_ts_sections(source_spec, pids))
+
+# ==============================================================================
+# Completeness tracking
+#
+
+#-------------------------------------------------------------------------------
+# Track received EIT sections per service
+#
+# A table (service, table id, version) is complete when, in every segment of
+# 8 sections up to its last section, all the sections up to the segment's
+# last section number have been seen. A service's table family is complete
+# when all its tables up to the signalled last table id are complete.
+#
+# The sections still missing in every table, the tables still incomplete
+# and the tables signalled but not seen are counted as the sections come,
+# so that checking the completeness doesn't go through all the tables.
+#
+class EitTracker :
+
+    def __init__(self) :
+        self.tables = {}
+        self.last_table_ids = {}
+        self.unseen_tables = set()
+        self.incomplete = 0
+        self.sections = 0
+        self.duplicates = 0
+        self.start_time = time.monotonic()
+        self.last_new_table_time = self.start_time
+
+    def feed(self, section) :
+        if len(section) < 18 or not is_eit(section[0]) :
+            return(False)
+        header = eit_header(section)
+        if not header['current'] :
+            return(False)
+        self.sections += 1
+                                                                    # find table
+        service = (
+            header['original_network_id'], header['transport_stream_id'],
+            header['service_id']
+        )
+        family = table_family(header['table_id'])
+        self._signal_tables(service, family, header['last_table_id'])
+        table_key = service + (header['table_id'],)
+        table = self.tables.get(table_key)
+        if table is None or table['version'] != header['version'] :
+            if table is not None and table['missing'] :
+                self.incomplete -= 1
+            table = {
+                'version' : header['version'],
+                'last_section_number' : header['last_section_number'],
+                'segment_last' : {},
+                'seen' : set()
+            }
+            table['missing'] = self.missing_sections(table)
+            self.incomplete += 1
+            self.tables[table_key] = table
+            self.unseen_tables.discard(table_key)
+            self.last_new_table_time = time.monotonic()
+                                                                # record section
+        section_number = header['section_number']
+        if section_number in table['seen'] :
+            self.duplicates += 1
+            return(False)
+        table['seen'].add(section_number)
+        segment = section_number // SECTIONS_PER_SEGMENT
+        segment_last = header['segment_last_section_number']
+                                 # count again when the expected sections change
+        if header['last_section_number'] != table['last_section_number'] \
+            or table['segment_last'].get(segment) != segment_last :
+            table['last_section_number'] = header['last_section_number']
+            table['segment_last'][segment] = segment_last
+            missing = self.missing_sections(table)
+        else :
+            missing = table['missing']
+            if section_number <= min(
+                segment_last, table['last_section_number']
+            ) :
+                missing -= 1
+        if bool(missing) != bool(table['missing']) :
+            self.incomplete += 1 if missing else -1
+        table['missing'] = missing
+
+        return(True)
+
+    def _signal_tables(self, service, family, last_table_id) :
+                                           # the tables of a family not yet seen
+        family_key = service + (family,)
+        if family in EIT_PRESENT_FOLLOWING :
+            return
+        if self.last_table_ids.get(family_key) == last_table_id :
+            return
+        self.last_table_ids[family_key] = last_table_id
+        for table_id in range(family, family + 0x10) :
+            table_key = service + (table_id,)
+            if table_id <= last_table_id and table_key not in self.tables :
+                self.unseen_tables.add(table_key)
+            else :
+                self.unseen_tables.discard(table_key)
+
+    def missing_sections(self, table) :
+                              # an unknown segment counts as one missing section
+        missing = 0
+        last_segment = table['last_section_number'] // SECTIONS_PER_SEGMENT
+        for segment in range(last_segment + 1) :
+            if segment not in table['segment_last'] :
+                missing += 1
+                continue
+            first_section = segment * SECTIONS_PER_SEGMENT
+            last_section = min(
+                table['segment_last'][segment], table['last_section_number']
+            )
+            for section_number in range(first_section, last_section + 1) :
+                if section_number not in table['seen'] :
+                    missing += 1
+
+        return(missing)
+
+    def incomplete_tables(self) :
+        return(self.incomplete + len(self.unseen_tables))
+
+    def is_complete(self, settle_time) :
+        if not self.tables :
+            return(False)
+        if time.monotonic() - self.last_new_table_time < settle_time :
+            return(False)
+
+        return(self.incomplete_tables() == 0)
+
+    def statistics(self) :
+        services = set(table_key[:3] for table_key in self.tables.keys())
+        return({
+            'services' : len(services),
+            'tables' : len(self.tables),
+            'incomplete' : self.incomplete_tables(),
+            'sections' : self.sections,
+            'duplicates' : self.duplicates,
+            'elapsed' : time.monotonic() - self.start_time
+        })
+
+# ==============================================================================
+# Decoding
+#
+
+#-------------------------------------------------------------------------------
+# Decode a DVB text string
+#
+def decode_text(data) :
+    if not data :
+        return('')
+                                                        # select character table
+    encoding = 'iso-6937'
+    if data[0] == 0x10 and len(data) >= 3 :
+        encoding = "iso-8859-%d" % data[2]
+        data = data[3:]
+    elif data[0] < 0x20 :
+        encoding = DVB_CHARACTER_TABLES.get(data[0], 'iso-8859-1')
+        data = data[1:]
+                                                              # decode multibyte
+    if encoding in ('utf-8', 'utf-16-be') :
+        text = data.decode(encoding, errors='replace')
+        return(text.replace('\uE08A', '\n').replace('\x8a', '\n'))
+                                             # drop control codes, keep newlines
+    data = bytes(
+        byte for byte in data.replace(b'\x8a', b'\n')
+            if not 0x80 <= byte <= 0x9F
+    )
+    if encoding != 'iso-6937' :
+        try :
+            return(data.decode(encoding, errors='replace'))
+        except LookupError :
+            return(data.decode('iso-8859-1'))
+                                                      # ISO 6937 with diacritics
+    characters = []
+    diacritic = ''
+    for byte in data :
+        if byte in ISO_6937_DIACRITICS :
+            diacritic = ISO_6937_DIACRITICS[byte]
+        elif byte < 0xA0 :
+            characters.append(chr(byte) + diacritic)
+            diacritic = ''
+        else :
+            characters.append(ISO_6937_CHARACTERS[byte])
+            diacritic = ''
+
+    return(unicodedata.normalize('NFC', ''.join(characters)))
+
+#-------------------------------------------------------------------------------
+# BCD byte to integer
+#
+def bcd(byte) :
+    return((byte >> 4) * 10 + (byte & 0x0F))
+
+#-------------------------------------------------------------------------------
+# MJD date and BCD UTC time to epoch seconds
+#
+def mjd_to_epoch(data) :
+    mjd = (data[0] << 8) | data[1]
+    date = MJD_EPOCH + datetime.timedelta(days=mjd)
+    start = datetime.datetime(
+        date.year, date.month, date.day,
+        bcd(data[2]), bcd(data[3]), bcd(data[4]),
+        tzinfo=datetime.timezone.utc
+    )
+
+    return(int(start.timestamp()))
+
+#-------------------------------------------------------------------------------
+# Iterate over a descriptors loop
+#
+def descriptors(data) :
+    offset = 0
+    while offset + 2 <= len(data) :
+        tag = data[offset]
+        length = data[offset+1]
+        yield(tag, data[offset+2:offset+2+length])
+        offset += 2 + length
+
+#-------------------------------------------------------------------------------
+# Decode the events of an EIT section
+#
+def decode_eit_events(section) :
+    header = eit_header(section)
+    events = []
+    offset = 14
+    end = len(section) - 4
+    while offset + 12 <= end :
+        event_id = (section[offset] << 8) | section[offset+1]
+        start_data = section[offset+2:offset+7]
+        duration_data = section[offset+7:offset+10]
+        running_status = section[offset+10] >> 5
+        loop_length = ((section[offset+10] & 0x0F) << 8) | section[offset+11]
+        loop = section[offset+12:offset+12+loop_length]
+        offset += 12 + loop_length
+                                                          # skip undefined times
+        if start_data == b'\xff\xff\xff\xff\xff' :
+            continue
+        start = mjd_to_epoch(start_data)
+        duration = (
+            bcd(duration_data[0]) * 3600 + bcd(duration_data[1]) * 60 +
+            bcd(duration_data[2])
+        )
+                                                             # event descriptors
+        event = {
+            'service_id' : header['service_id'],
+            'event_id' : event_id,
+            'start' : start,
+            'stop' : start + duration,
+            'running_status' : RUNNING_STATUS[running_status],
+            'language' : '',
+            'title' : '',
+            'short_text' : '',
+            'extended_text' : []
+        }
+        for (tag, data) in descriptors(loop) :
+            if tag == SHORT_EVENT_DESCRIPTOR and len(data) >= 5 :
+                event['language'] = data[0:3].decode('ascii', errors='replace')
+                name_length = data[3]
+                event['title'] = decode_text(data[4:4+name_length])
+                text_offset = 4 + name_length
+                text_length = data[text_offset]
+                event['short_text'] = decode_text(
+                    data[text_offset+1:text_offset+1+text_length]
+                )
+            elif tag == EXTENDED_EVENT_DESCRIPTOR and len(data) >= 6 :
+                descriptor_number = data[0] >> 4
+                items_length = data[4]
+                text_offset = 5 + items_length
+                text_length = data[text_offset]
+                event['extended_text'].append((
+                    descriptor_number,
+                    data[text_offset+1:text_offset+1+text_length]
+                ))
+                                               # extended text spans descriptors
+        extended_text = b''.join(
+            text for (number, text) in sorted(event['extended_text'])
+        )
+        event['extended_text'] = decode_text(extended_text)
+        events.append(event)
+
+    return(events)
+
+#-------------------------------------------------------------------------------
+# Decode the service names of an SDT section
+#
+def decode_sdt_services(section) :
+    services = {}
+    offset = 11
+    end = len(section) - 4
+    while offset + 5 <= end :
+        service_id = (section[offset] << 8) | section[offset+1]
+        loop_length = ((section[offset+3] & 0x0F) << 8) | section[offset+4]
+        loop = section[offset+5:offset+5+loop_length]
+        offset += 5 + loop_length
+        for (tag, data) in descriptors(loop) :
+            if tag == SERVICE_DESCRIPTOR and len(data) >= 3 :
+                provider_length = data[1]
+                name_offset = 2 + provider_length
+                name_length = data[name_offset]
+                services[service_id] = decode_text(
+                    data[name_offset+1:name_offset+1+name_length]
+                )
+
+    return(services)
+
+#-------------------------------------------------------------------------------
+# Epoch seconds to XMLTV local time string
+#
+def to_xmltv_time(epoch) :
+    local_time = datetime.datetime.fromtimestamp(epoch).astimezone()
+
+    return(local_time.strftime('%Y%m%d%H%M%S %z'))
+
+#-------------------------------------------------------------------------------
+# EIT event to XMLTV programme
+#
+# The programme has the shape of an xmltodict-parsed epgrab programme, so
+# both can be written by the same code.
+#
+def to_programme(event) :
+    programme = {
+        '@channel' : "%d.dvb.guide" % event['service_id'],
+        '@start' : to_xmltv_time(event['start']),
+        '@stop' : to_xmltv_time(event['stop']),
+        'title' : {'@lang' : event['language'], '#text' : event['title']}
+    }
+    description = event['short_text']
+    if event['extended_text'] :
+        if event['short_text'] :
+            programme['sub-title'] = {
+                '@lang' : event['language'], '#text' : event['short_text']
+            }
+        description = event['extended_text']
+    if description :
+        programme['desc'] = {'@lang' : event['language'], '#text' : description}
+
+    return(programme)
+
+#-------------------------------------------------------------------------------
+# Capture EIT sections until the guide is complete
+#
+# Stops when every table has been received and no new table has shown up
+# during the settle time, when the timeout expires, when the source ends or
+# when the optional keep_going() callback returns False.
+#
+def capture(source_spec, timeout, settle_time, keep_going=None) :
+    tracker = EitTracker()
+    completed = False
+    for section in read_sections(source_spec) :
+        if section is not None :
+            tracker.feed(section)
+        if tracker.is_complete(settle_time) :
+            completed = True
+            break
+        if time.monotonic() - tracker.start_time > timeout :
+            break
+        if keep_going is not None and not keep_going() :
+            break
+    statistics = tracker.statistics()
+                            # nothing received, as without lock, is not complete
+    statistics['completed'] = completed or (
+        statistics['tables'] > 0 and statistics['incomplete'] == 0
+    )
+
+    return(statistics)
+
+#-------------------------------------------------------------------------------
+# Decode programmes until the guide is complete
+#
+# Programmes are yielded as soon as their events are first received. The
+# SDT service names are stored in the service_names dictionary, and the
+# capture statistics in the statistics one, both given by the caller. The
+# decoding stops early when the optional keep_going() callback returns False.
+#
+def programmes(
+    source_spec, timeout, settle_time, service_names=None, statistics=None,
+    keep_going=None
+) :
+    tracker = EitTracker()
+    events_seen = set()
+    completed = False
+    for section in read_sections(source_spec, (EIT_PID, SDT_PID)) :
+        if section is not None :
+                                                           # store service names
+            if section[0] in (SDT_ACTUAL, SDT_OTHER) :
+                if service_names is not None :
+                    service_names.update(decode_sdt_services(section))
+                                                     # decode new event sections
+            elif tracker.feed(section) :
+                for event in decode_eit_events(section) :
+                    event_key = (event['service_id'], event['event_id'])
+                    if event_key in events_seen :
+                        continue
+                    events_seen.add(event_key)
+                    yield(to_programme(event))
+        if tracker.is_complete(settle_time) :
+            completed = True
+            break
+        if time.monotonic() - tracker.start_time > timeout :
+            break
+        if keep_going is not None and not keep_going() :
+            break
+    if statistics is not None :
+        statistics.update(tracker.statistics())
+                            # nothing received, as without lock, is not complete
+        statistics['completed'] = completed or (
+            statistics['tables'] > 0 and statistics['incomplete'] == 0
+        )
+        statistics['events'] = len(events_seen)
+
+#-------------------------------------------------------------------------------
+# Format capture statistics
+#
+def statistics_string(statistics) :
+    return(
+        "%d services, %d tables (%d incomplete), " % (
+            statistics['services'], statistics['tables'],
+            statistics['incomplete']
+        ) +
+        "%d sections (%d repeated) in %.1f sec" % (
+            statistics['sections'], statistics['duplicates'],
+            statistics['elapsed']
+        )
+    )
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='measure EIT completeness on a demux or a TS file'
+    )
+    parser.add_argument(
+        'source', default='/dev/dvb/adapter0/demux0', nargs='?',
+        help = 'the tuner demux or a transport stream file'
+    )
+    parser.add_argument(
+        '-t', '--timeout', default=600,
+        help = 'the maximal capture time in seconds'
+    )
+    parser.add_argument(
+        '-s', '--settle', default=10,
+        help = 'the time without new tables before stopping in seconds'
+    )
+    parser.add_argument(
+        '-p', '--programmes', action='store_true', dest='programmes',
+        help = 'decode and list the programmes'
+    )
+    parser_arguments = parser.parse_args(arguments)
+                                                                   # run capture
+    if parser_arguments.programmes :
+        statistics = {}
+        service_names = {}
+        for programme in programmes(
+            parser_arguments.source,
+            float(parser_arguments.timeout), float(parser_arguments.settle),
+            service_names, statistics
+        ) :
+            print("%s %s %s" % (
+                programme['@start'], programme['@channel'],
+                programme['title']['#text']
+            ))
+        for (service_id, service_name) in sorted(service_names.items()) :
+            print("service %d : %s" % (service_id, service_name))
+        print("%d events" % statistics['events'])
+    else :
+        statistics = capture(
+            parser_arguments.source,
+            float(parser_arguments.timeout), float(parser_arguments.settle)
+        )
+    print("%s : %s" % (
+        'complete' if statistics['completed'] else 'incomplete',
+        statistics_string(statistics)
+    ))
+
+if __name__ == '__main__' :
+    main()
@@ -1,13 +1,25 @@
 #!/usr/bin/python3
 import argparse
 import os
-import xmltodict
+import sys
+import time
+import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import xml.parsers.expat
+import epgIndex
+import epgSearch
 
 # ------------------------------------------------------------------------------
 # constants
 #
 EPG_FILES_DIR = ''
+OUTPUT_FORMATS = ('text', 'json', 'tsv')
+GRID_DEFAULT_HOURS = 2
+GRID_CHANNEL_WIDTH = 12
+GRID_CELL_WIDTH = 16
+GRID_READERS = 8
+SEARCH_RESULTS = 20
 
 INDENT = '  '
 SEPARATOR = 80 * '-'
@@ -15,46 +27,254 @@ SEPARATOR = 80 * '-'
 # ------------------------------------------------------------------------------
 # command line arguments
 #
-parser = argparse.ArgumentParser()
+def parse_arguments(arguments=None) :
+    global parser, channel_name, epg_files_directory, index_file_spec, \
+        use_index, window_start_string, window_stop_string, on_air_only, \
+        next_count, display_grid, grid_slot, search_query, output_format, \
+        verbose
+    parser = argparse.ArgumentParser()
                                                                        # channel
-parser.add_argument(
-    'channel', default='Arte', nargs='?',
-    help = 'channel name'
-)
+    parser.add_argument(
+        'channel', default='Arte', nargs='?',
+        help = 'channel name'
+    )
                                                            # epg files directory
-parser.add_argument(
-    '-d', '--dir', default='/home/control/Public/www',
-    help = 'the DVB channels list file'
-)
+    parser.add_argument(
+        '-d', '--dir', default='/home/control/Public/www',
+        help = 'the DVB channels list file'
+    )
+                                                                # EPG index file
+    parser.add_argument(
+        '-i', '--index', default='',
+        help = 'the EPG index file'
+    )
+                                                    # read the EPG file directly
+    parser.add_argument(
+        '-s', '--stream', action='store_true', dest='stream',
+        help = 'read the EPG file without the index'
+    )
+                                                                   # time window
+    parser.add_argument(
+        '--from', default='', dest='start',
+        help = 'window start, as "YYYYmmddHHMM", "YYYY-mm-dd HH:MM" or "HH:MM"'
+    )
+    parser.add_argument(
+        '--to', default='', dest='stop',
+        help = 'window end, same formats as --from'
+    )
+    parser.add_argument(
+        '--now', action='store_true', dest='now',
+        help = 'only the programme on air'
+    )
+    parser.add_argument(
+        '--next', default=0, dest='next',
+        help = 'the programme on air and the following ones, up to a total of N'
+    )
+                                                             # all channels grid
+    parser.add_argument(
+        '-g', '--grid', action='store_true', dest='grid',
+        help = 'display all channels, reading the EPG files directly'
+    )
+    parser.add_argument(
+        '--slot', default=30, dest='slot',
+        help = 'the grid time slot in minutes'
+    )
+                                                           # search all channels
+    parser.add_argument(
+        '-q', '--search', default='', dest='search',
+        help = 'search the titles and descriptions of all channels'
+    )
+                                                                 # output format
+    parser.add_argument(
+        '-f', '--format', default='text', choices=OUTPUT_FORMATS,
+        help = 'the output format'
+    )
                                                                      # verbosity
-parser.add_argument(
-    '-v', '--verbose', action='store_true', dest='verbose',
-    help = 'verbose console output'
-)
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
+    )
                                                   # parse command line arguments
-parser_arguments = parser.parse_args()
-channel_name = parser_arguments.channel
-epg_files_directory = parser_arguments.dir
-verbose = parser_arguments.verbose
+    parser_arguments = parser.parse_args(arguments)
+    channel_name = parser_arguments.channel
+    epg_files_directory = parser_arguments.dir
+    index_file_spec = parser_arguments.index
+    if index_file_spec == '' :
+        index_file_spec = epgIndex.index_file_spec(epg_files_directory)
+    use_index = not parser_arguments.stream
+    window_start_string = parser_arguments.start
+    window_stop_string = parser_arguments.stop
+    on_air_only = parser_arguments.now
+    next_count = int(parser_arguments.next)
+    display_grid = parser_arguments.grid
+    grid_slot = 60 * int(parser_arguments.slot)
+    search_query = parser_arguments.search
+    output_format = parser_arguments.format
+    verbose = parser_arguments.verbose
 
 # ==============================================================================
 # Internal functions
 #
 
 #-------------------------------------------------------------------------------
-# Read programes from EPG XML
+# Command line time to epoch seconds
 #
-def read_epg(time_string) :
-                                                            # read EPG from file
-    epg_file = open(epg_file_spec, 'r')
-    epg_xml = epg_file.read()
-    epg_file.close()
-    epg_dict = xmltodict.parse(epg_xml)
+def to_epoch(time_string) :
+    for time_format in ('%Y%m%d%H%M', '%Y%m%d%H%M%S', '%Y-%m-%d %H:%M') :
+        try :
+            return(int(datetime.strptime(time_string, time_format).timestamp()))
+        except ValueError :
+            pass
+                                                                  # today's time
+    try :
+        time_of_day = datetime.strptime(time_string, '%H:%M')
+    except ValueError :
+        parser.error("invalid time \"%s\"" % time_string)
+    time_object = datetime.now().replace(
+        hour=time_of_day.hour, minute=time_of_day.minute,
+        second=0, microsecond=0
+    )
+
+    return(int(time_object.timestamp()))
+
+#-------------------------------------------------------------------------------
+# Time window and programme count from the command line
+#
+def query_window() :
+    start = None
+    stop = None
+    limit = None
+    now = int(time.time())
+    if window_start_string :
+        start = to_epoch(window_start_string)
+    if window_stop_string :
+        stop = to_epoch(window_stop_string)
+    if on_air_only :
+        (start, stop, limit) = (now, now + 1, 1)
+    elif next_count > 0 :
+        if start is None :
+            start = now
+        limit = next_count
+                                        # the search defaults to the coming ones
+    elif search_query :
+        if start is None :
+            start = now
+        limit = SEARCH_RESULTS
+                                           # the grid defaults to the next hours
+    elif display_grid :
+        if start is None :
+            start = now
+        if stop is None :
+            stop = start + GRID_DEFAULT_HOURS * 60 * 60
+
+    return((start, stop, limit))
+
+#-------------------------------------------------------------------------------
+# Read programes from the EPG index
+#
+def read_epg(epg_file_spec, start=None, stop=None, limit=None) :
+                                                     # update index for the file
+    index = epgIndex.open_index(index_file_spec)
+    epgIndex.update_index(index, epg_files_directory, [epg_file_spec])
                                                            # retreive programmes
-    programmes = epg_dict['tv']['programme']
+    programmes = epgIndex.query_programmes(
+        index, epg_file_spec, start, stop, limit
+    )
+    index.close()
+
+    return(programmes)
+
+#-------------------------------------------------------------------------------
+# Read programes from EPG XML
+#
+# The programmes are filtered while parsing. As the EPG files are sorted by
+# start time, the parsing stops at the first programme after the window or
+# when enough programmes have been found.
+#
+def read_epg_stream(epg_file_spec, start=None, stop=None, limit=None) :
+                                      # loaded when needed, being slow to import
+    import xmltodict
+    programmes = []
+    def filter_programme(path, programme) :
+        if len(path) != 2 or path[0][0] != 'tv' :
+            return(True)
+        if not isinstance(programme, dict) :
+            return(True)
+        try :
+            programme_start = epgIndex.to_epoch(programme['@start'])
+            programme_stop = epgIndex.to_epoch(programme['@stop'])
+        except (KeyError, ValueError) :
+            return(True)
+                                                           # past the window end
+        if stop is not None and programme_start >= stop :
+            return(False)
+        if start is not None and programme_stop <= start :
+            return(True)
+        programmes.append(programme)
+                                                             # enough programmes
+        if limit is not None and len(programmes) >= limit :
+            return(False)
+        return(True)
+    try :
+        with open(epg_file_spec, 'rb') as epg_file :
+            xmltodict.parse(
+                epg_file, item_depth=2, item_callback=filter_programme
+            )
+    except xmltodict.ParsingInterrupted :
+        pass
+    except (OSError, xml.parsers.expat.ExpatError) :
+        pass
 
     return(programmes)
 
+#-------------------------------------------------------------------------------
+# Read the programmes of all channels
+#
+# The EPG files are read concurrently, each one only up to the end of the
+# time window. Returns a list of channel name and programmes pairs.
+#
+def read_all_epgs(start=None, stop=None, limit=None) :
+    epg_file_specs = sorted(
+        entry.path for entry in os.scandir(epg_files_directory)
+            if entry.name.endswith('.xml') and entry.is_file()
+    )
+    with ThreadPoolExecutor(max_workers=GRID_READERS) as executor :
+        channels_programmes = executor.map(
+            lambda file_spec : read_epg_stream(file_spec, start, stop, limit),
+            epg_file_specs
+        )
+        channels_programmes = list(channels_programmes)
+                                                 # skip files without programmes
+    channels = []
+    for (file_spec, programmes) in zip(epg_file_specs, channels_programmes) :
+        if programmes :
+            channel = os.path.basename(file_spec)[:-len('.xml')]
+            channels.append((channel.replace('_', ' '), programmes))
+
+    return(channels)
+
+#-------------------------------------------------------------------------------
+# Search the programmes of all channels
+#
+# Returns the ranked results, the search time and the total time with the
+# building of the search index, in milliseconds. The search index is built
+# for every search : only the EPG service keeps it between searches.
+#
+def search_epgs(query, start=None, stop=None, limit=None) :
+                                                    # update index for all files
+    build_start = time.perf_counter()
+    index = epgIndex.open_index(index_file_spec)
+    search_index = epgSearch.SearchIndex()
+    epgSearch.update_search_index(search_index, index, epg_files_directory)
+    index.close()
+                                                                        # search
+    search_start = time.perf_counter()
+    results = search_index.search(query, start, stop, limit)
+    search_time = 1000 * (time.perf_counter() - search_start)
+    total_time = 1000 * (time.perf_counter() - build_start)
+
+    return((results, search_time, total_time))
+
 #-------------------------------------------------------------------------------
 # EPG time string to datetime
 #
@@ -66,25 +286,41 @@ def to_datetime(time_string) :
 
     return(local_time)
 
+#-------------------------------------------------------------------------------
+# EPG time string to ISO 8601
+#
+def to_iso(time_string) :
+    time_object = datetime.strptime(time_string, '%Y%m%d%H%M%S %z')
+
+    return(time_object.isoformat())
+
 #-------------------------------------------------------------------------------
 # Sort programme by time
 #
 def sort_programmes(programmes) :
-                                                              # sort start times
-    start_times = []
-    for programme in programmes :
-        start_time = programme['@start']
-        start_time = start_time.split(' ')[0]
-        start_times.append(start_time)
-    start_times = sorted(start_times)
-                                                        # build sorted programme
-    sorted_programmes = []
-    for start_time in start_times :
-        for programme in programmes :
-            if start_time in programme['@start'] :
-                sorted_programmes.append(programme)
-
-    return(sorted_programmes)
+    return(sorted(
+        programmes,
+        key=lambda programme : (
+            epgIndex.to_epoch(programme['@start']), programme['@channel']
+        )
+    ))
+
+#-------------------------------------------------------------------------------
+# Print search results with their score, channel and time
+#
+def print_search_results(results, search_time, total_time) :
+    print("%d results in %.2f ms, %.1f ms with the index build" % (
+        len(results), search_time, total_time
+    ))
+    for (score, channel, programme) in results :
+        start_time = to_datetime(programme['@start'])
+        title = epgIndex.text_of(programme.get('title'))
+        sub_title = epgIndex.text_of(programme.get('sub-title'))
+        if sub_title :
+            title += " - %s" % sub_title
+        print("%6.2f %s %-12s %s" % (
+            score, start_time.strftime('%d %b %H:%M'), channel, title
+        ))
 
 #-------------------------------------------------------------------------------
 # Print programmes schedules and titles
@@ -102,20 +338,154 @@ def print_epg(programmes) :
             "%s - %s (%s)"
                 % (start_time_string, end_time_string, duration_string)
         )
-        print(INDENT + programme['title']['#text'])
+        print(INDENT + epgIndex.text_of(programme.get('title')))
+
+#-------------------------------------------------------------------------------
+# Print a channels by time slots grid
+#
+# Every cell shows the programme covering the largest part of the slot, a
+# programme spanning several slots being only titled in its first one.
+#
+def print_grid(channels, start, stop) :
+                                                               # grid time slots
+    if start is None :
+        start = min(
+            epgIndex.to_epoch(programmes[0]['@start'])
+                for (channel, programmes) in channels
+        )
+    if stop is None :
+        stop = max(
+            epgIndex.to_epoch(programmes[-1]['@stop'])
+                for (channel, programmes) in channels
+        )
+    start -= start % grid_slot
+    slots = list(range(start, stop, grid_slot))
+                                                                        # header
+    print(
+        GRID_CHANNEL_WIDTH * ' ' + ''.join(
+            datetime.fromtimestamp(slot).strftime('%H:%M').ljust(
+                GRID_CELL_WIDTH
+            ) for slot in slots
+        ).rstrip()
+    )
+                                                                 # channel lines
+    for (channel, programmes) in channels :
+        times = [
+            (
+                epgIndex.to_epoch(programme['@start']),
+                epgIndex.to_epoch(programme['@stop']),
+                epgIndex.text_of(programme.get('title'))
+            ) for programme in programmes
+        ]
+        line = channel[:GRID_CHANNEL_WIDTH - 1].ljust(GRID_CHANNEL_WIDTH)
+        previous_title_start = None
+        for slot in slots :
+            covering = None
+            covered = 0
+            for (programme_start, programme_stop, title) in times :
+                overlap = min(programme_stop, slot + grid_slot) \
+                    - max(programme_start, slot)
+                if overlap > covered :
+                    (covering, covered) = (
+                        (programme_start, title), overlap
+                    )
+            cell = ''
+            if covering is not None and covering[0] != previous_title_start :
+                cell = covering[1]
+                previous_title_start = covering[0]
+            elif covering is not None :
+                cell = '...'
+            line += cell[:GRID_CELL_WIDTH - 1].ljust(GRID_CELL_WIDTH)
+        print(line.rstrip())
+
+#-------------------------------------------------------------------------------
+# Print programmes for scripts
+#
+def print_epg_data(programmes, data_format) :
+    records = []
+    for programme in programmes :
+        records.append({
+            'channel' : programme.get('@channel', ''),
+            'start' : to_iso(programme['@start']),
+            'stop' : to_iso(programme['@stop']),
+            'title' : epgIndex.text_of(programme.get('title')),
+            'sub-title' : epgIndex.text_of(programme.get('sub-title')),
+            'description' : epgIndex.text_of(programme.get('desc'))
+        })
+    if data_format == 'json' :
+        json.dump(records, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else :
+        for record in records :
+            print('\t'.join(
+                ' '.join(value.split()) for value in (
+                    record['start'], record['stop'], record['channel'],
+                    record['title'], record['sub-title']
+                )
+            ))
 
 # ==============================================================================
 # main script
 #
-epg_file_spec = os.sep.join(
-    [epg_files_directory, channel_name.replace(' ', '_') + '.xml']
-)
+def main(arguments=None) :
+    parse_arguments(arguments)
+    epg_file_spec = os.sep.join(
+        [epg_files_directory, channel_name.replace(' ', '_') + '.xml']
+    )
+    (window_start, window_stop, programmes_limit) = query_window()
                                                     # display working parameters
-if verbose :
-    print("Creating EPG display for \"%s\"" % channel_name)
-    print(INDENT + "epg file : \"%s\"" % epg_file_spec)
-    print()
+    if verbose and output_format == 'text' :
+        if search_query :
+            print("Searching EPG for \"%s\"" % search_query)
+            print(INDENT + "epg index : \"%s\"" % index_file_spec)
+        elif display_grid :
+            print("Creating EPG grid for \"%s\"" % epg_files_directory)
+        else :
+            print("Creating EPG display for \"%s\"" % channel_name)
+            print(INDENT + "epg file  : \"%s\"" % epg_file_spec)
+            if use_index :
+                print(INDENT + "epg index : \"%s\"" % index_file_spec)
+        print()
+                                                           # all channels search
+    if search_query :
+        (results, search_time, total_time) = search_epgs(
+            search_query, window_start, window_stop, programmes_limit
+        )
+        if output_format == 'text' :
+            print_search_results(results, search_time, total_time)
+        else :
+            print_epg_data(
+                [programme for (score, channel, programme) in results],
+                output_format
+            )
+        return
+                                                             # all channels grid
+    if display_grid :
+        channels = read_all_epgs(window_start, window_stop, programmes_limit)
+        if output_format == 'text' :
+            if channels :
+                print_grid(channels, window_start, window_stop)
+        else :
+            programmes = []
+            for (channel, channel_programmes) in channels :
+                programmes += channel_programmes
+            print_epg_data(sort_programmes(programmes), output_format)
+        return
                                                            # retreive programmes
-programmes = sort_programmes(read_epg(epg_file_spec))
-if verbose :
-    print_epg(programmes)
+    if use_index :
+        programmes = read_epg(
+            epg_file_spec, window_start, window_stop, programmes_limit
+        )
+    else :
+        programmes = read_epg_stream(
+            epg_file_spec, window_start, window_stop, programmes_limit
+        )
+    programmes = sort_programmes(programmes)
+                                                            # display programmes
+    if output_format == 'text' :
+        print_epg(programmes)
+    else :
+        print_epg_data(programmes, output_format)
+
+if __name__ == '__main__' :
+    main()
@@ -11,8 +11,11 @@ start=`date +%s`
 for channel in ${CHANNELS_TO_SCAN[@]}; do
   channel_no_underscore=`echo $channel | tr _ ' '`
   echo "$INDENT$channel_no_underscore"
-  $SCRIPT_DIR/epg-grab.py $channel -l /dev/null
 done
+                                    # one tune per multiplex for all the channels
+                              # run by the resident daemon when it is started
+PYTHONPATH="$CONFIGURATION_SCRIPT_DIR" python3 -m tvbox \
+  grab ${CHANNELS_TO_SCAN[@]} -l /dev/null
 end=`date +%s`
 echo "done in $(((end-start)/60)) minutes"
 
@@ -1,12 +1,43 @@
 #!/usr/bin/python3
 import argparse
 import os
-import xmltodict
+import glob
+import sys
+import heapq
+import queue
+import signal
+import subprocess
+import threading
+import time
+import datetime
+import concurrent.futures
+import xml.parsers.expat
+import eit
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'recording'
+))
+import processSupervisor
 
 # ------------------------------------------------------------------------------
 # constants
 #
 EPG_FILES_DIR = ''
+EPG_HEADER = (
+    '<?xml version="1.0" encoding="utf-8"?>\n' +
+    '<!DOCTYPE tv SYSTEM "xmltv.dtd">\n' +
+    '<tv generator-info-name="epg-grab">\n'
+)
+EPG_FOOTER = "</tv>\n"
+GRAB_STAMP_FILE_NAME = '.%s.grabbed'
+TUNER_COMMAND = 'dvbv5-zap'
+GRABBER_COMMAND = 'epgrab'
+ADAPTERS_DIR = '/dev/dvb'
+STOP_CHECK_PERIOD = 1
+COMPARE_SIZE = 64 * 1024
+MULTIPLEX_PARAMETERS = (
+    'DELIVERY_SYSTEM', 'FREQUENCY', 'POLARIZATION', 'SAT_NUMBER',
+    'SYMBOL_RATE', 'STREAM_ID', 'BANDWIDTH_HZ', 'MODULATION'
+)
 
 INDENT = '  '
 SEPARATOR = 80 * '-'
@@ -14,169 +45,657 @@ SEPARATOR = 80 * '-'
 # ------------------------------------------------------------------------------
 # command line arguments
 #
-parser = argparse.ArgumentParser()
-                                                                       # channel
-parser.add_argument(
-    'channel', default='Arte', nargs='?',
-    help = 'channel name'
-)
+def parse_arguments(arguments=None) :
+    global channels_to_grab, epg_files_directory, channels_list_file_spec, \
+        epg_file_spec, log_file_spec, tuner_demux, tuner_adapters, \
+        early_completion, grab_timeout, settle_time, native_decoder, \
+        merge_guides, merge_horizon, already_tuned, verbose
+    parser = argparse.ArgumentParser()
+                                                                      # channels
+    parser.add_argument(
+        'channel', default=['Arte'], nargs='*',
+        help = 'channel names'
+    )
                                                            # epg files directory
-parser.add_argument(
-    '-d', '--dir', default='/home/control/Public/www',
-    help = 'the DVB channels list file'
-)
+    parser.add_argument(
+        '-d', '--dir', default='/home/control/Public/www',
+        help = 'the DVB channels list file'
+    )
                                                             # channels list file
-parser.add_argument(
-    '-c', '--channels', default='',
-    help = 'the DVB channels list file'
-)
+    parser.add_argument(
+        '-c', '--channels', default='',
+        help = 'the DVB channels list file'
+    )
                                                                    # output file
-parser.add_argument(
-    '-o', '--output', default='/tmp/epg.xml',
-    help = 'the grabbed EPG file'
-)
+    parser.add_argument(
+        '-o', '--output', default='/tmp/epg.xml',
+        help = 'the grabbed EPG file'
+    )
                                                                       # log file
-parser.add_argument(
-    '-l', '--logFile', default='/tmp/epg-grab.log',
-    help = 'the commands log file'
-)
+    parser.add_argument(
+        '-l', '--logFile', default='/tmp/epg-grab.log',
+        help = 'the commands log file'
+    )
                                                                    # tuner demux
-parser.add_argument(
-    '-D', '--demux', default='/dev/dvb/adapter0/demux0',
-    help = 'the tuner demux'
-)
+    parser.add_argument(
+        '-D', '--demux', default='/dev/dvb/adapter%d/demux0',
+        help = 'the tuner demux, with %%d standing for the adapter id, ' +
+            'or a transport stream file to replay'
+    )
+                                                                # tuner adapters
+    parser.add_argument(
+        '-a', '--adapters', default='',
+        help = 'comma-separated tuner adapter ids (default: all found)'
+    )
+                                                              # early completion
+    parser.add_argument(
+        '-e', '--early', action='store_true', dest='early',
+        help = 'stop grabbing as soon as the EIT has been fully received'
+    )
+                                                                  # grab timeout
+    parser.add_argument(
+        '-t', '--timeout', default=900,
+        help = 'the maximal grab time per multiplex in seconds ' +
+            '(--early, --native)'
+    )
+                                                                   # settle time
+    parser.add_argument(
+        '-s', '--settle', default=15,
+        help = 'the time without new EIT tables before stopping ' +
+            '(--early, --native)'
+    )
+                                                                    # merge mode
+    parser.add_argument(
+        '-m', '--merge', action='store_true', dest='merge',
+        help = 'merge the grabbed programmes into the existing EPG files'
+    )
+                                                                 # merge horizon
+    parser.add_argument(
+        '-H', '--horizon', default=24,
+        help = 'drop programmes ended more than this many hours ago, ' +
+            'with --merge'
+    )
+                                                                # native decoder
+    parser.add_argument(
+        '-n', '--native', action='store_true', dest='native',
+        help = 'decode the EIT directly instead of running epgrab'
+    )
+                                                         # tuned by the recorder
+    parser.add_argument(
+        '-T', '--tuned', action='store_true', dest='tuned',
+        help = 'the adapters are already tuned to the multiplex'
+    )
                                                                      # verbosity
-parser.add_argument(
-    '-v', '--verbose', action='store_true', dest='verbose',
-    help = 'verbose console output'
-)
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
+    )
                                                   # parse command line arguments
-parser_arguments = parser.parse_args()
-channel = parser_arguments.channel
-epg_files_directory = parser_arguments.dir
-channels_list_file_spec = parser_arguments.channels
-if channels_list_file_spec == '' :
-    channels_list_file_spec = os.sep.join(
-        [epg_files_directory, 'channels-dvb.txt']
-    )
-epg_file_spec = parser_arguments.output
-log_file_spec = parser_arguments.logFile
-tuner_demux = parser_arguments.demux
-verbose = parser_arguments.verbose
+    parser_arguments = parser.parse_args(arguments)
+    channels_to_grab = [
+        channel.replace('_', ' ') for channel in parser_arguments.channel
+    ]
+    epg_files_directory = parser_arguments.dir
+    channels_list_file_spec = parser_arguments.channels
+    if channels_list_file_spec == '' :
+        channels_list_file_spec = os.sep.join(
+            [epg_files_directory, 'channels-dvb.txt']
+        )
+    epg_file_spec = parser_arguments.output
+    log_file_spec = parser_arguments.logFile
+    tuner_demux = parser_arguments.demux
+    tuner_adapters = [
+        int(adapter) for adapter in parser_arguments.adapters.split(',')
+            if adapter.strip() != ''
+    ]
+    early_completion = parser_arguments.early
+    grab_timeout = float(parser_arguments.timeout)
+    settle_time = float(parser_arguments.settle)
+    native_decoder = parser_arguments.native
+    already_tuned = parser_arguments.tuned
+    merge_guides = parser_arguments.merge
+    merge_horizon = float(parser_arguments.horizon) * 3600
+    verbose = parser_arguments.verbose
 
 acquire_again = True
+grab_stopped = threading.Event()
 
 # ==============================================================================
 # Internal functions
 #
 
+#-------------------------------------------------------------------------------
+# Find tuner adapters
+#
+def find_adapters() :
+    adapters = []
+    for adapter_path in glob.glob(os.sep.join([ADAPTERS_DIR, 'adapter*'])) :
+        adapter_id = os.path.basename(adapter_path)[len('adapter'):]
+        if adapter_id.isdigit() :
+            adapters.append(int(adapter_id))
+    if not adapters :
+        adapters = [0]
+
+    return(sorted(adapters))
+
+#-------------------------------------------------------------------------------
+# Per-adapter file spec
+#
+def adapter_file_spec(file_spec, adapter) :
+    if file_spec == os.devnull :
+        return(file_spec)
+    (base, extension) = os.path.splitext(file_spec)
+
+    return("%s-adapter%d%s" % (base, adapter, extension))
+
+#-------------------------------------------------------------------------------
+# Per-adapter demux
+#
+def demux_spec(adapter) :
+    if '%d' in tuner_demux :
+        return(tuner_demux % adapter)
+
+    return(tuner_demux)
+
 #-------------------------------------------------------------------------------
 # Start DVB tuner
 #
-def start_tuner() :
-                                                               # execute command
-    channel_with_spaces = channel.replace('_', ' ')
-    os.system(
-        "dvbv5-zap -c %s -r \"%s\" >%s 2>&1 &" %
-            (channels_list_file_spec, channel_with_spaces, log_file_spec)
-    )
+def start_tuner(channel, adapter, log_file) :
+                   # execute command, both outputs written through the same file
+                                                  # descriptor to keep the order
+    tuner = supervisor.start('tuner', [
+        TUNER_COMMAND, '-c', channels_list_file_spec,
+        '-a', str(adapter), '-r', channel
+    ], stdout=log_file, stderr=subprocess.STDOUT)
+
+    return(tuner)
 
 #-------------------------------------------------------------------------------
 # Launch grabber
 #
-def grab_EPG() :
+def grab_EPG(adapter, output_file_spec, log_file) :
                                                                # execute command
-    os.system(
-        "epgrab -i %s >%s 2>%s" % (tuner_demux, epg_file_spec, log_file_spec)
+    with open(output_file_spec, 'w') as output_file :
+        grabber = supervisor.start('grabber', [
+            GRABBER_COMMAND, '-i', demux_spec(adapter)
+        ], stdout=output_file, log_file=log_file)
+        if early_completion :
+            monitor_EIT(adapter, grabber)
+                                                     # interrupt it when stopped
+        while grabber.wait(STOP_CHECK_PERIOD) is None :
+            if grab_stopped.is_set() :
+                grabber.stop(signal.SIGINT)
+        if grabber.returncode > 0 and not grabber.stopped :
+            print(INDENT + "adapter %d : %s ended with code %d" % (
+                adapter, GRABBER_COMMAND, grabber.returncode
+            ))
+            for line in grabber.stderr_tail() :
+                print(2*INDENT + line)
+    os.chmod(output_file_spec, 0o666)
+
+#-------------------------------------------------------------------------------
+# Stop the grabber as soon as the EIT is complete
+#
+def monitor_EIT(adapter, grabber) :
+                                                    # track sections in parallel
+    statistics = eit.capture(
+        demux_spec(adapter), grab_timeout, settle_time,
+        keep_going=lambda : grabber.is_running() and not grab_stopped.is_set()
     )
-    os.chmod(epg_file_spec, 0o666)
+                                                   # interrupt a running grabber
+    if grabber.is_running() :
+        grabber.stop(signal.SIGINT)
+    print(INDENT + "adapter %d : %s" % (
+        adapter, eit.statistics_string(statistics)
+    ))
 
 #-------------------------------------------------------------------------------
 # Stop DVB tuner
 #
-def stop_tuner() :
-                                                               # execute command
-    os.system('pkill dvbv5-zap')
+def stop_tuner(tuner) :
+                                                     # only stop our own process
+    tuner.stop()
 
 #-------------------------------------------------------------------------------
-# Demultiplex program guides
+# Read channels list
 #
-def demultiplex_program_guides() :
-                                                            # read EPG from file
-    epg_file = open(epg_file_spec, 'r')
-    epg_xml = epg_file.read()
-    epg_file.close()
-    epg_dict = xmltodict.parse(epg_xml)
-                                                                 # find channels
+def read_channels_list() :
     channels_list_file = open(channels_list_file_spec, 'r')
-    channel_ids = {}
+    channels = {}
     channel_name = ''
     for line in channels_list_file :
         if line.startswith('[') :
             channel_name = line[1:line.find(']')]
-        if 'SERVICE_ID' in line :
-            service_id = line.split('=')[1].strip()
-            channel_ids[service_id] = channel_name
+            channels[channel_name] = {}
+        elif '=' in line and channel_name :
+            (key, value) = line.split('=', 1)
+            channels[channel_name][key.strip()] = value.strip()
     channels_list_file.close()
-                                                                 # find channels
-    programmes = epg_dict['tv']['programme']
-    grabbed_channels = {}
-    for programme in programmes :
-        channel_id = programme['@channel'].split('.')[0]
-        grabbed_channels[channel_id] = channel_ids[channel_id]
+
+    return(channels)
+
+#-------------------------------------------------------------------------------
+# Read service ids from channels list
+#
+def read_channel_ids(channels) :
+    channel_ids = {}
+    for (channel_name, parameters) in channels.items() :
+        if 'SERVICE_ID' in parameters :
+            channel_ids[parameters['SERVICE_ID']] = channel_name
+
+    return(channel_ids)
+
+#-------------------------------------------------------------------------------
+# Group channels by multiplex
+#
+def group_by_multiplex(channels, channel_names) :
+    multiplexes = {}
+    for channel_name in channel_names :
+        if channel_name not in channels :
+            print("channel \"%s\" not found in %s" % (
+                channel_name, channels_list_file_spec
+            ))
+            continue
+        parameters = channels[channel_name]
+        multiplex = tuple(
+            parameters.get(name, '') for name in MULTIPLEX_PARAMETERS
+        )
+        multiplexes.setdefault(multiplex, []).append(channel_name)
+
+    return(list(multiplexes.values()))
+
+#-------------------------------------------------------------------------------
+# Channel EPG file spec
+#
+def channel_epg_file_spec(channel_name) :
+    no_space_channel_name = channel_name.replace(' ', '_')
+
+    return(os.sep.join([epg_files_directory, no_space_channel_name + '.xml']))
+
+#-------------------------------------------------------------------------------
+# Channel grab stamp file spec
+#
+# The time of the last grab of a channel is the modification time of its
+# stamp file, the channel EPG file being left untouched when unchanged.
+#
+def grab_stamp_file_spec(channel_name) :
+    no_space_channel_name = channel_name.replace(' ', '_')
+
+    return(os.sep.join([
+        epg_files_directory, GRAB_STAMP_FILE_NAME % no_space_channel_name
+    ]))
+
+#-------------------------------------------------------------------------------
+# Temporary file spec, renamed to the final one once complete
+#
+def temporary_file_spec(file_spec) :
+    (directory, file_name) = os.path.split(file_spec)
+
+    return(os.path.join(directory, ".%s.%d.tmp" % (file_name, os.getpid())))
+
+#-------------------------------------------------------------------------------
+# Open a channel EPG file and write the XMLTV header
+#
+# The programmes are written to a temporary file which replaces the channel
+# file only when closed.
+#
+def open_channel_epg(channel_name) :
+    if verbose :
+        print(INDENT + channel_epg_file_spec(channel_name))
+                                                     # write header with doctype
+    channel_epg_file = open(
+        temporary_file_spec(channel_epg_file_spec(channel_name)), 'w'
+    )
+    channel_epg_file.write(EPG_HEADER)
+
+    return(channel_epg_file)
+
+#-------------------------------------------------------------------------------
+# XMLTV time string to epoch seconds
+#
+def to_epoch(time_string) :
+    if ' ' in time_string :
+        time_object = datetime.datetime.strptime(time_string, '%Y%m%d%H%M%S %z')
+    else :
+        time_object = datetime.datetime.strptime(time_string, '%Y%m%d%H%M%S')
+
+    return(time_object.timestamp())
+
+#-------------------------------------------------------------------------------
+# Read the programmes of an EPG file
+#
+def read_programmes(file_spec) :
+                                      # loaded when needed, being slow to import
+    import xmltodict
+    programmes = []
+    def store_programme(path, programme) :
+        programmes.append(programme)
+        return(True)
+    try :
+        with open(file_spec, 'rb') as epg_file :
+            xmltodict.parse(
+                epg_file, item_depth=2, item_callback=store_programme
+            )
+    except (OSError, xml.parsers.expat.ExpatError) :
+        pass
+
+    return(programmes)
+
+#-------------------------------------------------------------------------------
+# Check if two files have the same content
+#
+def same_content(file_spec_1, file_spec_2) :
+    if os.path.getsize(file_spec_1) != os.path.getsize(file_spec_2) :
+        return(False)
+    with open(file_spec_1, 'rb') as file_1, open(file_spec_2, 'rb') as file_2 :
+        while True :
+            block = file_1.read(COMPARE_SIZE)
+            if block != file_2.read(COMPARE_SIZE) :
+                return(False)
+            if not block :
+                return(True)
+
+#-------------------------------------------------------------------------------
+# Check if the programmes of an EPG file are in strict start time order
+#
+def is_time_ordered(file_spec) :
+    import xmltodict
+    last_start = [None]
+    def check_programme(path, programme) :
+        start = to_epoch(programme['@start'])
+        if last_start[0] is not None and start <= last_start[0] :
+            return(False)
+        last_start[0] = start
+        return(True)
+    try :
+        with open(file_spec, 'rb') as epg_file :
+            xmltodict.parse(
+                epg_file, item_depth=2, item_callback=check_programme
+            )
+    except (
+        xmltodict.ParsingInterrupted, OSError, xml.parsers.expat.ExpatError
+    ) :
+        return(False)
+
+    return(True)
+
+#-------------------------------------------------------------------------------
+# Programmes of an EPG file with their start time, in start time order
+#
+# The sort is linear on programmes already in order.
+#
+def timed_programmes(file_spec) :
+    programmes = [
+        (to_epoch(programme['@start']), programme)
+            for programme in read_programmes(file_spec)
+    ]
+    programmes.sort(key=lambda item : item[0])
+
+    return(programmes)
+
+#-------------------------------------------------------------------------------
+# Finish a channel EPG file
+#
+# A guide grabbed in start time order is kept as written, streamed through
+# without being loaded. Otherwise, or to merge it with the existing one,
+# the programmes are put in order and written one by one over the temporary
+# file. The channel file is replaced atomically only if its content has
+# changed.
+#
+def finish_channel_epg(channel_name) :
+    import xmltodict
+    file_spec = channel_epg_file_spec(channel_name)
+    temporary_spec = temporary_file_spec(file_spec)
+    if merge_guides or not is_time_ordered(temporary_spec) :
+                                             # the new ones replace the old ones
+        new_programmes = timed_programmes(temporary_spec)
+        old_programmes = []
+        if merge_guides :
+            new_starts = set(start for (start, programme) in new_programmes)
+            oldest_stop = time.time() - merge_horizon
+            old_programmes = [
+                (start, programme)
+                    for (start, programme) in timed_programmes(file_spec)
+                        if start not in new_starts and
+                            to_epoch(programme['@stop']) >= oldest_stop
+            ]
+                                                      # merge the sorted streams
+        last_start = None
+        with open(temporary_spec, 'w') as epg_file :
+            epg_file.write(EPG_HEADER)
+            for (start, programme) in heapq.merge(
+                old_programmes, new_programmes, key=lambda item : item[0]
+            ) :
+                if start == last_start :
+                    continue
+                last_start = start
+                epg_file.write(xmltodict.unparse(
+                    {'programme' : programme},
+                    full_document=False, pretty=True, depth=1
+                ))
+            epg_file.write(EPG_FOOTER)
+                                                        # skip unchanged content
+    try :
+        unchanged = same_content(temporary_spec, file_spec)
+    except OSError :
+        unchanged = False
+    if unchanged :
+        os.remove(temporary_spec)
+        return(False)
+                                                            # replace atomically
+    os.replace(temporary_spec, file_spec)
+
+    return(True)
+
+#-------------------------------------------------------------------------------
+# Write a programme to its channel EPG file
+#
+# The channel files are shared by all the grabs of the run : a channel can
+# be described by the EIT of several multiplexes, in which case its
+# programmes are written only once.
+#
+def write_programme(programme, channel_ids, service_names=None) :
+    import xmltodict
+    if service_names is None :
+        service_names = {}
+                                                                  # find channel
+    channel_id = programme['@channel'].split('.')[0]
+    if channel_id in channel_ids :
+        channel_name = channel_ids[channel_id]
+    elif channel_id.isdigit() and int(channel_id) in service_names :
+        channel_name = service_names[int(channel_id)]
+    else :
+        return
+    programme_key = (channel_id, programme['@start'])
+                                                                 # write to file
+    with channel_epg_files_lock :
+        if programme_key in written_programmes :
+            return
+        written_programmes.add(programme_key)
+        if channel_id not in channel_epg_files :
+            channel_epg_files[channel_id] = (
+                channel_name, open_channel_epg(channel_name)
+            )
+        programme['@channel'] = channel_name.replace(' ', '_')
+        channel_epg_files[channel_id][1].write(xmltodict.unparse(
+            {'programme' : programme},
+            full_document=False, pretty=True, depth=1
+        ))
+
+#-------------------------------------------------------------------------------
+# Close the channel EPG files
+#
+def close_channel_epgs() :
+    for (channel_name, channel_epg_file) in channel_epg_files.values() :
+        channel_epg_file.write(EPG_FOOTER)
+        channel_epg_file.close()
+        if not finish_channel_epg(channel_name) and verbose :
+            print(INDENT + "%s unchanged" % channel_name)
+                                         # an interrupted grab is not up to date
+        if not grab_stopped.is_set() :
+            stamp_file_spec = grab_stamp_file_spec(channel_name)
+            with open(stamp_file_spec, 'a') :
+                os.utime(stamp_file_spec)
     if verbose :
         print('Found channels:')
-        for (channel_id, channel_name) in grabbed_channels.items() :
+        for (channel_id, (channel_name, channel_epg_file)) in \
+            channel_epg_files.items() :
             print(INDENT + "%s : %s" % (channel_id, channel_name))
-                                               # write individual program guides
-    if verbose :
-        print('Writing EPG files:')
-    for (channel_id, channel_name) in grabbed_channels.items() :
-                                                             # prepare file spec
-        no_space_channel_name = channel_name.replace(' ', '_')
-        channel_epg_file_spec = os.sep.join(
-            [epg_files_directory, no_space_channel_name + '.xml']
-        )
+
+#-------------------------------------------------------------------------------
+# Demultiplex program guides
+#
+# The grabbed EPG is parsed as a stream : each programme is written to its
+# channel file as soon as it has been read, so memory use doesn't depend
+# on the size of the grab.
+#
+def demultiplex_program_guides(channels, epg_file_spec) :
+    import xmltodict
+                                                                 # find channels
+    channel_ids = read_channel_ids(channels)
+                                                  # route programmes to channels
+    def route_programme(path, programme) :
+        write_programme(programme, channel_ids)
+        return(True)
+                                                          # stream EPG from file
+    epg_file = open(epg_file_spec, 'rb')
+    try :
+        xmltodict.parse(epg_file, item_depth=2, item_callback=route_programme)
+                                         # interrupted grab : keep what was read
+    except xml.parsers.expat.ExpatError :
         if verbose :
-            print(INDENT + channel_epg_file_spec)
-                                                     # separate programmes by id
-        channel_programmes = []
-        for programme in programmes :
-            individual_channel_id = programme['@channel'].split('.')[0]
-            if individual_channel_id == channel_id :
-                channel_programmes.append(programme)
-                channel_programmes[-1]['@channel'] = no_space_channel_name
-        programme_dict = {'tv' : {
-            '@generator-info-name': 'epg-grab',
-            'programme' : channel_programmes
-        }}
-                                                                   # add doctype
-        programme_xml = xmltodict.unparse(programme_dict, pretty=True)
-        programme_xml = programme_xml.replace(
-            "\n", "\n<!DOCTYPE tv SYSTEM \"xmltv.dtd\">\n", 1
-        )
-                                                                 # write to file
-        channel_epg_file = open(channel_epg_file_spec, 'w')
-        channel_epg_file.write(programme_xml)
-        channel_epg_file.write("\n")
-        channel_epg_file.close()
+            print(INDENT + "truncated EPG in %s" % epg_file_spec)
+    epg_file.close()
+
+#-------------------------------------------------------------------------------
+# Decode the programme guides from the EIT
+#
+# The built-in decoder replaces epgrab : the programmes go straight from
+# the demux to the channel files.
+#
+def decode_program_guides(channels, adapter) :
+    channel_ids = read_channel_ids(channels)
+    service_names = {}
+    statistics = {}
+    for programme in eit.programmes(
+        demux_spec(adapter), grab_timeout, settle_time,
+        service_names, statistics,
+        keep_going=lambda : not grab_stopped.is_set()
+    ) :
+        write_programme(programme, channel_ids, service_names)
+    print(INDENT + "adapter %d : %d events, %s" % (
+        adapter, statistics['events'], eit.statistics_string(statistics)
+    ))
+
+#-------------------------------------------------------------------------------
+# Stop the grabs on SIGINT or SIGTERM
+#
+# The workers see the stop, end their grabber or decoder and stop their
+# tuner, so that no child process is left holding an adapter.
+#
+def stop_grabs(signal_number, frame) :
+    grab_stopped.set()
+
+#-------------------------------------------------------------------------------
+# Grab the programme guide of a multiplex on the first free adapter
+#
+def grab_multiplex(multiplex_channels, channels, free_adapters) :
+    adapter = free_adapters.get()
+    output_file_spec = adapter_file_spec(epg_file_spec, adapter)
+    try :
+        if verbose :
+            print("Multiplex of %s on adapter %d" % (
+                ', '.join(multiplex_channels), adapter
+            ))
+        grabbed = False
+        if acquire_again and not grab_stopped.is_set() :
+                      # line buffered : the grabber error lines are written with
+                                       # the tuner output, the latter unbuffered
+            log_file = open(
+                adapter_file_spec(log_file_spec, adapter), 'w', buffering=1
+            )
+                                 # start tuner unless replaying or already tuned
+            tuner = None
+            if demux_spec(adapter).startswith('/dev/') and not already_tuned :
+                tuner = start_tuner(multiplex_channels[0], adapter, log_file)
+                                                          # grab programme guide
+            try :
+                if native_decoder :
+                    decode_program_guides(channels, adapter)
+                else :
+                    grab_EPG(adapter, output_file_spec, log_file)
+                                                                    # stop tuner
+            finally :
+                if tuner is not None :
+                    stop_tuner(tuner)
+                log_file.close()
+            grabbed = not grab_stopped.is_set()
+                                          # or the previous grab, if it is there
+        elif not acquire_again :
+            grabbed = os.path.exists(output_file_spec)
+                        # demultiplex program guides, before another grab reuses
+                                                # the output file of the adapter
+        if grabbed and not native_decoder :
+            demultiplex_program_guides(channels, output_file_spec)
+    finally :
+        free_adapters.put(adapter)
 
 # ==============================================================================
 # main script
 #
+def main(arguments=None) :
+    global tuner_adapters, channel_epg_files, written_programmes, \
+        channel_epg_files_lock, supervisor
+    parse_arguments(arguments)
+    if not tuner_adapters :
+        tuner_adapters = find_adapters()
                                                     # display working parameters
-if verbose :
-    print("Grabbing EPG for \"%s\"" % channel)
-    print(INDENT + "tuner demux        : \"%s\"" % tuner_demux)
-    print(INDENT + "channels list file : \"%s\"" % channels_list_file_spec)
-    print(INDENT + "output file        : \"%s\"" % epg_file_spec)
-    print(INDENT + "log file           : \"%s\"" % log_file_spec)
-                                                                   # start tuner
-if acquire_again :
-    start_tuner()
-                                                          # grab programme guide
-    grab_EPG()
-                                                                    # stop tuner
-    stop_tuner()
-                                                    # demultiplex program guides
-demultiplex_program_guides()
+    if verbose :
+        print("Grabbing EPG for %s" % ', '.join(
+            "\"%s\"" % channel for channel in channels_to_grab
+        ))
+        print(INDENT + "tuner adapters     : %s" % ', '.join(
+            str(adapter) for adapter in tuner_adapters
+        ))
+        print(INDENT + "tuner demux        : \"%s\"" % tuner_demux)
+        print(INDENT + "channels list file : \"%s\"" % channels_list_file_spec)
+        print(INDENT + "output file        : \"%s\"" % epg_file_spec)
+        print(INDENT + "log file           : \"%s\"" % log_file_spec)
+                                                   # group channels by multiplex
+    channels = read_channels_list()
+    multiplexes = group_by_multiplex(channels, channels_to_grab)
+                                     # grab the multiplexes on parallel adapters
+    if verbose :
+        print('Writing EPG files:')
+    free_adapters = queue.Queue()
+    for adapter in tuner_adapters :
+        free_adapters.put(adapter)
+    channel_epg_files = {}
+    written_programmes = set()
+    channel_epg_files_lock = threading.Lock()
+    supervisor = processSupervisor.Supervisor()
+                                 # signals can only be caught in the main thread
+    grab_stopped.clear()
+    handlers = {}
+    if threading.current_thread() is threading.main_thread() :
+        for signal_number in (signal.SIGINT, signal.SIGTERM) :
+            handlers[signal_number] = signal.signal(signal_number, stop_grabs)
+    try :
+        with concurrent.futures.ThreadPoolExecutor(
+            len(tuner_adapters)
+        ) as pool :
+            grabs = [
+                pool.submit(
+                    grab_multiplex, multiplex_channels, channels, free_adapters
+                ) for multiplex_channels in multiplexes
+            ]
+            for grab in grabs :
+                grab.result()
+    finally :
+        supervisor.stop_all()
+        for (signal_number, handler) in handlers.items() :
+            signal.signal(signal_number, handler)
+    close_channel_epgs()
+
+if __name__ == '__main__' :
+    main()
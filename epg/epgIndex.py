@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+#
+# Persistent index of the EPG files
+#
+# All the programmes of the channel EPG files are stored in an SQLite
+# database. A file is parsed again only when its modification time or size
+# has changed, so that the tools reading the EPG don't need to parse all the
+# XML files on every run.
+#
+import argparse
+import os
+import sqlite3
+import datetime
+import xml.parsers.expat
+
+# ------------------------------------------------------------------------------
+# constants
+#
+INDEX_FILE_NAME = '.epg-index.sqlite'
+SCHEMA_VERSION = 2
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS files (
+        file TEXT PRIMARY KEY,
+        mtime REAL,
+        size INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS programmes (
+        id INTEGER PRIMARY KEY,
+        file TEXT,
+        channel TEXT,
+        start INTEGER,
+        stop INTEGER,
+        start_text TEXT,
+        stop_text TEXT,
+        title TEXT,
+        sub_title TEXT,
+        episode TEXT,
+        description TEXT
+    );
+    CREATE INDEX IF NOT EXISTS programmes_file ON programmes (file);
+    CREATE INDEX IF NOT EXISTS programmes_channel
+        ON programmes (channel, start);
+    CREATE INDEX IF NOT EXISTS programmes_start ON programmes (start);
+'''
+PROGRAMME_COLUMNS = (
+    'channel', 'start', 'stop', 'start_text', 'stop_text',
+    'title', 'sub_title', 'episode', 'description', 'file'
+)
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# XMLTV time string to epoch seconds
+#
+def to_epoch(time_string) :
+    if ' ' in time_string :
+        time_object = datetime.datetime.strptime(time_string, '%Y%m%d%H%M%S %z')
+    else :
+        time_object = datetime.datetime.strptime(time_string, '%Y%m%d%H%M%S')
+
+    return(int(time_object.timestamp()))
+
+#-------------------------------------------------------------------------------
+# Text of an xmltodict element
+#
+def text_of(element) :
+    if isinstance(element, list) :
+        if not element :
+            return('')
+        element = element[0]
+    if isinstance(element, dict) :
+        return(element.get('#text', '') or '')
+    if element is None :
+        return('')
+
+    return(element)
+
+#-------------------------------------------------------------------------------
+# Open the index, creating or rebuilding it if needed
+#
+def open_index(index_file_spec) :
+    connection = sqlite3.connect(index_file_spec, timeout=30)
+    connection.row_factory = sqlite3.Row
+                                                      # rebuild on schema change
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    if version != SCHEMA_VERSION :
+        connection.executescript(
+            'DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS programmes;'
+        )
+    connection.executescript(SCHEMA)
+    connection.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+    connection.commit()
+
+    return(connection)
+
+#-------------------------------------------------------------------------------
+# Default index file spec for an EPG directory
+#
+def index_file_spec(epg_files_directory) :
+    return(os.sep.join([epg_files_directory, INDEX_FILE_NAME]))
+
+#-------------------------------------------------------------------------------
+# Parse the programmes of an EPG file into index rows
+#
+def parse_epg_file(epg_file_spec) :
+                                      # loaded when needed, being slow to import
+    import xmltodict
+    rows = []
+    def store_programme(path, programme) :
+        if len(path) != 2 or path[0][0] != 'tv' :
+            return(True)
+        if not isinstance(programme, dict) :
+            return(True)
+        try :
+            start = to_epoch(programme['@start'])
+            stop = to_epoch(programme['@stop'])
+        except (KeyError, ValueError) :
+            return(True)
+        rows.append((
+            programme.get('@channel', ''), start, stop,
+            programme['@start'], programme['@stop'],
+            text_of(programme.get('title')),
+            text_of(programme.get('sub-title')),
+            text_of(programme.get('episode-num')),
+            text_of(programme.get('desc')),
+            epg_file_spec
+        ))
+        return(True)
+    try :
+        with open(epg_file_spec, 'rb') as epg_file :
+            xmltodict.parse(
+                epg_file, item_depth=2, item_callback=store_programme
+            )
+    except (OSError, xml.parsers.expat.ExpatError) :
+        pass
+
+    return(rows)
+
+#-------------------------------------------------------------------------------
+# Update the index for the changed EPG files
+#
+# Only the files given, or all XML files of the directory, are checked.
+# Returns the list of reparsed files.
+#
+def update_index(connection, epg_files_directory, file_specs=None) :
+                                                                # list EPG files
+    all_files = file_specs is None
+    if all_files :
+        file_specs = []
+        for entry in os.scandir(epg_files_directory) :
+            if entry.name.endswith('.xml') and entry.is_file() :
+                file_specs.append(entry.path)
+    file_specs = [os.path.abspath(file_spec) for file_spec in file_specs]
+                                                            # compare with index
+    indexed = {}
+    for row in connection.execute('SELECT file, mtime, size FROM files') :
+        indexed[row['file']] = (row['mtime'], row['size'])
+    updated = []
+    for file_spec in file_specs :
+        try :
+            file_stat = os.stat(file_spec)
+        except OSError :
+            continue
+        file_state = (file_stat.st_mtime, file_stat.st_size)
+        if indexed.get(file_spec) == file_state :
+            continue
+                                                          # reparse changed file
+        rows = parse_epg_file(file_spec)
+        with connection :
+            connection.execute(
+                'DELETE FROM programmes WHERE file = ?', (file_spec,)
+            )
+            connection.executemany(
+                "INSERT INTO programmes (%s) VALUES (%s)" % (
+                    ', '.join(PROGRAMME_COLUMNS),
+                    ', '.join('?' * len(PROGRAMME_COLUMNS))
+                ),
+                rows
+            )
+            connection.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                (file_spec,) + file_state
+            )
+        updated.append(file_spec)
+                                                          # forget removed files
+    if all_files :
+        removed = set(indexed.keys()) - set(file_specs)
+        with connection :
+            for file_spec in removed :
+                connection.execute(
+                    'DELETE FROM programmes WHERE file = ?', (file_spec,)
+                )
+                connection.execute(
+                    'DELETE FROM files WHERE file = ?', (file_spec,)
+                )
+
+    return(updated)
+
+#-------------------------------------------------------------------------------
+# Query programmes
+#
+# The programmes are returned sorted by start time with the shape of
+# xmltodict-parsed XMLTV programmes.
+#
+def query_programmes(
+    connection, file_spec=None, start=None, stop=None, limit=None
+) :
+    conditions = []
+    parameters = []
+    if file_spec is not None :
+        conditions.append('file = ?')
+        parameters.append(os.path.abspath(file_spec))
+    if start is not None :
+        conditions.append('stop > ?')
+        parameters.append(start)
+    if stop is not None :
+        conditions.append('start < ?')
+        parameters.append(stop)
+    query = 'SELECT * FROM programmes'
+    if conditions :
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY start, channel'
+    if limit is not None :
+        query += ' LIMIT ?'
+        parameters.append(limit)
+
+    return([
+        to_programme(row) for row in connection.execute(query, parameters)
+    ])
+
+#-------------------------------------------------------------------------------
+# Index row to XMLTV programme
+#
+def to_programme(row) :
+    programme = {
+        '@channel' : row['channel'],
+        '@start' : row['start_text'],
+        '@stop' : row['stop_text'],
+        'title' : {'#text' : row['title']}
+    }
+    if row['sub_title'] :
+        programme['sub-title'] = {'#text' : row['sub_title']}
+    if row['episode'] :
+        programme['episode-num'] = {'#text' : row['episode']}
+    if row['description'] :
+        programme['desc'] = {'#text' : row['description']}
+
+    return(programme)
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(description='update the EPG index')
+    parser.add_argument(
+        '-d', '--dir', default='/home/control/Public/www',
+        help = 'the EPG files directory'
+    )
+    parser.add_argument(
+        '-i', '--index', default='',
+        help = 'the index file'
+    )
+    parser_arguments = parser.parse_args(arguments)
+    epg_files_directory = parser_arguments.dir
+    index_spec = parser_arguments.index
+    if index_spec == '' :
+        index_spec = index_file_spec(epg_files_directory)
+                                                                  # update index
+    connection = open_index(index_spec)
+    updated = update_index(connection, epg_files_directory)
+    print("Updated %d files" % len(updated))
+    for file_spec in updated :
+        print(INDENT + file_spec)
+    programmes_count = connection.execute(
+        'SELECT COUNT(*) FROM programmes'
+    ).fetchone()[0]
+    print("%d programmes in %s" % (programmes_count, index_spec))
+    connection.close()
+
+if __name__ == '__main__' :
+    main()
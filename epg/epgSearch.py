@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+#
+# Full-text search of the EPG programmes
+#
+# The titles, sub-titles and descriptions of the programmes are split in
+# words folded to lower case without accents, so that "Été" and "ete" are
+# the same word. An inverted index gives the programmes of every word, and
+# a second index gives the words sharing each trigram, so that the query
+# words also find longer words they begin and words with a small spelling
+# difference.
+#
+# The programmes are added and removed per EPG file, so that only the
+# changed files are indexed again in the resident EPG service. The command
+# line search builds the index for every run, and reports the total time
+# with the search time. The results are ranked by the weight of the fields
+# the words are found in and by the rarity of the words.
+#
+import argparse
+import os
+import re
+import math
+import time
+import unicodedata
+from collections import Counter
+import epgIndex
+
+# ------------------------------------------------------------------------------
+# constants
+#
+FIELD_WEIGHTS = (('title', 3), ('sub-title', 2), ('desc', 1))
+MIN_WORD_LENGTH = 2
+PREFIX_SIMILARITY = 0.8
+MIN_SIMILARITY = 0.5
+WORD_PATTERN = re.compile(r'\w+')
+LIGATURES = (('œ', 'oe'), ('æ', 'ae'))
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Text in lower case without accents
+#
+def fold(text) :
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(
+        character for character in text
+            if not unicodedata.combining(character)
+    ).casefold()
+    for (ligature, letters) in LIGATURES :
+        text = text.replace(ligature, letters)
+
+    return(text)
+
+#-------------------------------------------------------------------------------
+# Folded words of a text
+#
+def words_of(text) :
+    return([
+        word for word in WORD_PATTERN.findall(fold(text))
+            if len(word) >= MIN_WORD_LENGTH
+    ])
+
+#-------------------------------------------------------------------------------
+# Trigrams of a word, a short word being its own trigram
+#
+def trigrams_of(word) :
+    if len(word) < 3 :
+        return({word})
+
+    return(set(word[index:index + 3] for index in range(len(word) - 2)))
+
+# ==============================================================================
+# Index
+#
+
+#-------------------------------------------------------------------------------
+# Inverted index of the programmes
+#
+# The programmes have the shape of the xmltodict-parsed XMLTV programmes,
+# and every one gets a document id. The postings give the weight of a word
+# in each document.
+#
+class SearchIndex :
+
+    def __init__(self) :
+        self.documents = {}
+        self.document_words = {}
+        self.file_documents = {}
+        self.postings = {}
+        self.word_trigrams = {}
+        self.next_id = 0
+
+    def remove_file(self, file_spec) :
+        for document_id in self.file_documents.pop(file_spec, []) :
+            del self.documents[document_id]
+            for word in self.document_words.pop(document_id) :
+                postings = self.postings[word]
+                del postings[document_id]
+                if not postings :
+                    del self.postings[word]
+                    for trigram in trigrams_of(word) :
+                        self.word_trigrams[trigram].discard(word)
+                        if not self.word_trigrams[trigram] :
+                            del self.word_trigrams[trigram]
+
+    def add_file(self, file_spec, channel, programmes) :
+                                                 # replace the file's programmes
+        self.remove_file(file_spec)
+        document_ids = []
+        for programme in programmes :
+            document_id = self.next_id
+            self.next_id += 1
+            weights = Counter()
+            for (field, weight) in FIELD_WEIGHTS :
+                for word in words_of(epgIndex.text_of(programme.get(field))) :
+                    weights[word] += weight
+            self.documents[document_id] = (
+                channel, epgIndex.to_epoch(programme['@start']),
+                epgIndex.to_epoch(programme['@stop']), programme
+            )
+            self.document_words[document_id] = set(weights)
+            for (word, weight) in weights.items() :
+                if word not in self.postings :
+                    self.postings[word] = {}
+                    for trigram in trigrams_of(word) :
+                        self.word_trigrams.setdefault(trigram, set()).add(word)
+                self.postings[word][document_id] = weight
+            document_ids.append(document_id)
+        self.file_documents[file_spec] = document_ids
+
+    def files(self) :
+        return(set(self.file_documents))
+
+    def matching_words(self, query_word) :
+                             # the word itself, longer words and close spellings
+        words = {}
+                # a short word has no trigram, it only finds the words it begins
+        if len(query_word) < 3 :
+            for word in self.postings :
+                if word == query_word :
+                    words[word] = 1.0
+                elif word.startswith(query_word) :
+                    words[word] = PREFIX_SIMILARITY
+            return(words)
+        query_trigrams = trigrams_of(query_word)
+        shared = Counter()
+        for trigram in query_trigrams :
+            shared.update(self.word_trigrams.get(trigram, ()))
+        for (word, shared_count) in shared.items() :
+            if word == query_word :
+                similarity = 1.0
+            elif word.startswith(query_word) :
+                similarity = PREFIX_SIMILARITY
+            else :
+                similarity = shared_count / len(
+                    query_trigrams | trigrams_of(word)
+                )
+            if similarity >= MIN_SIMILARITY :
+                words[word] = similarity
+
+        return(words)
+
+    def search(self, query, start=None, stop=None, limit=None) :
+                                       # the programmes matching all query words
+        query_words = words_of(query)
+        if not query_words :
+            return([])
+        document_count = max(len(self.documents), 1)
+        scores = None
+        for query_word in query_words :
+            word_scores = {}
+            for (word, similarity) in self.matching_words(query_word).items() :
+                postings = self.postings[word]
+                rarity = math.log(1 + document_count / len(postings))
+                for (document_id, weight) in postings.items() :
+                    score = similarity * rarity * weight
+                    if score > word_scores.get(document_id, 0) :
+                        word_scores[document_id] = score
+            if scores is None :
+                scores = word_scores
+            else :
+                scores = dict(
+                    (document_id, score + word_scores[document_id])
+                        for (document_id, score) in scores.items()
+                            if document_id in word_scores
+                )
+                                                            # in the time window
+        results = []
+        for (document_id, score) in scores.items() :
+            (channel, programme_start, programme_stop, programme) = \
+                self.documents[document_id]
+            if start is not None and programme_stop <= start :
+                continue
+            if stop is not None and programme_start >= stop :
+                continue
+            results.append((score, programme_start, channel, programme))
+        results.sort(key=lambda result : (-result[0], result[1], result[2]))
+        if limit is not None :
+            results = results[:limit]
+
+        return([
+            (round(score, 2), channel, programme)
+                for (score, programme_start, channel, programme) in results
+        ])
+
+#-------------------------------------------------------------------------------
+# Update a search index from an EPG index
+#
+# Only the EPG files which have been parsed again, or which are missing from
+# the search index, are indexed again.
+#
+def update_search_index(search_index, connection, epg_files_directory) :
+    updated = set(epgIndex.update_index(connection, epg_files_directory))
+    file_specs = set(
+        row['file'] for row in connection.execute('SELECT file FROM files')
+    )
+    for file_spec in search_index.files() - file_specs :
+        search_index.remove_file(file_spec)
+    for file_spec in file_specs :
+        if file_spec in updated or file_spec not in search_index.files() :
+            channel = os.path.basename(file_spec)[:-len('.xml')]
+            search_index.add_file(
+                file_spec, channel.replace('_', ' '),
+                epgIndex.query_programmes(connection, file_spec)
+            )
+
+    return(updated)
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(description='search the EPG programmes')
+    parser.add_argument(
+        'query', nargs='+',
+        help = 'the words to search for'
+    )
+    parser.add_argument(
+        '-d', '--dir', default='/home/control/Public/www',
+        help = 'the EPG files directory'
+    )
+    parser.add_argument(
+        '-n', '--number', default=20,
+        help = 'the maximal number of results'
+    )
+    parser_arguments = parser.parse_args(arguments)
+    epg_files_directory = parser_arguments.dir
+                                                                   # build index
+    build_start = time.perf_counter()
+    connection = epgIndex.open_index(
+        epgIndex.index_file_spec(epg_files_directory)
+    )
+    search_index = SearchIndex()
+    update_search_index(search_index, connection, epg_files_directory)
+    connection.close()
+    build_time = time.perf_counter() - build_start
+                                                                        # search
+    search_start = time.perf_counter()
+    results = search_index.search(
+        ' '.join(parser_arguments.query), limit=int(parser_arguments.number)
+    )
+    search_time = time.perf_counter() - search_start
+    print("%d programmes, %d words indexed in %.1f ms" % (
+        len(search_index.documents), len(search_index.postings),
+        1000 * build_time
+    ))
+    print("%d results in %.2f ms, %.1f ms with the index build" % (
+        len(results), 1000 * search_time, 1000 * (build_time + search_time)
+    ))
+    for (score, channel, programme) in results :
+        print(INDENT + "%6.2f %s %s %s" % (
+            score, programme['@start'][:12], channel,
+            epgIndex.text_of(programme.get('title'))
+        ))
+
+if __name__ == '__main__' :
+    main()
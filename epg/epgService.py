@@ -0,0 +1,432 @@
+#!/usr/bin/python3
+#
+# EPG and schedule query service
+#
+# Serves the programmes of the channel EPG files and the recordings schedule
+# as JSON, next to the recordings served by the stream server. The parsed
+# data stays in memory and a file is only parsed again once it has changed,
+# the files being checked at most once a second.
+#
+# The responses are cached until the data changes, and are sent with an
+# ETag and gzip compressed, so that a client polling with If-None-Match only
+# gets a short Not Modified answer.
+#
+import argparse
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import datetime
+import xml.parsers.expat
+from collections import OrderedDict
+import epgIndex
+import epgSearch
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'recording'
+))
+import streamServer
+
+# ------------------------------------------------------------------------------
+# constants
+#
+API_PATH = '/api/'
+CHECK_PERIOD = 1
+DEFAULT_WINDOW = 2*60*60
+MAXIMAL_RESULTS = 1000
+CACHE_SIZE = 256
+GZIP_MIN_SIZE = 512
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Query time, as epoch seconds, "YYYYmmddHHMM" or "YYYYmmddHHMMSS"
+#
+def to_epoch(time_string) :
+    if len(time_string) == 12 :
+        time_string += '00'
+    if len(time_string) == 14 :
+        time_object = datetime.datetime.strptime(time_string, '%Y%m%d%H%M%S')
+        return(int(time_object.timestamp()))
+
+    return(int(time_string))
+
+#-------------------------------------------------------------------------------
+# EPG time string to ISO 8601
+#
+def to_iso(time_string) :
+    time_object = datetime.datetime.strptime(time_string, '%Y%m%d%H%M%S %z')
+
+    return(time_object.isoformat())
+
+#-------------------------------------------------------------------------------
+# Index row to JSON record
+#
+def to_record(channel, row) :
+    (
+        channel_id, start, stop, start_text, stop_text,
+        title, sub_title, episode, description, file_spec
+    ) = row
+
+    return({
+        'channel' : channel,
+        'start' : to_iso(start_text),
+        'stop' : to_iso(stop_text),
+        'title' : title,
+        'sub-title' : sub_title,
+        'episode' : episode,
+        'description' : description
+    })
+
+#-------------------------------------------------------------------------------
+# Entity tag of a response body
+#
+def entity_tag(body) :
+    return('"%s"' % hashlib.sha1(body).hexdigest()[:16])
+
+#-------------------------------------------------------------------------------
+# Check an If-None-Match header against an entity tag
+#
+def matches(header, tag) :
+    if header is None :
+        return(False)
+    for candidate in header.split(',') :
+        candidate = candidate.strip()
+        if candidate.startswith('W/') :
+            candidate = candidate[2:]
+        if candidate in ('*', tag) :
+            return(True)
+
+    return(False)
+
+# ==============================================================================
+# Data
+#
+
+#-------------------------------------------------------------------------------
+# In-memory EPG and schedule
+#
+# The programmes are kept per channel as index rows sorted by start time,
+# and the generation counts the changes of the data.
+#
+class EpgData :
+
+    def __init__(self, epg_files_directory, schedule_file_spec) :
+        self.epg_files_directory = epg_files_directory
+        self.schedule_file_spec = os.path.abspath(schedule_file_spec)
+        self.files = {}
+        self.channels = {}
+        self.schedule_state = None
+        self.schedule = []
+        self.search_index = epgSearch.SearchIndex()
+        self.generation = 0
+        self.check_time = None
+
+    def _read_schedule(self) :
+                                      # loaded when needed, being slow to import
+        import xmltodict
+        try :
+            with open(self.schedule_file_spec, 'r') as schedule_file :
+                schedule_dict = xmltodict.parse(schedule_file.read())
+        except (OSError, xml.parsers.expat.ExpatError) :
+            return([])
+        recordings = (schedule_dict.get('schedule') or {}).get('recording')
+        if recordings is None :
+            return([])
+        if not isinstance(recordings, list) :
+            recordings = [recordings]
+        schedule = []
+        for recording in recordings :
+            schedule.append({
+                'start' : to_iso(recording['start']),
+                'stop' : to_iso(recording['stop']),
+                'channel' : recording['channel'],
+                'title' : recording['title'],
+                'episode' : recording.get('episode') or '',
+                'tuner' : recording.get('tuner') or ''
+            })
+
+        return(schedule)
+
+    def refresh(self) :
+                                       # check the files at most once per period
+        now = time.monotonic()
+        if self.check_time is not None and \
+            now - self.check_time < CHECK_PERIOD :
+            return(False)
+        self.check_time = now
+        changed = False
+                                                             # channel EPG files
+        file_specs = set()
+        for entry in os.scandir(self.epg_files_directory) :
+            if not entry.name.endswith('.xml') or not entry.is_file() :
+                continue
+            if os.path.abspath(entry.path) == self.schedule_file_spec :
+                continue
+            file_specs.add(entry.path)
+            file_stat = entry.stat()
+            file_state = (file_stat.st_mtime, file_stat.st_size)
+            if self.files.get(entry.path, (None, None))[0] != file_state :
+                rows = epgIndex.parse_epg_file(entry.path)
+                self.files[entry.path] = (file_state, rows)
+                channel = os.path.basename(entry.path)[:-len('.xml')]
+                self.search_index.add_file(
+                    entry.path, channel.replace('_', ' '), [
+                        epgIndex.to_programme(
+                            dict(zip(epgIndex.PROGRAMME_COLUMNS, row))
+                        ) for row in rows
+                    ]
+                )
+                changed = True
+        for file_spec in set(self.files) - file_specs :
+            del self.files[file_spec]
+            self.search_index.remove_file(file_spec)
+            changed = True
+                                                                 # schedule file
+        try :
+            file_stat = os.stat(self.schedule_file_spec)
+            schedule_state = (file_stat.st_mtime, file_stat.st_size)
+        except OSError :
+            schedule_state = None
+        if schedule_state != self.schedule_state :
+            self.schedule_state = schedule_state
+            self.schedule = self._read_schedule()
+            changed = True
+        if changed :
+            channels = {}
+            for (file_spec, (file_state, rows)) in self.files.items() :
+                if rows :
+                    channel = os.path.basename(file_spec)[:-len('.xml')]
+                    channels[channel.replace('_', ' ')] = sorted(
+                        rows, key=lambda row : row[1]
+                    )
+            self.channels = channels
+            self.generation += 1
+
+        return(changed)
+
+    def channel_list(self) :
+        channels = []
+        for (channel, rows) in sorted(self.channels.items()) :
+            channels.append({
+                'name' : channel,
+                'programmes' : len(rows),
+                'first' : to_iso(rows[0][3]),
+                'last' : to_iso(rows[-1][4])
+            })
+
+        return(channels)
+
+    def programmes(self, channels=None, start=None, stop=None, limit=None) :
+        records = []
+        if channels is None :
+            channels = self.channels.keys()
+        for channel in channels :
+            for row in self.channels.get(channel, []) :
+                if start is not None and row[2] <= start :
+                    continue
+                if stop is not None and row[1] >= stop :
+                    break
+                records.append((row[1], channel, row))
+        records.sort(key=lambda record : record[:2])
+        if limit is not None :
+            records = records[:limit]
+
+        return([to_record(channel, row) for (start, channel, row) in records])
+
+    def search(self, text, start=None, limit=None) :
+                                                # ranked full-text search, timed
+        search_start = time.perf_counter()
+        results = self.search_index.search(text, start, None, limit)
+        records = []
+        for (score, channel, programme) in results :
+            records.append({
+                'score' : score,
+                'channel' : channel,
+                'start' : to_iso(programme['@start']),
+                'stop' : to_iso(programme['@stop']),
+                'title' : epgIndex.text_of(programme.get('title')),
+                'sub-title' : epgIndex.text_of(programme.get('sub-title')),
+                'episode' : epgIndex.text_of(programme.get('episode-num')),
+                'description' : epgIndex.text_of(programme.get('desc'))
+            })
+
+        search_time = 1000 * (time.perf_counter() - search_start)
+
+        return({'milliseconds' : round(search_time, 2), 'results' : records})
+
+# ==============================================================================
+# Service
+#
+
+#-------------------------------------------------------------------------------
+# Stream server with the EPG query API
+#
+class EpgService(streamServer.StreamServer) :
+
+    def __init__(self, directory, epg_data, verbose=False) :
+        streamServer.StreamServer.__init__(self, directory, verbose)
+        self.data = epg_data
+        self.refresh_lock = asyncio.Lock()
+        self.cache = OrderedDict()
+
+    async def _refresh(self) :
+                                            # parse without blocking the clients
+        async with self.refresh_lock :
+            if await asyncio.to_thread(self.data.refresh) :
+                self.cache.clear()
+
+    def _answer(self, endpoint, query, now) :
+        def parameter(name, default=None) :
+            return(query.get(name, [default])[0])
+        limit = min(int(parameter('limit', MAXIMAL_RESULTS)), MAXIMAL_RESULTS)
+        if endpoint == 'channels' :
+            return(self.data.channel_list())
+        if endpoint == 'programmes' :
+            start = parameter('from')
+            start = now if start is None else to_epoch(start)
+            stop = parameter('to')
+            stop = start + DEFAULT_WINDOW if stop is None else to_epoch(stop)
+            channels = query.get('channel')
+            return(self.data.programmes(channels, start, stop, limit))
+        if endpoint == 'search' :
+            return(self.data.search(parameter('q', ''), now, limit))
+        if endpoint == 'schedule' :
+            return(self.data.schedule)
+
+        return(None)
+
+    def _response(self, endpoint, query) :
+                                   # cached per minute, the default window start
+        now = int(time.time()) // 60 * 60
+        key = (endpoint, tuple(sorted(
+            (name, tuple(values)) for (name, values) in query.items()
+        )), now)
+        response = self.cache.get(key)
+        if response is not None :
+            self.cache.move_to_end(key)
+            return(response)
+        try :
+            answer = self._answer(endpoint, query, now)
+        except ValueError :
+            return(None)
+        if answer is None :
+            return(False)
+        body = json.dumps(answer, ensure_ascii=False).encode('utf-8')
+        compressed = None
+        if len(body) >= GZIP_MIN_SIZE :
+            compressed = gzip.compress(body, compresslevel=6, mtime=0)
+        response = (entity_tag(body), body, compressed)
+        self.cache[key] = response
+        if len(self.cache) > CACHE_SIZE :
+            self.cache.popitem(last=False)
+
+        return(response)
+
+    async def handle_request(
+        self, writer, method, path, query, headers, keep_alive
+    ) :
+        if not path.startswith(API_PATH) :
+            return(await streamServer.StreamServer.handle_request(
+                self, writer, method, path, query, headers, keep_alive
+            ))
+        await self._refresh()
+        response = self._response(path[len(API_PATH):].strip('/'), query)
+        if not response :
+            status = 404 if response is False else 400
+            await self.send_body(
+                writer, status, b'{}', JSON_CONTENT_TYPE, keep_alive
+            )
+            return(keep_alive)
+        (tag, body, compressed) = response
+        response_headers = [
+            ('ETag', tag), ('Cache-Control', 'no-cache'),
+            ('Vary', 'Accept-Encoding')
+        ]
+                                            # polling clients get a short answer
+        if matches(headers.get('if-none-match'), tag) :
+            await self.send_header(writer, 304, response_headers + [
+                ('Connection', 'keep-alive' if keep_alive else 'close')
+            ])
+            return(keep_alive)
+        if compressed is not None and \
+            'gzip' in headers.get('accept-encoding', '') :
+            body = compressed
+            response_headers.append(('Content-Encoding', 'gzip'))
+        await self.send_body(
+            writer, 200, body, JSON_CONTENT_TYPE, keep_alive,
+            method == 'HEAD', response_headers
+        )
+
+        return(keep_alive)
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='serve the EPG, the schedule and the recordings over HTTP'
+    )
+    parser.add_argument(
+        '-e', '--epg', default='/home/control/Public/www',
+        help = 'the EPG files directory'
+    )
+    parser.add_argument(
+        '-l', '--schedule', default='schedule.xml',
+        help = 'the recordings schedule file'
+    )
+    parser.add_argument(
+        '-d', '--dir', default='/media/storage/recordings',
+        help = 'the recordings directory'
+    )
+    parser.add_argument(
+        '-a', '--address', default='',
+        help = 'the address to listen on, all by default'
+    )
+    parser.add_argument(
+        '-p', '--port', default=streamServer.HTTP_PORT,
+        help = 'the HTTP port'
+    )
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
+    )
+    parser_arguments = parser.parse_args(arguments)
+    epg_files_directory = parser_arguments.epg
+    schedule_file_spec = parser_arguments.schedule
+    if os.sep not in schedule_file_spec:
+        schedule_file_spec = os.sep.join(
+            [epg_files_directory, schedule_file_spec]
+        )
+    verbose = parser_arguments.verbose
+                                                                         # serve
+    async def serve() :
+        service = EpgService(
+            parser_arguments.dir,
+            EpgData(epg_files_directory, schedule_file_spec), verbose
+        )
+        server = await service.start(
+            parser_arguments.address, int(parser_arguments.port)
+        )
+        if verbose :
+            print("Serving \"%s\" on port %d" % (
+                epg_files_directory, service.port()
+            ))
+        async with server :
+            await server.serve_forever()
+
+    try :
+        asyncio.run(serve())
+    except KeyboardInterrupt :
+        pass
+
+if __name__ == '__main__' :
+    main()
@@ -1,48 +1,107 @@
 #!/usr/bin/python3
 import argparse
 import os
-import xmltodict
+import re
+import sys
+import hashlib
+import time
 import datetime
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'epg'
+))
+import epgIndex
+import fileWatcher
+import ruleEngine
+import tunerAllocator
 
 # ------------------------------------------------------------------------------
 # constants
 #
+RECORDED_FILE_PATTERN = re.compile(
+    r'^(.*)-([0-9a-f]{8})-[0-9]{14}([+-][0-9]{4})?\.mp4$'
+)
+
+RECORDING_TUNERS = 1
+
 INDENT = '  '
 SEPARATOR = 80 * '-'
 
 # ------------------------------------------------------------------------------
 # command line arguments
 #
-parser = argparse.ArgumentParser()
+def parse_arguments(arguments=None) :
+    global rules_file_spec, epg_files_directory, schedule_file_spec, \
+        channels_list_file_spec, share_multiplexes, \
+        index_file_spec, recordings_directory, record_repeats, verbose
+    parser = argparse.ArgumentParser()
                                                                     # rules file
-parser.add_argument(
-    'rules', default='ruleSet.xml', nargs='?',
-    help = 'rules file'
-)
+    parser.add_argument(
+        'rules', default='ruleSet.xml', nargs='?',
+        help = 'rules file'
+    )
                                                            # epg files directory
-parser.add_argument(
-    '-d', '--dir', default='/home/control/Public/www',
-    help = 'the EPG files directory'
-)
+    parser.add_argument(
+        '-d', '--dir', default='/home/control/Public/www',
+        help = 'the EPG files directory'
+    )
                                                        # recording schedule file
-parser.add_argument(
-    '-l', '--schedule', default='schedule.xml',
-    help = 'the recordings schedule file'
-)
+    parser.add_argument(
+        '-l', '--schedule', default='schedule.xml',
+        help = 'the recordings schedule file'
+    )
+                                                            # channels list file
+    parser.add_argument(
+        '-c', '--channels', default='',
+        help = 'the DVB channels list file'
+    )
+                                                             # share multiplexes
+    parser.add_argument(
+        '-s', '--share', action='store_true', dest='share',
+        help = 'let programmes of the same multiplex share the tuner, ' +
+            'for recordProgrammes -s'
+    )
+                                                                # EPG index file
+    parser.add_argument(
+        '-i', '--index', default='',
+        help = 'the EPG index file'
+    )
+                                                     # recording files directory
+    parser.add_argument(
+        '-r', '--recordings', default='/media/storage/recordings',
+        help = 'the recordings directory'
+    )
+                                                                # record repeats
+    parser.add_argument(
+        '-R', '--repeats', action='store_true', dest='repeats',
+        help = 'record all airings of an episode'
+    )
                                                                      # verbosity
-parser.add_argument(
-    '-v', '--verbose', action='store_true', dest='verbose',
-    help = 'verbose console output'
-)
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
+    )
                                                   # parse command line arguments
-script_dir = os.path.dirname(os.path.realpath(__file__))
-parser_arguments = parser.parse_args()
-rules_file_spec = os.sep.join([script_dir, parser_arguments.rules])
-epg_files_directory = parser_arguments.dir
-schedule_file_spec = parser_arguments.schedule
-if os.sep not in schedule_file_spec:
-    schedule_file_spec = os.sep.join([epg_files_directory, schedule_file_spec])
-verbose = parser_arguments.verbose
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    parser_arguments = parser.parse_args(arguments)
+    rules_file_spec = os.sep.join([script_dir, parser_arguments.rules])
+    epg_files_directory = parser_arguments.dir
+    schedule_file_spec = parser_arguments.schedule
+    if os.sep not in schedule_file_spec:
+        schedule_file_spec = os.sep.join(
+            [epg_files_directory, schedule_file_spec]
+        )
+    channels_list_file_spec = parser_arguments.channels
+    if channels_list_file_spec == '' :
+        channels_list_file_spec = os.sep.join(
+            [epg_files_directory, 'channels-dvb.txt']
+        )
+    share_multiplexes = parser_arguments.share
+    index_file_spec = parser_arguments.index
+    if index_file_spec == '' :
+        index_file_spec = epgIndex.index_file_spec(epg_files_directory)
+    recordings_directory = parser_arguments.recordings
+    record_repeats = parser_arguments.repeats
+    verbose = parser_arguments.verbose
 
 # ==============================================================================
 # Internal functions
@@ -67,166 +126,232 @@ def to_string_long(datetime_object) :
     return(datetime.datetime.strftime(datetime_object, '%Y%m%d%H%M%S %z'))
 
 #-------------------------------------------------------------------------------
-# Check if a rule matches
+# Title as used in the recorded file names
+#
+def file_title(title) :
+    for charcater in " '" :
+        title = title.replace(charcater, '_')
+
+    return(title)
+
+#-------------------------------------------------------------------------------
+# Episode token of a programme
+#
+# The episode is identified by its episode number, else by its sub-title,
+# else by its description. Returns None if none of them is given.
+#
+def episode_token(programme) :
+    for (field, folded) in (
+        ('episode-num', False), ('sub-title', True), ('desc', True)
+    ) :
+        text = epgIndex.text_of(programme.get(field)).strip()
+        if text :
+            if folded :
+                text = ' '.join(ruleEngine.fold(text).split())
+            return(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8])
+
+    return(None)
+
+#-------------------------------------------------------------------------------
+# Episodes found in the recordings directory
 #
-def rule_matches(rule, channel, title) :
-                                                                 # check channel
-    channel_matches = False
-    if 'channel' in rule :
-        if rule['channel']['@name'] == channel :
-            channel_matches = True
-    else :
-        channel_matches = True
-                                                                 # check title
-    title_matches = False
-    if 'title' in rule :
-        rule_title = rule['title']
-        if '@is' in rule_title:
-            if rule_title['@is'] == title :
-                title_matches = True
-        if '@contains' in rule_title:
-            if rule_title['@contains'] in title :
-                title_matches = True
-
-    return(channel_matches and title_matches)
+def recorded_episodes() :
+    episodes = set()
+    try :
+        entries = list(os.scandir(recordings_directory))
+    except OSError :
+        return(episodes)
+    for entry in entries :
+        found = RECORDED_FILE_PATTERN.match(entry.name)
+        if found :
+            episodes.add((found.group(1), found.group(2)))
+
+    return(episodes)
 
 #-------------------------------------------------------------------------------
 # Build a list of programmes based on the rule set
 #
 def build_programme_list() :
+                                      # loaded when needed, being slow to import
+    import xmltodict
                                                           # read rules from file
     rules_file = open(rules_file_spec, 'r')
     rules_xml = rules_file.read()
     rules_file.close()
     rules_dict = xmltodict.parse(rules_xml)
-                                                          # build EPG files list
-    files_list = []
-    for file in os.listdir(epg_files_directory):
-        if file.endswith(".xml"):
-            epg_file_spec = os.path.join(epg_files_directory, file)
-            with open(epg_file_spec, 'r') as file:
-                last_line = file.read().splitlines()[-1]
-            if last_line == '</tv>' :
-                files_list.append(epg_file_spec)
-                                                         # build programmes list
-    programmes = []
-    for epg_file_spec in files_list :
-        epg_file = open(epg_file_spec, 'r')
-        epg_xml = epg_file.read()
-        epg_file.close()
-        epg_dict = xmltodict.parse(epg_xml)
-        programmes += epg_dict['tv']['programme']
-                                                            # loop through rules
+                     # read the programmes not yet ended from the EPG index, the
+                            # merged guides keeping past airings of the episodes
+    index = epgIndex.open_index(index_file_spec)
+    updated_files = epgIndex.update_index(index, epg_files_directory)
+    programmes = epgIndex.query_programmes(index, start=int(time.time()))
+    index.close()
+    if verbose :
+        print()
+        print("Reindexed %d EPG files" % len(updated_files))
+        for epg_file_spec in updated_files :
+            print(INDENT + epg_file_spec)
+                                                             # compile the rules
+    rules = ruleEngine.RuleSet(rules_dict['ruleSet']['rule'])
+                                                  # match programmes in one pass
     if verbose :
         print()
         print('Checking rules')
+    rule_matches = [[] for rule in rules.rules]
+    for programme in programmes :
+        matched_rules = rules.match(
+            programme['@channel'], programme['title']['#text'],
+            to_datetime(programme['@start']), to_datetime(programme['@stop'])
+        )
+        if matched_rules :
+            programme['priority'] = max(
+                rules.priority(rule_index) for rule_index in matched_rules
+            )
+            rule_matches[matched_rules[0]].append(programme)
+                                                          # keep the rules order
     matches = []
-    for rule in rules_dict['ruleSet']['rule'] :
+    for (rule, programmes) in zip(rules.rules, rule_matches) :
         if verbose :
             print("\n")
             print(rule)
-        for programme in programmes :
-            channel = programme['@channel']
-            title = programme['title']['#text']
-            if rule_matches(rule, channel, title) :
-                matches.append(programme)
-                if verbose :
-                    print()
-                    print(programme)
+            for programme in programmes :
+                print()
+                print(programme)
+        matches += programmes
+                                                         # identify the episodes
+    recorded = recorded_episodes()
+    to_record = []
+    skipped = []
+    for programme in matches :
+        title = programme['title']['#text']
+        token = episode_token(programme)
+        programme['episode'] = token
+        programme['identity'] = None
+        if token is not None and not record_repeats :
+            programme['identity'] = (ruleEngine.fold(title), token)
+        if (file_title(title), token) in recorded and not record_repeats :
+            skipped.append(programme)
+        else :
+            to_record.append(programme)
+    if verbose and skipped :
+        print()
+        print('Already recorded')
+        for programme in skipped :
+            print(INDENT + "%s, %s" % (
+                programme['@channel'].replace('_', ' '),
+                programme['title']['#text']
+            ))
 
-    return(matches)
+    return(to_record)
 
 #-------------------------------------------------------------------------------
 # Build a schedule based on the recordings list
 #
 def build_schedule(programmes) :
-    schedule = []
+    multiplexes = tunerAllocator.read_multiplexes(channels_list_file_spec)
     if verbose :
         print()
         print('Building schedule')
-                                                       # loop through programmes
+                                                            # prepare recordings
+    recordings = []
     for programme in programmes :
         channel = programme['@channel']
-        title = programme['title']['#text']
-        start = to_datetime(programme['@start'])
-        stop = to_datetime(programme['@stop'])
-                                                    # check if time slot is free
-        time_slot_is_free = True
-        for occupied in schedule :
-            occupied_start = occupied['start']
-            occupied_stop = occupied['stop']
-                                                        # starts within occupied
-            if (start > occupied_start) and (start < occupied_stop) :
-                time_slot_is_free = False
-                                                          # ends within occupied
-            if (stop > occupied_start) and (stop < occupied_stop) :
-                time_slot_is_free = False
-                                                          # ranges over occupied
-            if (start < occupied_start) and (stop > occupied_stop) :
-                time_slot_is_free = False
-        if time_slot_is_free :
-            if verbose :
-                print(INDENT + "%s - %s : %s" %
-                    (to_string(start), to_string(stop), title)
-                )
-            schedule.append({
-                'start' : start,
-                'stop' : stop,
-                'channel' : channel.replace('_', ' '),
-                'title' : title
-            })
-        else :
-            if verbose :
-                print(2*INDENT + "slot %s - %s for \"%s\" is occupied" %
-                    (to_string(start), to_string(stop), title)
-                )
-                                                            # sort by start time
-    sorting_dict = {}
-    for item in schedule :
-        epoch = int(item['start'].timestamp())
-        sorting_dict[epoch] = item
-    sorted_scedule = []
-    for key in sorted(sorting_dict.keys()) :
-        sorted_scedule.append(sorting_dict[key])
-
-    return(sorted_scedule)
+        multiplex = None
+        if share_multiplexes :
+            multiplex = multiplexes.get(channel, channel)
+        recordings.append({
+            'start' : to_datetime(programme['@start']),
+            'stop' : to_datetime(programme['@stop']),
+            'channel' : channel.replace('_', ' '),
+            'title' : programme['title']['#text'],
+            'multiplex' : multiplex,
+            'priority' : programme.get('priority', 0),
+            'episode' : programme.get('episode'),
+            'identity' : programme.get('identity')
+        })
+                      # recordProgrammes records on a single adapter, one tuning
+                               # at a time : overlapping recordings which cannot
+                                            # share it are reported as conflicts
+    (schedule, conflicts) = tunerAllocator.allocate(
+        recordings, RECORDING_TUNERS
+    )
+    if verbose :
+        for recording in schedule :
+            print(INDENT + "%s - %s : %s (tuner %d)" % (
+                to_string(recording['start']), to_string(recording['stop']),
+                recording['title'], recording['tuner']
+            ))
+                                                              # report conflicts
+    if conflicts :
+        print()
+        print('Conflicts:')
+        for recording in conflicts :
+            print(INDENT + "%s - %s : %s, %s" % (
+                to_string(recording['start']), to_string(recording['stop']),
+                recording['channel'], recording['title']
+            ))
+            print(2*INDENT + recording['reason'])
+
+    return((schedule, conflicts))
 
 # ==============================================================================
 # main script
 #
+def main(arguments=None) :
+    import xmltodict
+    parse_arguments(arguments)
                                                     # display working parameters
-if verbose :
-    print("Building recording schedule")
-    print(INDENT + "rules file     : \"%s\"" % rules_file_spec)
-    print(INDENT + "schedules file : \"%s\"" % schedule_file_spec)
-    print(INDENT + "epg directory  : \"%s\"" % epg_files_directory)
+    if verbose :
+        print("Building recording schedule")
+        print(INDENT + "rules file     : \"%s\"" % rules_file_spec)
+        print(INDENT + "schedules file : \"%s\"" % schedule_file_spec)
+        print(INDENT + "epg directory  : \"%s\"" % epg_files_directory)
+        print(INDENT + "epg index      : \"%s\"" % index_file_spec)
+        print(INDENT + "channels file  : \"%s\"" % channels_list_file_spec)
+        print(INDENT + "share tuner    : %s" % share_multiplexes)
+        print(INDENT + "recordings     : \"%s\"" % recordings_directory)
                                                           # build programme list
-to_record = build_programme_list()
+    to_record = build_programme_list()
                                                                 # build schedule
-schedule = build_schedule(to_record)
+    (schedule, conflicts) = build_schedule(to_record)
                                                                  # write to file
-if verbose :
-    print()
-    print('Schedule:')
-recording_list = []
-for recording in schedule :
     if verbose :
-        print(INDENT + "%s - %s : %s, %s" % (
-            to_string(recording['start']),
-            to_string(recording['stop']),
-            recording['channel'],
-            recording['title']
-        ))
-    recording_list.append({
-        'start' : to_string_long(recording['start']),
-        'stop' : to_string_long(recording['stop']),
-        'channel' : recording['channel'],
-        'title' : recording['title']
-    })
-schedule_file = open(schedule_file_spec, 'w')
-schedule_file.write(xmltodict.unparse(
-    {'schedule' : {'recording' : recording_list}},
-    pretty=True
-))
-schedule_file.write("\n")
-schedule_file.close()
+        print()
+        print('Schedule:')
+    recording_list = []
+    for recording in schedule :
+        if verbose :
+            print(INDENT + "%s - %s : %s, %s" % (
+                to_string(recording['start']),
+                to_string(recording['stop']),
+                recording['channel'],
+                recording['title']
+            ))
+        recording_entry = {
+            'start' : to_string_long(recording['start']),
+            'stop' : to_string_long(recording['stop']),
+            'channel' : recording['channel'],
+            'title' : recording['title'],
+            'tuner' : recording['tuner']
+        }
+        if recording['episode'] is not None :
+            recording_entry['episode'] = recording['episode']
+        recording_list.append(recording_entry)
+    conflict_list = []
+    for recording in conflicts :
+        conflict_list.append({
+            'start' : to_string_long(recording['start']),
+            'stop' : to_string_long(recording['stop']),
+            'channel' : recording['channel'],
+            'title' : recording['title'],
+            'reason' : recording['reason']
+        })
+                                            # replaced under the recordings loop
+    fileWatcher.write_file(schedule_file_spec, xmltodict.unparse(
+        {'schedule' : {
+            'recording' : recording_list, 'conflict' : conflict_list
+        }},
+        pretty=True
+    ) + "\n")
+
+if __name__ == '__main__' :
+    main()
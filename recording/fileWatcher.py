@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+#
+# File change notification
+#
+# The changes of a file are notified by inotify on its directory, so that
+# the editors and the tools replacing the file atomically are also seen.
+# Where inotify is not available, the modification time, size and inode of
+# the file are checked periodically, without reading the file.
+#
+# A wait can be interrupted from another thread, so that a resident loop
+# waiting for changes can be stopped without delay.
+#
+# The watched files are to be replaced atomically by their writers, a change
+# being only notified once a file has been written and closed or renamed.
+#
+import os
+import select
+import struct
+import time
+import ctypes
+import ctypes.util
+
+# ------------------------------------------------------------------------------
+# constants
+#
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 4096
+POLLING_PERIOD = 5
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# inotify file descriptor watching a directory, or None
+#
+def open_inotify(directory) :
+    library_name = ctypes.util.find_library('c')
+    try :
+        libc = ctypes.CDLL(library_name, use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError) :
+        return(None)
+    inotify_add_watch.argtypes = (
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+    )
+    file_descriptor = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if file_descriptor < 0 :
+        return(None)
+    if inotify_add_watch(
+        file_descriptor, os.fsencode(directory), WATCH_MASK
+    ) < 0 :
+        os.close(file_descriptor)
+        return(None)
+
+    return(file_descriptor)
+
+#-------------------------------------------------------------------------------
+# Replace a file atomically, so that a watcher never reads it half written
+#
+def write_file(file_spec, text) :
+    (directory, file_name) = os.path.split(file_spec)
+    temporary_file_spec = os.path.join(
+        directory, ".%s.%d.tmp" % (file_name, os.getpid())
+    )
+    with open(temporary_file_spec, 'w') as temporary_file :
+        temporary_file.write(text)
+    os.replace(temporary_file_spec, file_spec)
+
+#-------------------------------------------------------------------------------
+# File state as seen by stat
+#
+def file_state(file_spec) :
+    try :
+        file_stat = os.stat(file_spec)
+    except OSError :
+        return(None)
+
+    return((file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino))
+
+# ==============================================================================
+# Watcher
+#
+
+#-------------------------------------------------------------------------------
+# Watcher of a single file
+#
+class FileWatcher :
+
+    def __init__(self, file_spec, polling_period=POLLING_PERIOD) :
+        self.file_spec = os.path.abspath(file_spec)
+        self.file_name = os.fsencode(os.path.basename(self.file_spec))
+        self.polling_period = polling_period
+        self.state = file_state(self.file_spec)
+        self.inotify = open_inotify(os.path.dirname(self.file_spec))
+        (self.wake_reader, self.wake_writer) = os.pipe()
+        os.set_blocking(self.wake_reader, False)
+
+    def uses_inotify(self) :
+        return(self.inotify is not None)
+
+    def _read_events(self) :
+        changed = False
+        while True :
+            try :
+                events = os.read(self.inotify, READ_SIZE)
+            except BlockingIOError :
+                break
+            if not events :
+                break
+            position = 0
+            while position < len(events) :
+                (watch, mask, cookie, name_length) = EVENT_HEADER.unpack_from(
+                    events, position
+                )
+                position += EVENT_HEADER.size
+                name = events[position:position + name_length].rstrip(b'\0')
+                position += name_length
+                if name == self.file_name :
+                    changed = True
+
+        return(changed)
+
+    def changed(self) :
+                                 # events are only hints, the file state decides
+        if self.inotify is not None :
+            if not self._read_events() :
+                return(False)
+        state = file_state(self.file_spec)
+        if state == self.state :
+            return(False)
+        self.state = state
+
+        return(True)
+
+    def wait(self, timeout) :
+        deadline = time.monotonic() + max(timeout, 0)
+        while True :
+            if self.changed() :
+                return(True)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 :
+                return(False)
+            descriptors = [self.wake_reader]
+            if self.inotify is not None :
+                descriptors.append(self.inotify)
+            else :
+                remaining = min(remaining, self.polling_period)
+            (readable, writable, failed) = select.select(
+                descriptors, [], [], remaining
+            )
+            if self.wake_reader in readable :
+                try :
+                    os.read(self.wake_reader, READ_SIZE)
+                except BlockingIOError :
+                    pass
+                return(False)
+
+    def wake(self) :
+        if self.wake_reader is not None :
+            os.write(self.wake_writer, b'\0')
+
+    def close(self) :
+        if self.inotify is not None :
+            os.close(self.inotify)
+            self.inotify = None
+        if self.wake_reader is not None :
+            os.close(self.wake_reader)
+            os.close(self.wake_writer)
+            self.wake_reader = None
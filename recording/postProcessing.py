@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+#
+# Post-processing queue
+#
+# The recorded transport streams are remuxed by ffmpeg through a queue
+# stored in a JSON file, so that the pending jobs survive a restart. Only a
+# bounded number of jobs run at once, at idle CPU and I/O priority, and the
+# running jobs are suspended while a recording is going on.
+#
+import argparse
+import os
+import json
+import time
+import shutil
+import signal
+import subprocess
+import processSupervisor
+
+# ------------------------------------------------------------------------------
+# constants
+#
+QUEUE_FILE_NAME = '.postprocessing-queue.json'
+TRANSCODING_COMMAND = 'ffmpeg'
+NICE_COMMAND = ('nice', '-n', '19')
+IONICE_COMMAND = ('ionice', '-c', '3')
+HISTORY_LENGTH = 50
+MEGABYTE = 1024 * 1024
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Default queue file spec for a recordings directory
+#
+def queue_file_spec(recordings_directory) :
+    return(os.sep.join([recordings_directory, QUEUE_FILE_NAME]))
+
+#-------------------------------------------------------------------------------
+# Command prefix lowering the CPU and I/O priorities
+#
+def priority_prefix() :
+    prefix = []
+    if shutil.which(NICE_COMMAND[0]) :
+        prefix += NICE_COMMAND
+    if shutil.which(IONICE_COMMAND[0]) :
+        prefix += IONICE_COMMAND
+
+    return(prefix)
+
+#-------------------------------------------------------------------------------
+# Remux command
+#
+def remux_command(input_file_spec, output_file_spec) :
+    return(priority_prefix() + [
+        TRANSCODING_COMMAND, '-nostdin', '-y', '-i', input_file_spec,
+        '-c', 'copy', output_file_spec
+    ])
+
+# ==============================================================================
+# Queue
+#
+
+#-------------------------------------------------------------------------------
+# Persistent job queue
+#
+# Jobs are dicts with 'input', 'output', 'state' and the 'added' time, the
+# finished ones getting their 'duration', 'size' and 'throughput'.
+#
+class JobQueue :
+
+    def __init__(self, file_spec, concurrency=1, verbose=False) :
+        self.file_spec = file_spec
+        self.supervisor = processSupervisor.Supervisor()
+        self.concurrency = concurrency
+        self.verbose = verbose
+        self.paused = False
+        self.paused_time = 0
+        self.running = {}
+        self.paused_durations = {}
+        self.jobs = []
+        self.history = []
+        self._load()
+
+    def _load(self) :
+        try :
+            with open(self.file_spec, 'r') as queue_file :
+                stored = json.load(queue_file)
+        except (OSError, ValueError) :
+            return
+        self.history = stored.get('history', [])
+                                       # jobs interrupted by a restart run again
+        for job in stored.get('jobs', []) :
+            job['state'] = 'queued'
+            self.jobs.append(job)
+
+    def _save(self) :
+        temporary_file_spec = "%s.%d.tmp" % (self.file_spec, os.getpid())
+        with open(temporary_file_spec, 'w') as queue_file :
+            json.dump(
+                {'jobs' : self.jobs, 'history' : self.history},
+                queue_file, indent=2
+            )
+        os.replace(temporary_file_spec, self.file_spec)
+
+    def add(self, input_file_spec, output_file_spec) :
+        self.jobs.append({
+            'input' : input_file_spec, 'output' : output_file_spec,
+            'state' : 'queued', 'added' : time.time()
+        })
+        self._save()
+        self.step()
+
+    def pending_inputs(self) :
+        return(set(job['input'] for job in self.jobs))
+
+    def is_busy(self) :
+        return(bool(self.jobs))
+
+    def pause(self) :
+        if self.paused :
+            return
+        self.paused = True
+        self.paused_time = time.monotonic()
+        for process in self.running.values() :
+            process.send_signal(signal.SIGSTOP)
+
+    def resume(self) :
+        if not self.paused :
+            return
+        self.paused = False
+        paused_duration = time.monotonic() - self.paused_time
+        for (output, process) in self.running.items() :
+            process.send_signal(signal.SIGCONT)
+            self.paused_durations[output] += paused_duration
+        self.step()
+
+    def _finish(self, job, process) :
+        del self.running[job['output']]
+        self.jobs.remove(job)
+                                             # the time spent paused is not used
+        job['duration'] = round(
+            process.duration() - self.paused_durations.pop(job['output']), 1
+        )
+        job['size'] = 0
+        try :
+            job['size'] = os.path.getsize(job['input'])
+        except OSError :
+            pass
+        job['throughput'] = 0
+        if job['duration'] > 0 :
+            job['throughput'] = round(
+                job['size'] / MEGABYTE / job['duration'], 2
+            )
+        job['state'] = 'done'
+        if process.returncode != 0 :
+            job['state'] = 'failed'
+            job['error'] = process.stderr_tail()[-1:]
+        self.history = (self.history + [job])[-HISTORY_LENGTH:]
+        if job['state'] == 'done' :
+            if self.verbose :
+                print(INDENT + "remuxed %s : %.1f MB in %g sec (%.2f MB/s)" % (
+                    os.path.basename(job['output']), job['size'] / MEGABYTE,
+                    job['duration'], job['throughput']
+                ))
+        else :
+            print(INDENT + "remuxing %s failed with code %d" % (
+                os.path.basename(job['output']), process.returncode
+            ))
+            for line in process.stderr_tail() :
+                print(2*INDENT + line)
+
+    def step(self) :
+                                                         # collect finished jobs
+        changed = False
+        for job in list(self.jobs) :
+            process = self.running.get(job['output'])
+            if process is not None and process.poll() is not None :
+                self._finish(job, process)
+                changed = True
+                                                             # start queued jobs
+        if not self.paused :
+            for job in self.jobs :
+                if len(self.running) >= self.concurrency :
+                    break
+                if job['state'] != 'queued' :
+                    continue
+                if self.verbose :
+                    print(INDENT + "remuxing to %s" % job['output'])
+                self.running[job['output']] = self.supervisor.start(
+                    'remuxing',
+                    remux_command(job['input'], job['output']),
+                    stdout=subprocess.DEVNULL
+                )
+                self.paused_durations[job['output']] = 0
+                job['state'] = 'running'
+                job['started'] = time.time()
+                changed = True
+        if changed :
+            self._save()
+        self.supervisor.reap()
+
+    def drain(self, period=1) :
+        self.resume()
+        while self.jobs :
+            self.step()
+            if self.running :
+                self.supervisor.wait_any(period)
+
+    def stop(self) :
+                                      # stopped jobs are queued again on restart
+        for process in self.running.values() :
+            process.send_signal(signal.SIGCONT)
+            process.stop()
+        self.running = {}
+        self.paused_durations = {}
+        self._save()
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='show or run the post-processing queue'
+    )
+    parser.add_argument(
+        '-d', '--dir', default='/media/storage/recordings',
+        help = 'the recordings directory'
+    )
+    parser.add_argument(
+        '-q', '--queue', default='',
+        help = 'the queue file'
+    )
+    parser.add_argument(
+        '-r', '--run', action='store_true', dest='run',
+        help = 'run the queued jobs'
+    )
+    parser.add_argument(
+        '-j', '--jobs', default=1,
+        help = 'the number of jobs run at once'
+    )
+    parser_arguments = parser.parse_args(arguments)
+    queue_spec = parser_arguments.queue
+    if queue_spec == '' :
+        queue_spec = queue_file_spec(parser_arguments.dir)
+                                                                    # show queue
+    job_queue = JobQueue(queue_spec, int(parser_arguments.jobs), verbose=True)
+    print("%d queued jobs" % len(job_queue.jobs))
+    for job in job_queue.jobs :
+        print(INDENT + "%s -> %s" % (job['input'], job['output']))
+    print("%d finished jobs" % len(job_queue.history))
+    for job in job_queue.history :
+        print(INDENT + "%s %s : %g sec, %.2f MB/s" % (
+            job['state'], os.path.basename(job['output']),
+            job['duration'], job['throughput']
+        ))
+                                                                     # run queue
+    if parser_arguments.run :
+        try :
+            job_queue.drain()
+        finally :
+            job_queue.stop()
+
+if __name__ == '__main__' :
+    main()
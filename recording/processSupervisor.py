@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+#
+# Supervision of the child processes
+#
+# The external tools (dvbv5-zap, epgrab, ffmpeg) are started as jobs of a
+# supervisor which keeps their handles. A job can be polled or waited for
+# with a timeout, and its exit code and the last lines of its error output
+# are kept. Every job runs in its own process group, so that stopping it
+# signals its processes only.
+#
+# Where the kernel supports it, a pidfd is opened for every job, so that
+# several jobs can be waited for at once with select.
+#
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+# ------------------------------------------------------------------------------
+# constants
+#
+STOP_TIMEOUT = 5
+STDERR_LINES = 20
+POLLING_PERIOD = 0.2
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# pidfd of a process, or None
+#
+def open_pidfd(pid) :
+    try :
+        return(os.pidfd_open(pid))
+    except (AttributeError, OSError) :
+        return(None)
+
+# ==============================================================================
+# Jobs
+#
+
+#-------------------------------------------------------------------------------
+# Supervised child process
+#
+class Job :
+
+    def __init__(self, name, command, stdout=None, stderr=None, log_file=None) :
+        self.name = name
+        self.command = command
+        self.stderr_lines = deque(maxlen=STDERR_LINES)
+        self.log_file = log_file
+        self.start_time = time.monotonic()
+        self.stop_time = None
+        self.returncode = None
+        self.stopped = False
+                                                      # capture the error output
+        if stderr is None :
+            stderr = subprocess.PIPE
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr,
+            start_new_session=True
+        )
+        self.pid = self.process.pid
+        self.pidfd = open_pidfd(self.pid)
+        self.reader = None
+        if stderr == subprocess.PIPE :
+            self.reader = threading.Thread(
+                target=self._read_stderr, daemon=True
+            )
+            self.reader.start()
+
+    def _read_stderr(self) :
+        for line in self.process.stderr :
+            line = line.decode('utf-8', 'replace')
+            self.stderr_lines.append(line.rstrip('\n'))
+            if self.log_file is not None :
+                self.log_file.write(line)
+        self.process.stderr.close()
+
+    def fileno(self) :
+        return(self.pidfd)
+
+    def _finished(self) :
+        if self.stop_time is None :
+            self.stop_time = time.monotonic()
+            self.returncode = self.process.returncode
+            if self.reader is not None :
+                self.reader.join(timeout=STOP_TIMEOUT)
+            if self.pidfd is not None :
+                os.close(self.pidfd)
+                self.pidfd = None
+
+    def poll(self) :
+        returncode = self.process.poll()
+        if returncode is not None :
+            self._finished()
+
+        return(returncode)
+
+    def is_running(self) :
+        return(self.poll() is None)
+
+    def wait(self, timeout=None) :
+        try :
+            returncode = self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired :
+            return(None)
+        self._finished()
+
+        return(returncode)
+
+    def duration(self) :
+        stop_time = self.stop_time
+        if stop_time is None :
+            stop_time = time.monotonic()
+
+        return(stop_time - self.start_time)
+
+    def send_signal(self, signal_number) :
+        if self.poll() is None :
+            try :
+                os.killpg(self.pid, signal_number)
+            except ProcessLookupError :
+                pass
+
+    def stop(self, signal_number=signal.SIGTERM, timeout=STOP_TIMEOUT) :
+                                                # ask first, then kill the group
+        if self.poll() is None :
+            self.stopped = True
+        self.send_signal(signal_number)
+        returncode = self.wait(timeout)
+        if returncode is None :
+            self.send_signal(signal.SIGKILL)
+            returncode = self.wait()
+
+        return(returncode)
+
+    def stderr_tail(self) :
+        return(list(self.stderr_lines))
+
+    def __repr__(self) :
+        return("%s (pid %d)" % (self.name, self.pid))
+
+# ==============================================================================
+# Supervisor
+#
+
+#-------------------------------------------------------------------------------
+# Set of jobs
+#
+class Supervisor :
+
+    def __init__(self) :
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def start(self, name, command, stdout=None, stderr=None, log_file=None) :
+        job = Job(name, command, stdout, stderr, log_file)
+        with self.lock :
+            self.jobs.append(job)
+
+        return(job)
+
+    def running(self, name=None) :
+        with self.lock :
+            jobs = list(self.jobs)
+
+        return([
+            job for job in jobs
+                if (name is None or job.name == name) and job.is_running()
+        ])
+
+    def reap(self) :
+                                           # forget the jobs which have finished
+        with self.lock :
+            finished = [job for job in self.jobs if job.poll() is not None]
+            self.jobs = [job for job in self.jobs if job not in finished]
+
+        return(finished)
+
+    def wait_any(self, timeout=None) :
+                                                        # pidfds become readable
+        running = self.running()
+        if not running :
+            return([])
+        deadline = None
+        if timeout is not None :
+            deadline = time.monotonic() + timeout
+        while True :
+            finished = [job for job in running if not job.is_running()]
+            if finished :
+                return(finished)
+            remaining = None
+            if deadline is not None :
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 :
+                    return([])
+            pidfds = [job for job in running if job.fileno() is not None]
+            if len(pidfds) == len(running) :
+                select.select(pidfds, [], [], remaining)
+            else :
+                if remaining is None :
+                    remaining = POLLING_PERIOD
+                time.sleep(min(remaining, POLLING_PERIOD))
+
+    def stop_all(self, timeout=STOP_TIMEOUT) :
+        for job in self.running() :
+            job.stop(timeout=timeout)
+        self.reap()
@@ -1,17 +1,40 @@
 #!/usr/bin/python3
 import argparse
 import os
-import xmltodict
+import sys
+import subprocess
 import time
 import datetime
-import pytz
-import psutil
+import fileWatcher
+import processSupervisor
+import tunerAllocator
+import postProcessing
+import recordingsRetention
+import tunerScheduler
 
 # ------------------------------------------------------------------------------
 # constants
 #
 RECORDING_COMMAND = 'dvbv5-zap'
+SPLITTER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'tsSplitter.py'
+)
+RECORDER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'tsRecorder.py'
+)
+BUILD_SCRIPT = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'buildSchedule.py'
+)
+DVR_DEVICE = '/dev/dvb/adapter%d/dvr0'
 OVERRUN_MARGIN = 5
+MAXIMAL_WAIT = 60
+QUEUE_CHECK_PERIOD = 5
+LOCK_PATTERN = 'Lock'
+LOCK_TIMEOUT = 10
+LOCK_CHECK_PERIOD = 0.1
+LOCK_LOG_FILE_NAME = 'tuner-lock.log'
+GRAB_LOG_FILE_NAME = 'epg-grab.log'
+PREROLL_SIZE = 4*1024*1024
 
 INDENT = '  '
 SEPARATOR = 80 * '-'
@@ -19,65 +42,166 @@ SEPARATOR = 80 * '-'
 # ------------------------------------------------------------------------------
 # command line arguments
 #
-parser = argparse.ArgumentParser()
+def parse_arguments(arguments=None) :
+    global parser_arguments, epg_files_directory, schedule_file_spec, \
+        recordings_directory, recording_file_spec, channels_file_spec, \
+        tuner_adapter, split_multiplex, buffered_recording, tuning_lead, \
+        keep_tuned_gap, queue_file_spec, post_processing_jobs, \
+        sampling_period, recordings_quota, free_space_floor, eviction_policy, \
+        grab_channels, grab_adapters, grab_interval, grab_timeout, \
+        rules_file_spec, verbose
+    parser = argparse.ArgumentParser()
                                                            # epg files directory
-parser.add_argument(
-    '-e', '--epg', default='/home/control/Public/www',
-    help = 'the EPG files directory'
-)
+    parser.add_argument(
+        '-e', '--epg', default='/home/control/Public/www',
+        help = 'the EPG files directory'
+    )
                                                        # recording schedule file
-parser.add_argument(
-    '-l', '--schedule', default='schedule.xml',
-    help = 'the recordings schedule file'
-)
+    parser.add_argument(
+        '-l', '--schedule', default='schedule.xml',
+        help = 'the recordings schedule file'
+    )
                                                      # recording files directory
-parser.add_argument(
-    '-d', '--dir', default='/media/storage/recordings',
-    help = 'the recordings directory'
-)
+    parser.add_argument(
+        '-d', '--dir', default='/media/storage/recordings',
+        help = 'the recordings directory'
+    )
                                                                 # recording file
-parser.add_argument(
-    '-f', '--file', default='recording.ts',
-    help = 'the recordings schedule file'
-)
+    parser.add_argument(
+        '-f', '--file', default='recording.ts',
+        help = 'the recordings schedule file'
+    )
                                                                  # channels file
-parser.add_argument(
-    '-c', '--channels', default='/home/control/Public/www/channels-dvb.txt',
-    help = 'the DVB channels file'
-)
+    parser.add_argument(
+        '-c', '--channels', default='/home/control/Public/www/channels-dvb.txt',
+        help = 'the DVB channels file'
+    )
                                                                  # tuner adapter
-parser.add_argument(
-    '-a', '--adapter', default=1,
-    help = 'the tuner adapter id'
-)
-                                                              # main loop period
-parser.add_argument(
-    '-p', '--period', default=1,
-    help = 'the period of the scheduling loop'
-)
+    parser.add_argument(
+        '-a', '--adapter', default=1,
+        help = 'the tuner adapter id'
+    )
+                                                    # record a multiplex at once
+    parser.add_argument(
+        '-s', '--split', action='store_true', dest='split',
+        help = 'record the overlapping programmes of a multiplex ' +
+            'with one tuning'
+    )
+                                                   # record with buffered writes
+    parser.add_argument(
+        '-b', '--buffered', action='store_true', dest='buffered',
+        help = 'record through the buffered recorder instead of dvbv5-zap'
+    )
+                                                  # tune ahead of the recordings
+    parser.add_argument(
+        '-w', '--warm', default=0,
+        help = 'the tuning lead time in seconds, recording through the splitter'
+    )
+    parser.add_argument(
+        '-k', '--keep', default=600,
+        help = 'the longest gap in seconds during which the tuner is kept on'
+    )
+                                                         # post-processing queue
+    parser.add_argument(
+        '-q', '--queue', default='',
+        help = 'the post-processing queue file'
+    )
+    parser.add_argument(
+        '-j', '--jobs', default=1,
+        help = 'the number of post-processing jobs run at once'
+    )
+                                                              # disk space usage
+    parser.add_argument(
+        '-u', '--quota', default=0,
+        help = 'the disk space quota of the recordings in GB, 0 for none'
+    )
+    parser.add_argument(
+        '-m', '--free', default=1,
+        help = 'the free disk space to keep in GB'
+    )
+    parser.add_argument(
+        '-o', '--order', default='oldest', choices=recordingsRetention.POLICIES,
+        help = 'the recordings removed first to make room'
+    )
+                                              # EPG grabs between the recordings
+    parser.add_argument(
+        '-g', '--grab', default='',
+        help = 'the comma-separated channels of which the EPG is grabbed ' +
+            'between the recordings'
+    )
+    parser.add_argument(
+        '-A', '--adapters', default='',
+        help = 'the comma-separated other adapters grabbing the EPG'
+    )
+    parser.add_argument(
+        '-i', '--interval', default=12,
+        help = 'the EPG grab interval in hours'
+    )
+    parser.add_argument(
+        '-t', '--timeout', default=900,
+        help = 'the longest EPG grab in seconds'
+    )
+    parser.add_argument(
+        '-r', '--rules', default='',
+        help = 'the buildSchedule rules file, ' +
+            'to build the schedule again after the EPG grabs'
+    )
+                                                    # schedule file check period
+    parser.add_argument(
+        '-p', '--period', default=5,
+        help = 'the schedule file check period without inotify'
+    )
                                                                      # verbosity
-parser.add_argument(
-    '-v', '--verbose', action='store_true', dest='verbose',
-    help = 'verbose console output'
-)
-                                                  # parse command line arguments
-parser_arguments = parser.parse_args()
-epg_files_directory = parser_arguments.epg
-schedule_file_spec = parser_arguments.schedule
-if os.sep not in schedule_file_spec:
-    schedule_file_spec = os.sep.join([epg_files_directory, schedule_file_spec])
-recordings_directory = parser_arguments.dir
-recording_file_spec = parser_arguments.file
-if os.sep not in recording_file_spec:
-    recording_file_spec = os.sep.join(
-        [recordings_directory, recording_file_spec]
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
     )
-channels_file_spec = parser_arguments.channels
-tuner_adapter = int(parser_arguments.adapter)
-sampling_period = float(parser_arguments.period)
-verbose = parser_arguments.verbose
+                                                  # parse command line arguments
+    parser_arguments = parser.parse_args(arguments)
+    epg_files_directory = parser_arguments.epg
+    schedule_file_spec = parser_arguments.schedule
+    if os.sep not in schedule_file_spec:
+        schedule_file_spec = os.sep.join(
+            [epg_files_directory, schedule_file_spec]
+        )
+    recordings_directory = parser_arguments.dir
+    recording_file_spec = parser_arguments.file
+    if os.sep not in recording_file_spec:
+        recording_file_spec = os.sep.join(
+            [recordings_directory, recording_file_spec]
+        )
+    channels_file_spec = parser_arguments.channels
+    tuner_adapter = int(parser_arguments.adapter)
+    split_multiplex = parser_arguments.split
+    buffered_recording = parser_arguments.buffered
+    tuning_lead = float(parser_arguments.warm)
+    keep_tuned_gap = float(parser_arguments.keep)
+    queue_file_spec = parser_arguments.queue
+    if queue_file_spec == '' :
+        queue_file_spec = postProcessing.queue_file_spec(recordings_directory)
+    post_processing_jobs = int(parser_arguments.jobs)
+    sampling_period = float(parser_arguments.period)
+    recordings_quota = \
+        float(parser_arguments.quota) * recordingsRetention.GIGABYTE
+    free_space_floor = \
+        float(parser_arguments.free) * recordingsRetention.GIGABYTE
+    eviction_policy = parser_arguments.order
+    grab_channels = [
+        channel for channel in parser_arguments.grab.split(',')
+            if channel.strip() != ''
+    ]
+    grab_adapters = [
+        int(adapter) for adapter in parser_arguments.adapters.split(',')
+            if adapter.strip() != ''
+    ]
+    grab_interval = float(parser_arguments.interval) * 3600
+    grab_timeout = float(parser_arguments.timeout)
+    rules_file_spec = parser_arguments.rules
+    verbose = parser_arguments.verbose
 
 build_new_timestamp = False
+schedule_watcher = None
+recording_stopped = False
 
 # ==============================================================================
 # Internal functions
@@ -101,6 +225,26 @@ def to_string(datetime_object) :
 def to_string_long(datetime_object) :
     return(datetime.datetime.strftime(datetime_object, '%Y%m%d%H%M%S %z'))
 
+#-------------------------------------------------------------------------------
+# read the schedule file
+#
+def read_schedule() :
+                                      # loaded when needed, being slow to import
+    import xmltodict
+    schedule_file = open(schedule_file_spec, 'r')
+    schedule_xml = schedule_file.read()
+    schedule_file.close()
+
+    return(xmltodict.parse(schedule_xml))
+
+#-------------------------------------------------------------------------------
+# recordings of the schedule, a list or a single one
+#
+def scheduled_recordings(schedule_dict) :
+    schedule = schedule_dict.get('schedule') or {}
+
+    return(schedule.get('recording') or [])
+
 #-------------------------------------------------------------------------------
 # timestamp for files
 #
@@ -114,38 +258,66 @@ def purge_old_recordings() :
     seconds_per_day = 60*60*24
     if verbose :
         print('Purging old recordings')
-                                                 # loop through recordings files
-    file_name_start = recording_file_spec.split(os.sep)[-1]
-    file_name_start = file_name_start.split('.')[0]
-    recordings_directory = os.sep.join(recording_file_spec.split(os.sep)[:-1])
+                                               # loop through indexed recordings
     current_time = time.time()
-    for file_name in os.listdir(recordings_directory) :
-        file_spec = os.sep.join([recordings_directory, file_name])
-        if os.path.isfile(file_spec) :
-            if file_name.startswith(file_name_start) :
-                file_time = os.stat(file_spec).st_mtime
-                if file_time < current_time - seconds_per_day :
-                    if verbose :
-                        print(INDENT + file_name)
-                    os.remove(file_spec)
+    protected_files = post_processing_files()
+    entries = recordings_index.update()
+    for (file_name, entry) in list(entries.items()) :
+        if entry['raw'] and file_name not in protected_files :
+            if entry['mtime'] < current_time - seconds_per_day :
+                recordings_index.remove(file_name)
 
 #-------------------------------------------------------------------------------
-# check if command is running
+# files of the post-processing queue
 #
-def is_running(command) :
+def post_processing_files() :
+    file_specs = post_processing.pending_inputs()
+    file_specs |= set(job['output'] for job in post_processing.jobs)
 
-    is_found = False
-    pid_list = psutil.pids()
-    for pid in pid_list :
-        try :
-            process_command = psutil.Process(pid).cmdline()
-        except :
-            process_command = []  # process has ended in between
-        if len(process_command) > 0 :
-            if process_command[0] == command :
-                is_found = True
+    return(set(os.path.basename(file_spec) for file_spec in file_specs))
 
-    return(is_found)
+#-------------------------------------------------------------------------------
+# make room for a recording
+#
+# The raw recording and its remuxed video both need the room, at the mean
+# rate of the recordings.
+#
+def make_room(duration, service_count) :
+    required_size = 2 * duration * service_count * recordings_index.byte_rate()
+    if verbose :
+        print(INDENT + "making room for %.1f MB" % (
+            required_size / recordingsRetention.MEGABYTE
+        ))
+    recordings_index.make_room(
+        required_size, recordings_quota, free_space_floor, eviction_policy,
+        post_processing_files()
+    )
+
+#-------------------------------------------------------------------------------
+# report the jobs which have ended
+#
+def report_jobs() :
+    for job in supervisor.reap() :
+        if job.returncode != 0 and not job.stopped :
+            print(INDENT + "%s ended with code %d" % (job.name, job.returncode))
+            for line in job.stderr_tail() :
+                print(2*INDENT + line)
+            continue
+        if verbose :
+            print(INDENT + "%s done in %d sec." % (job.name, job.duration()))
+                                         # the recorder ends with its statistics
+        if job.command[1:2] == [RECORDER_SCRIPT] :
+            for line in job.stderr_tail()[-1:] :
+                print(INDENT + "recorded %s" % line)
+
+#-------------------------------------------------------------------------------
+# recording name, with the episode token if any
+#
+def recording_name(recording) :
+    if recording.get('episode') :
+        return("%s-%s" % (recording['title'], recording['episode']))
+
+    return(recording['title'])
 
 #-------------------------------------------------------------------------------
 # find next recording start
@@ -153,7 +325,9 @@ def is_running(command) :
 def next_recording(schedule) :
 
     next_recording_start = datetime.datetime.now() + datetime.timedelta(days=10)
-    next_recording_start = next_recording_start.replace(tzinfo=pytz.UTC)
+    next_recording_start = next_recording_start.replace(
+        tzinfo=datetime.timezone.utc
+    )
     if isinstance(schedule, list) :
         for recording in schedule :
             start = to_datetime(recording['start'])
@@ -161,12 +335,12 @@ def next_recording(schedule) :
                 next_recording_start = start
                 next_recording_stop = to_datetime(recording['stop'])
                 next_recording_channel = recording['channel']
-                next_recording_title = recording['title']
+                next_recording_title = recording_name(recording)
     else :  # last element of list is only the dict
-        next_recording_start = to_datetime(schedule['stop'])
+        next_recording_start = to_datetime(schedule['start'])
         next_recording_stop = to_datetime(schedule['stop'])
         next_recording_channel = schedule['channel']
-        next_recording_title = schedule['title']
+        next_recording_title = recording_name(schedule)
 
     return(
         next_recording_start, next_recording_stop,
@@ -174,26 +348,227 @@ def next_recording(schedule) :
     )
 
 #-------------------------------------------------------------------------------
-# start recording
+# recordings of the same multiplex overlapping a recording
 #
-def start_recording(channel, duration) :
-                                                    # add timestamp to file spec
+def multiplex_recordings(schedule, channel, start, stop, chained=True) :
+    channels = tunerAllocator.read_channels(channels_file_spec)
+    if channel not in channels :
+        return([])
+    multiplex = tunerAllocator.multiplex_of(channels[channel])
+    candidates = []
+    if chained and isinstance(schedule, list) :
+        for recording in schedule :
+            recording_channel = recording['channel']
+            if recording_channel in channels and tunerAllocator.multiplex_of(
+                channels[recording_channel]
+            ) == multiplex :
+                candidates.append((
+                    to_datetime(recording['start']),
+                    to_datetime(recording['stop']),
+                    recording_channel, recording
+                ))
+    candidates.sort(key=lambda candidate : candidate[0])
+                                                  # chain overlapping recordings
+    group = [(start, stop, channel, None)]
+    for candidate in candidates :
+        (candidate_start, candidate_stop, candidate_channel) = candidate[:3]
+        if candidate_start < start :
+            continue
+        if candidate_start == start and candidate_channel == channel :
+            continue
+        if candidate_start >= stop :
+            break
+        group.append(candidate)
+        stop = max(stop, candidate_stop)
+    services = []
+    for (start, stop, channel, recording) in group :
+        services.append((
+            start, stop, channel, int(channels[channel]['SERVICE_ID'], 0),
+            recording
+        ))
+
+    return(services)
+
+#-------------------------------------------------------------------------------
+# multiplex of a channel, or None
+#
+def channel_multiplex(channel) :
+    channels = tunerAllocator.read_channels(channels_file_spec)
+    if channel not in channels :
+        return(None)
+
+    return(tunerAllocator.multiplex_of(channels[channel]))
+
+#-------------------------------------------------------------------------------
+# check if the next recording is soon on the same multiplex
+#
+def keeps_tuner(schedule, multiplex) :
+    if not isinstance(schedule, list) :
+        return(False)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    following = None
+    for recording in schedule :
+        start = to_datetime(recording['start'])
+        if (recording['start'], recording['channel']) in recorded :
+            continue
+        if start < now - datetime.timedelta(seconds=OVERRUN_MARGIN) :
+            continue
+        if following is None or start < to_datetime(following['start']) :
+            following = recording
+    if following is None :
+        return(False)
+    gap = (to_datetime(following['start']) - now).total_seconds()
+
+    return(
+        gap <= keep_tuned_gap and
+            channel_multiplex(following['channel']) == multiplex
+    )
+
+#-------------------------------------------------------------------------------
+# wait for the tuner lock and log its latency
+#
+def check_tuner_lock(tuner, channel, deadline) :
+    status = None
+    while status is None and tuner.is_running() :
+        for line in tuner.stderr_tail() :
+            if LOCK_PATTERN in line :
+                status = ' '.join(line.split())
+                break
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if status is None :
+            if now >= deadline :
+                break
+            time.sleep(LOCK_CHECK_PERIOD)
+    if status is None :
+        print(INDENT + "no lock on %s after %.1f sec" % (
+            channel, tuner.duration()
+        ))
+        return
+    latency = tuner.duration()
+    if verbose :
+        print(INDENT + "locked on %s in %.2f sec (%s)" % (
+            channel, latency, status
+        ))
+                                                   # to tune the warm start lead
+    log_file_spec = os.sep.join([recordings_directory, LOCK_LOG_FILE_NAME])
+    with open(log_file_spec, 'a') as log_file :
+        log_file.write("%s\t%s\t%.2f\t%s\n" % (
+            time_stamp(), channel, latency, status
+        ))
+
+#-------------------------------------------------------------------------------
+# timestamped recording file spec
+#
+def recording_file(suffix='') :
     file_parts = recording_file_spec.split('.')
     file_name = '.'.join(file_parts[:-1])
     file_extension = file_parts[-1]
-    output_file_spec = "%s-%s.%s" % (file_name, time_stamp(), file_extension)
+
+    return("%s%s-%s.%s" % (file_name, suffix, time_stamp(), file_extension))
+
+#-------------------------------------------------------------------------------
+# start recording
+#
+# Returns the recorded files with their titles and the recording jobs, the
+# first job ending with the recording.
+#
+def start_recording(channel, duration, title) :
+                                                    # add timestamp to file spec
+    output_file_spec = recording_file()
     if verbose :
         print(INDENT + output_file_spec)
                                                               # launch recording
-    os.system(
-        "%s -r '%s' -t %d -o '%s' -c '%s' -a %d >/dev/null 2>&1 &" % (
-            RECORDING_COMMAND,
-            channel, duration, output_file_spec,
-            channels_file_spec, tuner_adapter
-        )
+    if not buffered_recording :
+        recorder = supervisor.start('recording', [
+            RECORDING_COMMAND, '-r', channel, '-t', str(int(duration)),
+            '-o', output_file_spec, '-c', channels_file_spec,
+            '-a', str(tuner_adapter)
+        ], stdout=subprocess.DEVNULL)
+        return(([(output_file_spec, title)], [recorder]))
+                                           # tune and record from the DVR device
+    tuner = supervisor.start('tuner', [
+        RECORDING_COMMAND, '-c', channels_file_spec,
+        '-a', str(tuner_adapter), '-r', channel
+    ], stdout=subprocess.DEVNULL)
+    recorder = supervisor.start('recording', [
+        sys.executable, RECORDER_SCRIPT, DVR_DEVICE % tuner_adapter,
+        '-o', output_file_spec, '-t', str(int(duration)),
+        '-r', str(int(recordings_index.byte_rate()))
+    ], stdout=subprocess.DEVNULL)
+
+    return(([(output_file_spec, title)], [recorder, tuner]))
+
+#-------------------------------------------------------------------------------
+# start recording the services of a multiplex
+#
+def start_multiplex_recording(services, title, tuner=None) :
+                                                    # tune and pass all the PIDs
+    if tuner is None :
+        tuner = supervisor.start('tuner', [
+            RECORDING_COMMAND, '-c', channels_file_spec,
+            '-a', str(tuner_adapter), '-r', '-P', services[0][2]
+        ], stdout=subprocess.DEVNULL)
+                                                   # split the services to files
+    recorded_files = []
+    splitter_command = [
+        sys.executable, SPLITTER_SCRIPT, DVR_DEVICE % tuner_adapter
+    ]
+    if tuning_lead > 0 :
+        splitter_command += ['-p', str(PREROLL_SIZE)]
+    for (start, stop, channel, service_id, recording) in services :
+        output_file_spec = recording_file("-%d" % service_id)
+        if recording is not None :
+            title = recording_name(recording)
+        recorded_files.append((output_file_spec, title))
+        splitter_command += ['-s', "%d:%s:%d:%d" % (
+            service_id, output_file_spec, start.timestamp(), stop.timestamp()
+        )]
+        if verbose :
+            print(INDENT + "%s (%s, %s - %s)" % (
+                output_file_spec, channel, to_string(start), to_string(stop)
+            ))
+    splitter = supervisor.start(
+        'recording', splitter_command, stdout=subprocess.DEVNULL
     )
 
-    return(output_file_spec)
+    return((recorded_files, [splitter, tuner]))
+
+#-------------------------------------------------------------------------------
+# wait for the end of the recording jobs
+#
+def end_recording_jobs(jobs) :
+    if jobs[0].wait(OVERRUN_MARGIN) is None :
+        if verbose :
+            print(INDENT + "stopping %s" % jobs[0])
+    for job in jobs :
+        job.stop()
+    report_jobs()
+
+#-------------------------------------------------------------------------------
+# stop the recordings loop from another thread
+#
+def stop() :
+    global recording_stopped
+    recording_stopped = True
+    if schedule_watcher is not None :
+        schedule_watcher.wake()
+
+#-------------------------------------------------------------------------------
+# build the schedule again from the grabbed EPG
+#
+def build_schedule() :
+    if supervisor.running('schedule build') :
+        return
+    command = [
+        sys.executable, BUILD_SCRIPT, rules_file_spec,
+        '-d', epg_files_directory, '-l', schedule_file_spec,
+        '-c', channels_file_spec, '-r', recordings_directory
+    ]
+    if split_multiplex :
+        command.append('-s')
+    if verbose :
+        print(INDENT + "building the schedule with %s" % rules_file_spec)
+    supervisor.start('schedule build', command)
 
 #-------------------------------------------------------------------------------
 # end recording
@@ -211,116 +586,307 @@ def end_recording(recorded_file_spec, title) :
     ])
     for charcater in " '" :
         transcoded_file_spec = transcoded_file_spec.replace(charcater, '_')
-                                                     # wait for end of recording
-    if verbose :
-        print(INDENT, end = '')
-    record_done = False
-    while not record_done :
-        record_done = is_running(RECORDING_COMMAND)
-        if verbose :
-            print('.', end = '')
-        time.sleep(1)
-    if verbose :
-        print()
-                                                                # transcode file
-    print(INDENT + "transcoding to %s" % transcoded_file_spec)
-    os.system(
-        "ffmpeg -y -i '%s' -c copy '%s' >/dev/null 2>&1 &" % (
-            recorded_file_spec, transcoded_file_spec
-        )
-    )
+                                                         # queue the transcoding
+    print(INDENT + "queueing transcoding to %s" % transcoded_file_spec)
+    post_processing.add(recorded_file_spec, transcoded_file_spec)
 
 # ==============================================================================
 # main script
 #
+def main(arguments=None) :
+    global supervisor, post_processing, recordings_index, recorded, \
+        schedule_watcher, recording_stopped, tuner_scheduler
+    import xmltodict
+    parse_arguments(arguments)
+    recording_stopped = False
                                                     # display working parameters
-if verbose :
-    print("Controlling recordings")
-    print(INDENT + "schedules file      : \"%s\"" % schedule_file_spec)
-    print(INDENT + "epg directory       : \"%s\"" % epg_files_directory)
-    print(INDENT + "recording directory : \"%s\"" % recordings_directory)
-    print(INDENT + "recording file      : \"%s\"" % recording_file_spec)
-    print(INDENT + "DVB channels file   : \"%s\"" % channels_file_spec)
-    print(INDENT + "tuner adapter id    : %d" % tuner_adapter)
-    print(INDENT + "sampling period     : %g sec." % sampling_period)
-
-recording_end = False
-state = 'waiting'
-old_state = ''
-while not recording_end :
     if verbose :
-        if state != old_state :
-            if old_state in ('waiting', 'recording') :
+        print("Controlling recordings")
+        print(INDENT + "schedules file      : \"%s\"" % schedule_file_spec)
+        print(INDENT + "epg directory       : \"%s\"" % epg_files_directory)
+        print(INDENT + "recording directory : \"%s\"" % recordings_directory)
+        print(INDENT + "recording file      : \"%s\"" % recording_file_spec)
+        print(INDENT + "DVB channels file   : \"%s\"" % channels_file_spec)
+        print(INDENT + "tuner adapter id    : %d" % tuner_adapter)
+        if tuning_lead > 0 :
+            print(INDENT + "tuning lead         : %g sec." % tuning_lead)
+        print(INDENT + "post-processing     : \"%s\", %d jobs" % (
+            queue_file_spec, post_processing_jobs
+        ))
+        quota = 'no'
+        if recordings_quota :
+            quota = "%g GB" % float(parser_arguments.quota)
+        print(INDENT + "disk space          : %s quota, %g GB free, %s first"
+            % (quota, float(parser_arguments.free), eviction_policy)
+        )
+        if rules_file_spec :
+            print(INDENT + "schedule rules      : \"%s\"" % rules_file_spec)
+        if grab_channels :
+            print(INDENT + "EPG grabs           : %s, every %g h" % (
+                ', '.join(grab_channels), float(parser_arguments.interval)
+            ))
+            print(INDENT + "EPG grab adapters   : %s" % ', '.join(
+                str(adapter) for adapter in [tuner_adapter] + grab_adapters
+            ))
+                                                       # watch the schedule file
+    schedule_watcher = fileWatcher.FileWatcher(
+        schedule_file_spec, sampling_period
+    )
+    if verbose :
+        if schedule_watcher.uses_inotify() :
+            print(INDENT + "schedule check      : inotify")
+        else :
+            print(INDENT + "schedule check      : %g sec." % sampling_period)
+    supervisor = processSupervisor.Supervisor()
+                                    # the adapters are shared with the EPG grabs
+    tuner_scheduler = tunerScheduler.TunerScheduler(
+        [tuner_adapter] + grab_adapters, channels_file_spec,
+        epg_files_directory, grab_channels, grab_interval, grab_timeout,
+        supervisor, os.sep.join([recordings_directory, GRAB_LOG_FILE_NAME]),
+        verbose
+    )
+                                            # resume the pending post-processing
+    post_processing = postProcessing.JobQueue(
+        queue_file_spec, post_processing_jobs, verbose
+    )
+    post_processing.step()
+                               # index the recordings, probing in the background
+    recordings_index = recordingsRetention.RecordingsIndex(
+        recordings_directory,
+        os.path.basename(recording_file_spec).split('.')[0], verbose=verbose,
+        background=True
+    )
+    schedule_dict = read_schedule()
+    schedule_changed = False
+    recorded = set()
+    recording_multiplex = None
+    hot_tuner = None
+    built_grabs = 0
+    recording_end = False
+    state = 'waiting'
+    old_state = ''
+    while not recording_end and not recording_stopped :
+        grab_window = 0
+        if verbose :
+            if state != old_state :
+                if old_state in ('waiting', 'recording') :
+                    print()
+                print(state.replace('_', ' '))
+                old_state = state
+                                                   # reload the changed schedule
+        if schedule_changed :
+            if verbose :
                 print()
-            print(state.replace('_', ' '))
-            old_state = state
-                                                                 # read schedule
-    schedule_file = open(schedule_file_spec, 'r')
-    schedule_xml = schedule_file.read()
-    schedule_file.close()
-    schedule_dict = xmltodict.parse(schedule_xml)
+                print('reloading schedule')
+            schedule_dict = read_schedule()
+            schedule_changed = False
                                                     # waiting for next recording
-    if state == 'waiting' :
-        recording_list = schedule_dict['schedule']['recording']
+        if state == 'waiting' :
+            recording_list = scheduled_recordings(schedule_dict)
+                            # without recordings, keep grabbing the EPG if asked
+            if not recording_list :
+                recording_end = not grab_channels
+                seconds_to_wait = 0
+                if grab_channels :
+                    now = datetime.datetime.now(datetime.timezone.utc)
+                    next_event = now + datetime.timedelta(seconds=MAXIMAL_WAIT)
+                    seconds_to_wait = MAXIMAL_WAIT
+                    grab_window = None
+            else :
                                                      # find next recording start
-        (next_start, next_stop, channel, title) = next_recording(
-            recording_list
-        )
-        next_event = next_start
-        now = datetime.datetime.now(datetime.timezone.utc)
-        seconds_to_wait = (next_start - now).total_seconds()
+                (next_start, next_stop, channel, title) = next_recording(
+                    recording_list
+                )
+                next_event = next_start
+                now = datetime.datetime.now(datetime.timezone.utc)
+                seconds_to_wait = (next_start - now).total_seconds()
                                                        # remove overrun schedule
-        if seconds_to_wait < -OVERRUN_MARGIN :
-            if isinstance(recording_list, list) :
-                if verbose :
-                    print(
-                        "removing overrun schedule at %s" %
-                            (to_string(next_start))
-                    )
-                schedule_dict['schedule']['recording'] = [
-                    element for element in recording_list
-                        if not (element['start'] == to_string_long(next_start))
-                ]
-                schedule_file = open(schedule_file_spec, 'w')
-                schedule_file.write(xmltodict.unparse(schedule_dict, pretty=True))
-                schedule_file.close()
-            else :
-                if verbose :
-                    print('end of recodings list')
-                recording_end = True
+                                         # and the ones which have been recorded
+                is_recorded = (to_string_long(next_start), channel) in recorded
+                if seconds_to_wait < -OVERRUN_MARGIN or is_recorded :
+                    if not is_recorded :
+                        print("missed \"%s\" on %s at %s" % (
+                            title, channel, to_string(next_start)
+                        ))
+                    if isinstance(recording_list, list) :
+                        if verbose :
+                            print(
+                                "removing overrun schedule at %s" %
+                                    (to_string(next_start))
+                            )
+                        schedule_dict['schedule']['recording'] = [
+                            element for element in recording_list
+                                if element['start'] != \
+                                    to_string_long(next_start)
+                        ]
+                        fileWatcher.write_file(
+                            schedule_file_spec,
+                            xmltodict.unparse(schedule_dict, pretty=True)
+                        )
+                                                 # the last one has been removed
+                        if not schedule_dict['schedule']['recording'] :
+                            if verbose :
+                                print('end of recodings list')
+                            recording_end = not grab_channels
+                    else :
+                        if verbose :
+                            print('end of recodings list')
+                        schedule_dict['schedule']['recording'] = []
+                        recording_end = not grab_channels
+                    seconds_to_wait = 0
                                                                  # check if done
-        elif seconds_to_wait <= sampling_period :
-            state = 'starting_recording'
+                elif seconds_to_wait <= tuning_lead :
+                    state = 'starting_recording'
+                    seconds_to_wait = 0
+                                             # tune ahead of the recording start
+                else :
+                    seconds_to_wait -= tuning_lead
+                    next_event = next_start - \
+                        datetime.timedelta(seconds=tuning_lead)
+                                          # release a tuner kept on for too long
+                    if hot_tuner is not None and \
+                        seconds_to_wait > keep_tuned_gap :
+                        tuner_scheduler.stop_grab(tuner_adapter)
+                        hot_tuner[0].stop()
+                        hot_tuner = None
+                    grab_window = seconds_to_wait
                                                                # start recording
-    elif state == 'starting_recording' :
-        to_transcode = start_recording(
-            channel, (next_stop - now).total_seconds()
-        )
-        next_event = next_stop
-        seconds_to_wait = 0
-        state = 'recording'
+        elif state == 'starting_recording' :
+            tuner_scheduler.reserve(tuner_adapter, hot_tuner is not None)
+            post_processing.pause()
+            now = datetime.datetime.now(datetime.timezone.utc)
+            services = []
+            if split_multiplex or tuning_lead > 0 :
+                services = multiplex_recordings(
+                    schedule_dict['schedule']['recording'],
+                    channel, next_start, next_stop, split_multiplex
+                )
+                                             # make room for the whole recording
+            recording_stop = next_stop
+            if services :
+                recording_stop = max(service[1] for service in services)
+            make_room(
+                (recording_stop - now).total_seconds(), max(len(services), 1)
+            )
+            recording_multiplex = None
+            if services :
+                recording_multiplex = channel_multiplex(channel)
+                next_stop = max(service[1] for service in services)
+                for service in services :
+                    recorded.add((to_string_long(service[0]), service[2]))
+                                          # keep the tuner on the same multiplex
+                tuner = None
+                if hot_tuner is not None :
+                    (tuner, tuned_multiplex) = hot_tuner
+                    hot_tuner = None
+                    if tuned_multiplex != recording_multiplex or \
+                        not tuner.is_running() :
+                        tuner.stop()
+                        tuner = None
+                    elif verbose :
+                        print(INDENT + "tuner kept on %s" % channel)
+                (to_transcode, recording_jobs) = start_multiplex_recording(
+                    services, title, tuner
+                )
+                if tuner is None :
+                    check_tuner_lock(recording_jobs[-1], channel, max(
+                        next_start,
+                        now + datetime.timedelta(seconds=LOCK_TIMEOUT)
+                    ))
+            else :
+                recorded.add((to_string_long(next_start), channel))
+                (to_transcode, recording_jobs) = start_recording(
+                    channel, (next_stop - now).total_seconds(), title
+                )
+            next_event = next_stop
+            seconds_to_wait = 0
+            state = 'recording'
                                                   # waiting for end of recording
-    elif state == 'recording' :
-        now = datetime.datetime.now(datetime.timezone.utc)
-        seconds_to_wait = (next_stop - now).total_seconds()
-        if seconds_to_wait <= sampling_period :
-            state = 'stopping_recording'
+        elif state == 'recording' :
+            now = datetime.datetime.now(datetime.timezone.utc)
+            seconds_to_wait = (next_stop - now).total_seconds()
+            if seconds_to_wait <= 0 :
+                state = 'stopping_recording'
+                seconds_to_wait = 0
                                                                 # stop recording
-    elif state == 'stopping_recording' :
-        end_recording(to_transcode, title)
-        purge_old_recordings()
-        seconds_to_wait = 0
-        state = 'waiting'
-                                                      # wait for sampling period
-    if verbose :
+        elif state == 'stopping_recording' :
+            if recording_multiplex is not None and keeps_tuner(
+                schedule_dict['schedule']['recording'], recording_multiplex
+            ) :
+                hot_tuner = (recording_jobs.pop(), recording_multiplex)
+            end_recording_jobs(recording_jobs)
+            for (recorded_file_spec, recorded_title) in to_transcode :
+                end_recording(recorded_file_spec, recorded_title)
+            tuner_scheduler.release(tuner_adapter)
+            post_processing.resume()
+            purge_old_recordings()
+            if verbose and grab_channels :
+                for line in tuner_scheduler.report() :
+                    print(INDENT + line)
+            seconds_to_wait = 0
+            state = 'waiting'
+                                 # grab the EPG on the adapters free until their
+                                      # next reservation, keeping the tuned ones
+        if not recording_end :
+            tuned = {}
+            if hot_tuner is not None :
+                tuned[tuner_adapter] = hot_tuner[1]
+            tuner_scheduler.step({tuner_adapter : grab_window}, tuned)
+                                     # the schedule file change is seen as usual
+            if rules_file_spec and not tuner_scheduler.is_busy() and \
+                tuner_scheduler.completed > built_grabs :
+                built_grabs = tuner_scheduler.completed
+                build_schedule()
+                                  # wait for the next event or a schedule change
+                                   # with a bounded wait following clock changes
+                                       # and check the post-processing regularly
         if seconds_to_wait > 0 :
-            now_utc = pytz.utc.localize(datetime.datetime.now())
-            print(
-                INDENT +
-                "waiting from %s to %s (%d sec)" % (
-                    to_string(now_utc), to_string(next_event), seconds_to_wait
-                ) +
-                10*' ',
-                end = "\r"
-            )
-    time.sleep(sampling_period)
+            seconds_to_wait = min(seconds_to_wait, MAXIMAL_WAIT)
+            if post_processing.running and not post_processing.paused :
+                seconds_to_wait = min(seconds_to_wait, QUEUE_CHECK_PERIOD)
+            if tuner_scheduler.is_busy() :
+                seconds_to_wait = min(seconds_to_wait, QUEUE_CHECK_PERIOD)
+            next_grab = tuner_scheduler.next_due()
+            if next_grab is not None :
+                seconds_to_wait = min(
+                    seconds_to_wait, max(next_grab, QUEUE_CHECK_PERIOD)
+                )
+            if verbose :
+                now_utc = datetime.datetime.now().replace(
+                    tzinfo=datetime.timezone.utc
+                )
+                print(
+                    INDENT +
+                    "waiting from %s to %s (%d sec)" % (
+                        to_string(now_utc), to_string(next_event),
+                        seconds_to_wait
+                    ) +
+                    10*' ',
+                    end = "\r"
+                )
+            schedule_changed = schedule_watcher.wait(seconds_to_wait)
+        report_jobs()
+        post_processing.step()
+                                                # end the recording when stopped
+    if state == 'recording' :
+        end_recording_jobs(recording_jobs)
+        for (recorded_file_spec, recorded_title) in to_transcode :
+            end_recording(recorded_file_spec, recorded_title)
+    tuner_scheduler.stop()
+    if hot_tuner is not None :
+        hot_tuner[0].stop()
+    if verbose and grab_channels :
+        for line in tuner_scheduler.report() :
+            print(line)
+                                                      # let the transcodings end
+                                        # or queue them again for the next start
+    if recording_stopped :
+        post_processing.stop()
+    else :
+        post_processing.drain()
+    report_jobs()
+    schedule_watcher.close()
+    schedule_watcher = None
+
+if __name__ == '__main__' :
+    main()
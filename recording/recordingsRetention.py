@@ -0,0 +1,366 @@
+#!/usr/bin/python3
+#
+# Retention of the recordings
+#
+# The recordings of a directory, the raw transport streams and the remuxed
+# videos, are kept in an index stored in a JSON file with their size,
+# modification time, title and duration. The index is updated incrementally
+# from a directory scan, the duration being only probed for new or changed
+# files. The probes can run in the background, their results being taken
+# by the next updates, so that a scan never waits for them.
+#
+# Room is made for a new recording by removing recordings until a disk space
+# quota and a minimal free space are respected, in the order of an eviction
+# policy: the oldest, the largest or the already watched recordings first.
+# A video is taken as watched once it has been read after being written;
+# the access time set by a probe is restored for this.
+#
+import argparse
+import os
+import re
+import json
+import time
+import shutil
+import subprocess
+
+# ------------------------------------------------------------------------------
+# constants
+#
+INDEX_FILE_NAME = '.recordings-index.json'
+VIDEO_EXTENSION = '.mp4'
+PROBE_COMMAND = 'ffprobe'
+PROBE_TIMEOUT = 30
+PROBE_JOBS = 2
+TIMESTAMP_PATTERN = re.compile(r'-[0-9]{14}([+-][0-9]{4})?$')
+POLICIES = ('oldest', 'largest', 'watched')
+DEFAULT_BYTE_RATE = 1024 * 1024
+GIGABYTE = 1024 * 1024 * 1024
+MEGABYTE = 1024 * 1024
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Default index file spec for a recordings directory
+#
+def index_file_spec(recordings_directory) :
+    return(os.sep.join([recordings_directory, INDEX_FILE_NAME]))
+
+#-------------------------------------------------------------------------------
+# Title of a recording from its file name
+#
+def recording_title(file_name) :
+    title = os.path.splitext(file_name)[0]
+    title = TIMESTAMP_PATTERN.sub('', title)
+
+    return(title.replace('_', ' '))
+
+#-------------------------------------------------------------------------------
+# Start probing the duration of a video
+#
+def start_probe(file_spec) :
+    return(subprocess.Popen(
+        [
+            PROBE_COMMAND, '-v', 'error', '-show_entries',
+            'format=duration', '-of', 'csv=p=0', file_spec
+        ],
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    ))
+
+#-------------------------------------------------------------------------------
+# Duration of a finished probe in seconds, or None
+#
+def probe_duration(process, timeout=None) :
+    try :
+        output = process.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired :
+        process.kill()
+        process.communicate()
+        return(None)
+    try :
+        return(round(float(output.decode().strip()), 1))
+    except ValueError :
+        return(None)
+
+#-------------------------------------------------------------------------------
+# Eviction order of the index entries
+#
+def eviction_order(entries, policy) :
+    if policy == 'largest' :
+        key = lambda item : -item[1]['size']
+    elif policy == 'watched' :
+        key = lambda item : (not item[1]['watched'], item[1]['mtime'])
+    else :
+        key = lambda item : item[1]['mtime']
+
+    return([
+        file_name for (file_name, entry) in sorted(entries.items(), key=key)
+    ])
+
+# ==============================================================================
+# Index
+#
+
+#-------------------------------------------------------------------------------
+# Index of the recordings of a directory
+#
+# The entries are dicts with the 'size', 'mtime', 'title', 'duration' and
+# 'watched' state of a file, 'raw' telling a transport stream from a video,
+# and 'probed' once the duration has been probed.
+#
+class RecordingsIndex :
+
+    def __init__(
+        self, directory, raw_prefix, file_spec=None, verbose=False,
+        background=False
+    ) :
+        self.directory = directory
+        self.raw_prefix = raw_prefix
+        self.file_spec = file_spec
+        if self.file_spec is None :
+            self.file_spec = index_file_spec(directory)
+        self.verbose = verbose
+        self.background = background
+        self.entries = {}
+        self.probes = {}
+        self._load()
+
+    def _load(self) :
+        try :
+            with open(self.file_spec, 'r') as index_file :
+                self.entries = json.load(index_file)
+        except (OSError, ValueError) :
+            self.entries = {}
+
+    def _save(self) :
+        temporary_file_spec = "%s.%d.tmp" % (self.file_spec, os.getpid())
+        with open(temporary_file_spec, 'w') as index_file :
+            json.dump(self.entries, index_file, indent=2)
+        os.replace(temporary_file_spec, self.file_spec)
+
+    def _is_recording(self, file_name) :
+        if file_name.startswith('.') :
+            return(False)
+
+        return(
+            file_name.endswith(VIDEO_EXTENSION) or
+                file_name.startswith(self.raw_prefix)
+        )
+
+    def _start_probes(self) :
+                                               # a few probes at a time, at most
+        changed = False
+        for (file_name, entry) in self.entries.items() :
+            if len(self.probes) >= PROBE_JOBS :
+                break
+            if entry.get('probed', True) or file_name in self.probes :
+                continue
+            if not shutil.which(PROBE_COMMAND) :
+                entry['probed'] = True
+                changed = True
+                continue
+            file_spec = os.sep.join([self.directory, file_name])
+            try :
+                file_stat = os.stat(file_spec)
+            except OSError :
+                continue
+            self.probes[file_name] = (
+                start_probe(file_spec), file_stat, time.monotonic()
+            )
+
+        return(changed)
+
+    def _collect_probes(self, wait=False) :
+        changed = False
+        for (file_name, (process, file_stat, start)) in \
+            list(self.probes.items()) :
+            timeout = max(start + PROBE_TIMEOUT - time.monotonic(), 0)
+            if not wait and timeout > 0 and process.poll() is None :
+                continue
+            duration = probe_duration(process, timeout)
+            del self.probes[file_name]
+                                             # the probe has read the whole file
+            file_spec = os.sep.join([self.directory, file_name])
+            try :
+                os.utime(
+                    file_spec, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns)
+                )
+            except OSError :
+                pass
+                                            # unless the file changed in between
+            entry = self.entries.get(file_name)
+            if entry is None or entry['size'] != file_stat.st_size or \
+                entry['mtime'] != file_stat.st_mtime :
+                continue
+            entry['duration'] = duration
+            entry['probed'] = True
+            changed = True
+
+        return(changed)
+
+    def update(self) :
+                                     # only the new and changed files are probed
+        changed = self._collect_probes()
+        entries = {}
+        with os.scandir(self.directory) as directory_entries :
+            for directory_entry in directory_entries :
+                file_name = directory_entry.name
+                if not self._is_recording(file_name) :
+                    continue
+                if not directory_entry.is_file() :
+                    continue
+                file_stat = directory_entry.stat()
+                entry = self.entries.get(file_name)
+                if entry is None or entry['size'] != file_stat.st_size or \
+                    entry['mtime'] != file_stat.st_mtime :
+                    entry = {
+                        'size' : file_stat.st_size,
+                        'mtime' : file_stat.st_mtime,
+                        'title' : recording_title(file_name),
+                        'duration' : None,
+                        'raw' : not file_name.endswith(VIDEO_EXTENSION),
+                        'probed' : False
+                    }
+                    changed = True
+                watched = not entry['raw'] and \
+                    file_stat.st_atime > file_stat.st_mtime
+                if entry.get('watched') != watched :
+                    entry['watched'] = watched
+                    changed = True
+                entries[file_name] = entry
+        if set(entries) != set(self.entries) :
+            changed = True
+        self.entries = entries
+                                                # or wait for them in the script
+        while True :
+            changed |= self._start_probes()
+            if self.background or not self.probes :
+                break
+            changed |= self._collect_probes(wait=True)
+        if changed :
+            self._save()
+
+        return(self.entries)
+
+    def total_size(self) :
+        return(sum(entry['size'] for entry in self.entries.values()))
+
+    def byte_rate(self) :
+                                            # mean rate of the probed recordings
+        size = 0
+        duration = 0
+        for entry in self.entries.values() :
+            if entry['duration'] :
+                size += entry['size']
+                duration += entry['duration']
+        if duration == 0 :
+            return(DEFAULT_BYTE_RATE)
+
+        return(size / duration)
+
+    def remove(self, file_name) :
+        if self.verbose :
+            print(INDENT + "removing %s" % file_name)
+        try :
+            os.remove(os.sep.join([self.directory, file_name]))
+        except FileNotFoundError :
+            pass
+        self.entries.pop(file_name, None)
+        self._save()
+
+    def make_room(
+        self, required_size, quota=0, free_floor=0, policy='oldest',
+        protected=()
+    ) :
+                                         # remove recordings until the size fits
+        self.update()
+        removed = []
+        candidates = [
+            file_name for file_name in eviction_order(self.entries, policy)
+                if file_name not in protected
+        ]
+        while True :
+            total_size = self.total_size()
+            free_size = shutil.disk_usage(self.directory).free
+            over_quota = quota > 0 and total_size + required_size > quota
+            under_floor = free_size - required_size < free_floor
+            if not (over_quota or under_floor) :
+                break
+            if not candidates :
+                print(INDENT + "no recording left to free %.1f MB" % (
+                    required_size / MEGABYTE
+                ))
+                break
+            file_name = candidates.pop(0)
+            self.remove(file_name)
+            removed.append(file_name)
+
+        return(removed)
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='show the recordings index or make room in the directory'
+    )
+    parser.add_argument(
+        '-d', '--dir', default='/media/storage/recordings',
+        help = 'the recordings directory'
+    )
+    parser.add_argument(
+        '-f', '--file', default='recording',
+        help = 'the name start of the raw recording files'
+    )
+    parser.add_argument(
+        '-u', '--quota', default=0,
+        help = 'the disk space quota of the recordings in GB, 0 for none'
+    )
+    parser.add_argument(
+        '-m', '--free', default=0,
+        help = 'the free disk space to keep in GB'
+    )
+    parser.add_argument(
+        '-o', '--order', default='oldest', choices=POLICIES,
+        help = 'the recordings removed first'
+    )
+    parser.add_argument(
+        '-r', '--run', default=None,
+        help = 'make room for a recording of the given duration in minutes'
+    )
+    parser_arguments = parser.parse_args(arguments)
+                                                                    # show index
+    index = RecordingsIndex(
+        parser_arguments.dir, parser_arguments.file, verbose=True
+    )
+    index.update()
+    print("%d recordings, %.2f GB" % (
+        len(index.entries), index.total_size() / GIGABYTE
+    ))
+    for file_name in sorted(index.entries) :
+        entry = index.entries[file_name]
+        duration = '-'
+        if entry['duration'] :
+            duration = "%d min" % round(entry['duration'] / 60)
+        print(INDENT + "%s : %.1f MB, %s%s (%s)" % (
+            file_name, entry['size'] / MEGABYTE, duration,
+            ', watched' if entry['watched'] else '', entry['title']
+        ))
+                                                                     # make room
+    if parser_arguments.run is not None :
+        required_size = float(parser_arguments.run) * 60 * index.byte_rate()
+        removed = index.make_room(
+            required_size,
+            float(parser_arguments.quota) * GIGABYTE,
+            float(parser_arguments.free) * GIGABYTE,
+            parser_arguments.order
+        )
+        print("%d recordings removed" % len(removed))
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+#
+# Compiled recording rules
+#
+# The rules of the rule set are compiled once into indexes : a hash map for
+# exact titles, an Aho-Corasick automaton for the "contains" tests and a
+# combined regular expression for the "matches" tests, partitioned by
+# channel. Every programme is then matched in a single pass.
+#
+# Rule elements :
+#   <channel name="Arte"/>                  channel restriction
+#   <title is="..."/>                       exact title
+#   <title contains="..."/>                 title substring
+#   <title matches="..."/>                  title regular expression
+#   <title ... fold="yes"/>                 case and accent insensitive
+#   <days is="sat sun"/>                    days of the week
+#   <time from="18:00" to="23:30"/>         start time of day window
+#   <duration min="20"/>                    minimal duration in minutes
+#
+# The tests of a title element are alternatives. A rule without title
+# matches the whole programmes of its days or time window, and nothing
+# without them. A rule with a bad element is reported and skipped.
+#
+# A rule can be given a priority with <rule priority="2">, the default being
+# 0. Higher priorities win scheduling conflicts.
+#
+import re
+import unicodedata
+from collections import deque
+
+# ------------------------------------------------------------------------------
+# constants
+#
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+ANY_CHANNEL = None
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Accent removal
+#
+def strip_accents(text) :
+    decomposed = unicodedata.normalize('NFD', text)
+
+    return(''.join(
+        character for character in decomposed
+            if not unicodedata.combining(character)
+    ))
+
+#-------------------------------------------------------------------------------
+# Case and accent folding
+#
+def fold(text) :
+    return(strip_accents(text).casefold())
+
+#-------------------------------------------------------------------------------
+# Channel name as found in the EPG files
+#
+def channel_key(channel_name) :
+    return(channel_name.replace(' ', '_'))
+
+#-------------------------------------------------------------------------------
+# Element or list of elements to list
+#
+def as_list(element) :
+    if element is None :
+        return([])
+    if isinstance(element, list) :
+        return(element)
+
+    return([element])
+
+#-------------------------------------------------------------------------------
+# Day name to day of the week
+#
+def to_weekday(day) :
+    if day[:3].lower() not in WEEKDAYS :
+        raise ValueError("unknown day \"%s\"" % day)
+
+    return(WEEKDAYS.index(day[:3].lower()))
+
+#-------------------------------------------------------------------------------
+# hh:mm to minutes of the day
+#
+def to_minutes(time_string) :
+    (hours, minutes) = time_string.split(':')
+
+    return(int(hours) * 60 + int(minutes))
+
+# ==============================================================================
+# Multi-pattern substring search
+#
+
+#-------------------------------------------------------------------------------
+# Aho-Corasick automaton
+#
+class AhoCorasick :
+
+    def __init__(self) :
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [set()]
+
+    def add(self, pattern, value) :
+        state = 0
+        for character in pattern :
+            if character not in self.transitions[state] :
+                self.transitions.append({})
+                self.failures.append(0)
+                self.outputs.append(set())
+                self.transitions[state][character] = len(self.transitions) - 1
+            state = self.transitions[state][character]
+        self.outputs[state].add(value)
+
+    def build(self) :
+                                                   # breadth-first failure links
+        queue = deque(self.transitions[0].values())
+        while queue :
+            state = queue.popleft()
+            for (character, next_state) in self.transitions[state].items() :
+                queue.append(next_state)
+                failure = self.failures[state]
+                while failure and character not in self.transitions[failure] :
+                    failure = self.failures[failure]
+                failure = self.transitions[failure].get(character, 0)
+                if failure == next_state :
+                    failure = 0
+                self.failures[next_state] = failure
+                self.outputs[next_state] |= self.outputs[failure]
+
+    def find(self, text) :
+        found = set()
+        state = 0
+        for character in text :
+            while state and character not in self.transitions[state] :
+                state = self.failures[state]
+            state = self.transitions[state].get(character, 0)
+            if self.outputs[state] :
+                found |= self.outputs[state]
+
+        return(found)
+
+# ==============================================================================
+# Rules
+#
+
+#-------------------------------------------------------------------------------
+# Title tests of one channel partition
+#
+class TitleMatcher :
+
+    def __init__(self) :
+        self.exact = {}
+        self.exact_folded = {}
+        self.contains = AhoCorasick()
+        self.contains_folded = AhoCorasick()
+        self.expressions = []
+        self.expressions_folded = []
+        self.untitled = set()
+
+    def add(self, rule_index, test, folded) :
+                                 # the tests of a title element are alternatives
+        if test is None :
+            self.untitled.add(rule_index)
+            return
+        if '@is' in test :
+            if folded :
+                self.exact_folded.setdefault(
+                    fold(test['@is']), set()
+                ).add(rule_index)
+            else :
+                self.exact.setdefault(test['@is'], set()).add(rule_index)
+        if '@contains' in test :
+            if folded :
+                self.contains_folded.add(fold(test['@contains']), rule_index)
+            else :
+                self.contains.add(test['@contains'], rule_index)
+        if '@matches' in test :
+                          # case folding would change escapes such as \D into \d
+            if folded :
+                self.expressions_folded.append(
+                    (rule_index, strip_accents(test['@matches']))
+                )
+            else :
+                self.expressions.append((rule_index, test['@matches']))
+
+    def _compile_expressions(self, expressions, flags) :
+        combinable = []
+        separate = []
+                             # groups are renumbered and inline global flags are
+                             # rejected in a combined expression : such ones are
+                                                           # searched separately
+        plain_flags = re.compile('', flags).flags
+        for (rule_index, expression) in expressions :
+            compiled = re.compile(expression, flags)
+            if compiled.groups == 0 and compiled.flags == plain_flags :
+                combinable.append((rule_index, expression, compiled))
+            else :
+                separate.append((rule_index, compiled))
+        combined = None
+        if combinable :
+            combined = re.compile('|'.join(
+                "(?:%s)" % expression
+                    for (rule_index, expression, compiled) in combinable
+            ), flags)
+
+        return((
+            combined,
+            [
+                (rule_index, compiled)
+                    for (rule_index, expression, compiled) in combinable
+            ],
+            separate
+        ))
+
+    def build(self) :
+        self.contains.build()
+        self.contains_folded.build()
+        self.expressions = self._compile_expressions(self.expressions, 0)
+        self.expressions_folded = self._compile_expressions(
+            self.expressions_folded, re.IGNORECASE
+        )
+
+    def _search_expressions(self, expressions, title) :
+        (combined, compiled, separate) = expressions
+        found = set(
+            rule_index for (rule_index, expression) in separate
+                if expression.search(title)
+        )
+                                       # the combined expression filters quickly
+        if combined is None or not combined.search(title) :
+            return(found)
+
+        return(found | set(
+            rule_index for (rule_index, expression) in compiled
+                if expression.search(title)
+        ))
+
+    def find(self, title) :
+        folded_title = fold(title)
+        candidates = set(self.untitled)
+        candidates |= self.exact.get(title, set())
+        candidates |= self.exact_folded.get(folded_title, set())
+        candidates |= self.contains.find(title)
+        candidates |= self.contains_folded.find(folded_title)
+        candidates |= self._search_expressions(self.expressions, title)
+        candidates |= self._search_expressions(
+            self.expressions_folded, strip_accents(title)
+        )
+
+        return(candidates)
+
+#-------------------------------------------------------------------------------
+# Compiled rule set
+#
+class RuleSet :
+
+    def __init__(self, rules) :
+        self.rules = as_list(rules)
+        self.partitions = {}
+        self.conditions = []
+        for (rule_index, rule) in enumerate(self.rules) :
+            self._add_rule(rule_index, rule)
+        for partition in self.partitions.values() :
+            partition.build()
+
+    def _add_rule(self, rule_index, rule) :
+        if not isinstance(rule, dict) :
+            rule = {}
+                                   # time and duration, a bad rule being skipped
+        try :
+            conditions = self._conditions(rule)
+        except (ValueError, KeyError) as error :
+            reason = str(error)
+            if isinstance(error, KeyError) :
+                reason = "missing attribute %s" % error
+            print("skipping rule %d, %s : %s" % (rule_index + 1, reason, rule))
+            self.conditions.append({})
+            return
+        self.conditions.append(conditions)
+                                                       # find channel partitions
+        channels = [
+            channel_key(channel['@name'])
+                for channel in as_list(rule.get('channel'))
+        ]
+        if not channels :
+            channels = [ANY_CHANNEL]
+                                                                   # title tests
+                     # rules without title test need a day or time of day window
+        title_tests = as_list(rule.get('title'))
+        if not title_tests and rule.keys() & {'days', 'time'} :
+            title_tests = [None]
+        for channel in channels :
+            partition = self.partitions.setdefault(channel, TitleMatcher())
+            for test in title_tests :
+                folded = test is not None and \
+                    test.get('@fold', 'no').lower() in ('yes', 'true', '1')
+                partition.add(rule_index, test, folded)
+
+    def _conditions(self, rule) :
+        conditions = {}
+        days = rule.get('days')
+        if days is not None :
+            conditions['days'] = set(
+                to_weekday(day)
+                    for day in days['@is'].replace(',', ' ').split()
+            )
+        time_window = rule.get('time')
+        if time_window is not None :
+            conditions['time'] = (
+                to_minutes(time_window.get('@from', '00:00')),
+                to_minutes(time_window.get('@to', '24:00'))
+            )
+        duration = rule.get('duration')
+        if duration is not None :
+            conditions['duration'] = float(duration['@min']) * 60
+
+        return(conditions)
+
+    def priority(self, rule_index) :
+        rule = self.rules[rule_index]
+        if not isinstance(rule, dict) :
+            return(0)
+
+        return(int(rule.get('@priority', 0)))
+
+    def _conditions_match(self, rule_index, start, stop) :
+        conditions = self.conditions[rule_index]
+        if 'days' in conditions :
+            if start.weekday() not in conditions['days'] :
+                return(False)
+        if 'time' in conditions :
+            (window_start, window_stop) = conditions['time']
+            minutes = start.hour * 60 + start.minute
+                                                     # windows may span midnight
+            if window_start <= window_stop :
+                if not window_start <= minutes < window_stop :
+                    return(False)
+            elif window_stop <= minutes < window_start :
+                return(False)
+        if 'duration' in conditions :
+            if (stop - start).total_seconds() < conditions['duration'] :
+                return(False)
+
+        return(True)
+
+    def match(self, channel, title, start, stop) :
+                                                       # candidates from indexes
+        candidates = set()
+        for partition_key in (ANY_CHANNEL, channel) :
+            partition = self.partitions.get(partition_key)
+            if partition is not None :
+                candidates |= partition.find(title)
+                                                          # check the conditions
+        matched = [
+            rule_index for rule_index in candidates
+                if self._conditions_match(rule_index, start, stop)
+        ]
+
+        return(sorted(matched))
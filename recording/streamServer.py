@@ -0,0 +1,391 @@
+#!/usr/bin/python3
+#
+# HTTP server of the recordings
+#
+# Serves the files of the recordings directory to the other computers of the
+# local network, with an index page listing them. The clients are handled
+# by asyncio in a single thread, and the file contents are sent with
+# sendfile, without being copied through the process.
+#
+# Byte ranges are supported for seeking. A transport stream which is still
+# being recorded is followed as it grows, so that a recording in progress
+# can be watched with a delay.
+#
+import argparse
+import os
+import html
+import time
+import asyncio
+import urllib.parse
+
+# ------------------------------------------------------------------------------
+# constants
+#
+HTTP_PORT = 8080
+MAX_HEADER_SIZE = 8192
+RECORDINGS_PATH = '/recordings/'
+CONTENT_TYPES = {
+    '.ts' : 'video/mp2t',
+    '.mp4' : 'video/mp4',
+    '.xml' : 'text/xml',
+    '.txt' : 'text/plain'
+}
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+GROWING_EXTENSION = '.ts'
+GROWING_AGE = 10
+FOLLOW_PERIOD = 0.5
+FOLLOW_TIMEOUT = 10
+MEGABYTE = 1024 * 1024
+REASONS = {
+    200 : 'OK', 206 : 'Partial Content', 304 : 'Not Modified',
+    400 : 'Bad Request',
+    404 : 'Not Found', 405 : 'Method Not Allowed',
+    416 : 'Range Not Satisfiable'
+}
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Byte range of a Range header
+#
+# Returns the first and last byte of a single range, None without a valid
+# range, or False for a range beyond the end of the file. The last byte is
+# None for an open range, which can start beyond the end of a growing file.
+#
+def parse_range(header, size, growing=False) :
+    if header is None or not header.startswith('bytes=') :
+        return(None)
+    ranges = header[len('bytes='):].split(',')
+    if len(ranges) != 1 :
+        return(None)
+    (first, separator, last) = ranges[0].strip().partition('-')
+    try :
+        if first == '' :
+                                       # the last N bytes, none of an empty file
+            length = int(last)
+            if length == 0 or size == 0 :
+                return(False)
+            return((max(size - length, 0), size - 1))
+        first = int(first)
+        last = int(last) if last else None
+    except ValueError :
+        return(None)
+    if last is not None and last < first :
+        return(None)
+    if first >= size and not (growing and last is None) :
+        return(False)
+    if last is not None :
+        last = min(last, size - 1)
+
+    return((first, last))
+
+#-------------------------------------------------------------------------------
+# Check if a file is a recording in progress
+#
+def is_growing(file_spec, file_stat) :
+    if not file_spec.endswith(GROWING_EXTENSION) :
+        return(False)
+
+    return(time.time() - file_stat.st_mtime < GROWING_AGE)
+
+#-------------------------------------------------------------------------------
+# Content type of a file
+#
+def content_type(file_spec) :
+    extension = os.path.splitext(file_spec)[1].lower()
+
+    return(CONTENT_TYPES.get(extension, DEFAULT_CONTENT_TYPE))
+
+# ==============================================================================
+# Server
+#
+
+#-------------------------------------------------------------------------------
+# HTTP server of a recordings directory
+#
+class StreamServer :
+
+    def __init__(self, directory, verbose=False) :
+        self.directory = directory
+        self.verbose = verbose
+        self.server = None
+        self.clients = 0
+        self.requests = 0
+        self.bytes_sent = 0
+
+    async def start(self, host='', port=HTTP_PORT) :
+        self.server = await asyncio.start_server(self._handle, host, port)
+
+        return(self.server)
+
+    def port(self) :
+        return(self.server.sockets[0].getsockname()[1])
+
+    async def _read_request(self, reader) :
+        try :
+            header = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) :
+            return(None)
+        if len(header) > MAX_HEADER_SIZE :
+            return(None)
+        lines = header.decode('latin-1').split('\r\n')
+        request = lines[0].split()
+        if len(request) != 3 :
+            return(None)
+        headers = {}
+        for line in lines[1:] :
+            (name, separator, value) = line.partition(':')
+            if separator :
+                headers[name.strip().lower()] = value.strip()
+
+        return((request[0], request[1], request[2], headers))
+
+    async def send_header(self, writer, status, headers) :
+        lines = ["HTTP/1.1 %d %s" % (status, REASONS[status])]
+        lines += ["%s: %s" % (name, value) for (name, value) in headers]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+    async def send_body(
+        self, writer, status, body, content_type, keep_alive, head=False,
+        extra_headers=()
+    ) :
+        await self.send_header(writer, status, [
+            ('Content-Type', content_type),
+            ('Content-Length', str(len(body))),
+            ('Connection', 'keep-alive' if keep_alive else 'close')
+        ] + list(extra_headers))
+        if not head :
+            writer.write(body)
+            await writer.drain()
+            self.bytes_sent += len(body)
+
+    async def _send_error(self, writer, status, keep_alive) :
+        await self.send_body(
+            writer, status, ("%d %s\n" % (status, REASONS[status])).encode(),
+            'text/plain', keep_alive
+        )
+
+    async def _send_file_part(self, writer, file, offset, count) :
+                                                       # zero-copy when possible
+        loop = asyncio.get_running_loop()
+        sent = await loop.sendfile(writer.transport, file, offset, count)
+        self.bytes_sent += sent
+
+        return(sent)
+
+    def _index_page(self) :
+        entries = []
+        with os.scandir(self.directory) as directory_entries :
+            for entry in directory_entries :
+                if entry.name.startswith('.') or not entry.is_file() :
+                    continue
+                entries.append((entry.stat().st_mtime, entry))
+        entries.sort(key=lambda item : item[0], reverse=True)
+        lines = [
+            '<!DOCTYPE html>', '<html><head><meta charset="utf-8">',
+            '<title>Recordings</title></head><body>',
+            '<h1>Recordings</h1>', '<ul>'
+        ]
+        for (mtime, entry) in entries :
+            lines.append('<li><a href="%s%s">%s</a> (%.1f MB)</li>' % (
+                RECORDINGS_PATH, urllib.parse.quote(entry.name),
+                html.escape(entry.name), entry.stat().st_size / MEGABYTE
+            ))
+        lines += ['</ul>', '</body></html>', '']
+
+        return('\n'.join(lines).encode('utf-8'))
+
+    async def handle_request(
+        self, writer, method, path, query, headers, keep_alive
+    ) :
+                                    # the other pages can be added by a subclass
+        head = method == 'HEAD'
+        if path in ('/', RECORDINGS_PATH) :
+            await self.send_body(
+                writer, 200, self._index_page(), 'text/html; charset=utf-8',
+                keep_alive, head
+            )
+            return(keep_alive)
+        if path.startswith(RECORDINGS_PATH) :
+            return(await self._serve_file(
+                writer, path[len(RECORDINGS_PATH):], headers, keep_alive, head
+            ))
+        await self._send_error(writer, 404, keep_alive)
+
+        return(keep_alive)
+
+    async def _serve_file(self, writer, file_name, headers, keep_alive, head) :
+                                        # only the files of the directory itself
+        file_name = urllib.parse.unquote(file_name)
+        if file_name != os.path.basename(file_name) or \
+            file_name.startswith('.') :
+            await self._send_error(writer, 404, keep_alive)
+            return(keep_alive)
+        file_spec = os.sep.join([self.directory, file_name])
+        try :
+            file = open(file_spec, 'rb')
+        except OSError :
+            await self._send_error(writer, 404, keep_alive)
+            return(keep_alive)
+        with file :
+            file_stat = os.fstat(file.fileno())
+            size = file_stat.st_size
+            growing = is_growing(file_spec, file_stat)
+            byte_range = parse_range(headers.get('range'), size, growing)
+            if byte_range is False :
+                await self.send_header(writer, 416, [
+                    ('Content-Range', "bytes */%d" % size),
+                    ('Content-Length', '0')
+                ])
+                return(keep_alive)
+            partial = byte_range is not None
+            if not partial :
+                byte_range = (0, None if growing else size - 1)
+            (first, last) = byte_range
+                                           # a recording in progress is followed
+            if growing and last is None :
+                return(await self._follow_file(
+                    writer, file, file_spec, first, head
+                ))
+            if last is None :
+                last = size - 1
+            response_headers = [
+                ('Content-Type', content_type(file_spec)),
+                ('Accept-Ranges', 'bytes'),
+                ('Content-Length', str(last - first + 1)),
+                ('Connection', 'keep-alive' if keep_alive else 'close')
+            ]
+            status = 200
+            if partial :
+                status = 206
+                response_headers.append(('Content-Range', "bytes %d-%d/%s" % (
+                    first, last, '*' if growing else size
+                )))
+            await self.send_header(writer, status, response_headers)
+            if not head and last >= first :
+                await self._send_file_part(
+                    writer, file, first, last - first + 1
+                )
+
+        return(keep_alive)
+
+    async def _follow_file(self, writer, file, file_spec, first, head) :
+                                 # without length, the end closes the connection
+        status = 200
+        response_headers = [
+            ('Content-Type', content_type(file_spec)),
+            ('Accept-Ranges', 'bytes'),
+            ('Connection', 'close')
+        ]
+        if first > 0 :
+            status = 206
+            response_headers.append(('Content-Range', "bytes %d-/*" % first))
+        await self.send_header(writer, status, response_headers)
+        if head :
+            return(False)
+        offset = first
+        idle_time = 0
+        while idle_time < FOLLOW_TIMEOUT :
+            size = os.fstat(file.fileno()).st_size
+            if size > offset :
+                offset += await self._send_file_part(
+                    writer, file, offset, size - offset
+                )
+                idle_time = 0
+            else :
+                await asyncio.sleep(FOLLOW_PERIOD)
+                idle_time += FOLLOW_PERIOD
+
+        return(False)
+
+    async def _handle(self, reader, writer) :
+        self.clients += 1
+        peer = writer.get_extra_info('peername')
+        try :
+            keep_alive = True
+            while keep_alive :
+                request = await self._read_request(reader)
+                if request is None :
+                    break
+                (method, target, version, headers) = request
+                self.requests += 1
+                if self.verbose :
+                    print(INDENT + "%s %s %s" % (peer[0], method, target))
+                keep_alive = version == 'HTTP/1.1' and \
+                    headers.get('connection', '').lower() != 'close'
+                if method not in ('GET', 'HEAD') :
+                    await self._send_error(writer, 405, keep_alive)
+                    continue
+                target = urllib.parse.urlsplit(target)
+                keep_alive = await self.handle_request(
+                    writer, method, target.path,
+                    urllib.parse.parse_qs(target.query), headers, keep_alive
+                )
+        except (ConnectionError, asyncio.CancelledError) :
+            pass
+        finally :
+            self.clients -= 1
+            writer.close()
+            try :
+                await writer.wait_closed()
+            except ConnectionError :
+                pass
+
+    def statistics(self) :
+        return({
+            'clients' : self.clients,
+            'requests' : self.requests,
+            'bytes sent' : self.bytes_sent
+        })
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='serve the recordings over HTTP'
+    )
+    parser.add_argument(
+        '-d', '--dir', default='/media/storage/recordings',
+        help = 'the recordings directory'
+    )
+    parser.add_argument(
+        '-a', '--address', default='',
+        help = 'the address to listen on, all by default'
+    )
+    parser.add_argument(
+        '-p', '--port', default=HTTP_PORT,
+        help = 'the HTTP port'
+    )
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
+    )
+    parser_arguments = parser.parse_args(arguments)
+    verbose = parser_arguments.verbose
+                                                                         # serve
+    async def serve() :
+        stream_server = StreamServer(parser_arguments.dir, verbose)
+        server = await stream_server.start(
+            parser_arguments.address, int(parser_arguments.port)
+        )
+        if verbose :
+            print("Serving \"%s\" on port %d" % (
+                parser_arguments.dir, stream_server.port()
+            ))
+        async with server :
+            await server.serve_forever()
+
+    try :
+        asyncio.run(serve())
+    except KeyboardInterrupt :
+        pass
+
+if __name__ == '__main__' :
+    main()
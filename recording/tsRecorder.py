@@ -0,0 +1,388 @@
+#!/usr/bin/python3
+#
+# Transport stream recorder
+#
+# Records the transport stream of a tuner DVR device, or of a file or a pipe
+# standing for it, to a file. The DVR device gets a large kernel buffer, and
+# the data read goes through a ring buffer to a writer thread, so that a
+# stalled disk write doesn't make the DVR buffer overflow.
+#
+# The writes are made in large blocks aligned on both the disk pages and
+# the packets, the output file is preallocated for the expected duration
+# and bitrate, and the data is synced to the disk in batches. The
+# throughput, the high-water mark of the ring buffer and the overflows are
+# reported at the end.
+#
+import argparse
+import os
+import sys
+import errno
+import fcntl
+import mmap
+import select
+import signal
+import threading
+import time
+import ctypes
+import ctypes.util
+
+# ------------------------------------------------------------------------------
+# constants
+#
+TS_PACKET_SIZE = 188
+PAGE_SIZE = mmap.PAGESIZE
+WRITE_SIZE = PAGE_SIZE * TS_PACKET_SIZE
+RING_SIZE = 32 * WRITE_SIZE
+READ_SIZE = 348 * TS_PACKET_SIZE
+DVR_BUFFER_SIZE = 16 * 1024 * 1024
+DMX_SET_BUFFER_SIZE = 0x6F2D
+FALLOC_FL_KEEP_SIZE = 0x01
+SYNC_SIZE = 64 * 1024 * 1024
+DEVICE_TIMEOUT = 1
+MEGABYTE = 1024 * 1024
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Set the kernel buffer size of a DVR device
+#
+def set_dvr_buffer_size(file_descriptor, size) :
+    try :
+        fcntl.ioctl(file_descriptor, DMX_SET_BUFFER_SIZE, size)
+    except OSError :
+        return(False)
+
+    return(True)
+
+#-------------------------------------------------------------------------------
+# Reserve the disk space of a file without changing its size
+#
+def preallocate(file_descriptor, size) :
+    if size <= 0 :
+        return(False)
+    library_name = ctypes.util.find_library('c')
+    try :
+        fallocate = ctypes.CDLL(library_name, use_errno=True).fallocate
+    except (OSError, AttributeError) :
+        return(False)
+    fallocate.argtypes = (
+        ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong
+    )
+
+    return(
+        fallocate(file_descriptor, FALLOC_FL_KEEP_SIZE, 0, int(size)) == 0
+    )
+
+# ==============================================================================
+# Recorder
+#
+
+#-------------------------------------------------------------------------------
+# Ring buffer between the reader and the writer
+#
+# The reader fills the free space in place and the writer takes whole
+# blocks of WRITE_SIZE, the ring size being a multiple of it.
+#
+class RingBuffer :
+
+    def __init__(self, size=RING_SIZE) :
+        self.size = size
+        self.buffer = mmap.mmap(-1, size)
+        self.view = memoryview(self.buffer)
+        self.produced = 0
+        self.consumed = 0
+        self.high_water = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def fill(self) :
+        return(self.produced - self.consumed)
+
+    def free_views(self) :
+                                                 # at most two parts of the ring
+        with self.condition :
+            free = self.size - self.fill()
+        start = self.produced % self.size
+        first_size = min(free, self.size - start)
+        views = [self.view[start:start + first_size]]
+        if free > first_size :
+            views.append(self.view[0:free - first_size])
+
+        return(views)
+
+    def wait_free(self) :
+        with self.condition :
+            while self.fill() >= self.size and not self.closed :
+                self.condition.wait()
+
+    def commit(self, size) :
+        with self.condition :
+            self.produced += size
+            self.high_water = max(self.high_water, self.fill())
+            if self.fill() >= WRITE_SIZE :
+                self.condition.notify()
+
+    def close(self) :
+                                          # wakes both the reader and the writer
+        with self.condition :
+            self.closed = True
+            self.condition.notify_all()
+
+    def next_block(self) :
+                                   # a whole block, or the remainder once closed
+        with self.condition :
+            while self.fill() < WRITE_SIZE and not self.closed :
+                self.condition.wait()
+            size = self.fill()
+            if size >= WRITE_SIZE :
+                size = WRITE_SIZE
+        start = self.consumed % self.size
+
+        return(self.view[start:start + size])
+
+    def release(self, size) :
+        with self.condition :
+            self.consumed += size
+            self.condition.notify()
+
+#-------------------------------------------------------------------------------
+# Transport stream recorder
+#
+class TsRecorder :
+
+    def __init__(self, ring_size=RING_SIZE, dvr_buffer_size=DVR_BUFFER_SIZE) :
+        self.ring = RingBuffer(ring_size)
+        self.dvr_buffer_size = dvr_buffer_size
+        self.stopping = False
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.ring_overflows = 0
+        self.dropped_bytes = 0
+        self.dvr_overflows = 0
+        self.longest_write = 0
+        self.syncs = 0
+        self.preallocated = False
+        self.start_time = None
+        self.stop_time = None
+        self.write_error = None
+
+    def stop(self) :
+        self.stopping = True
+
+    def _write(self, output) :
+                                                            # writer thread loop
+        unsynced = 0
+        try :
+            while True :
+                block = self.ring.next_block()
+                if not block :
+                    break
+                write_start = time.monotonic()
+                written = 0
+                while written < len(block) :
+                    written += os.write(output, block[written:])
+                self.longest_write = max(
+                    self.longest_write, time.monotonic() - write_start
+                )
+                block.release()
+                self.ring.release(written)
+                self.bytes_written += written
+                unsynced += written
+                if unsynced >= SYNC_SIZE :
+                    os.fdatasync(output)
+                    self.syncs += 1
+                    unsynced = 0
+        except OSError as error :
+                                      # the reader may be waiting for free space
+            self.write_error = error
+            self.stopping = True
+            self.ring.close()
+
+    def _read(self, source, is_device) :
+                                  # read in place, or drop when the ring is full
+                                             # a file or a pipe can wait instead
+        if not is_device :
+            self.ring.wait_free()
+            if self.ring.closed :
+                return(False)
+        views = self.ring.free_views()
+        if not views[0] :
+            views = [memoryview(bytearray(READ_SIZE))]
+        try :
+            size = os.readv(source, views)
+        except BlockingIOError :
+            return(True)
+        except OSError as error :
+                                                 # the DVR buffer has overflowed
+            if error.errno == errno.EOVERFLOW :
+                self.dvr_overflows += 1
+                return(True)
+            raise
+        if size == 0 :
+            return(False)
+        self.bytes_read += size
+        if views[0].obj is self.ring.buffer :
+            self.ring.commit(size)
+        else :
+            self.ring_overflows += 1
+            self.dropped_bytes += size
+
+        return(True)
+
+    def run(self, source_spec, file_spec, duration=None, byte_rate=None) :
+        is_device = source_spec.startswith('/dev/')
+        flags = os.O_RDONLY
+        if is_device :
+            flags |= os.O_NONBLOCK
+        source = os.open(source_spec, flags)
+        if is_device :
+            set_dvr_buffer_size(source, self.dvr_buffer_size)
+        output = os.open(
+            file_spec, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644
+        )
+        if duration is not None and byte_rate is not None :
+            self.preallocated = preallocate(output, duration * byte_rate)
+        writer = threading.Thread(target=self._write, args=(output,))
+        writer.start()
+        self.start_time = time.monotonic()
+        deadline = None
+        if duration is not None :
+            deadline = self.start_time + duration
+        try :
+            while not self.stopping :
+                if deadline is not None and time.monotonic() >= deadline :
+                    break
+                                                  # wait for data from the tuner
+                if is_device :
+                    timeout = DEVICE_TIMEOUT
+                    if deadline is not None :
+                        timeout = min(timeout, deadline - time.monotonic())
+                    (readable, writable, errors) = select.select(
+                        [source], [], [], max(timeout, 0)
+                    )
+                    if not readable :
+                        continue
+                if not self._read(source, is_device) :
+                    break
+        finally :
+            self.stop_time = time.monotonic()
+            self.ring.close()
+            writer.join()
+            os.fdatasync(output)
+            self.syncs += 1
+                                      # release the space preallocated in excess
+            if self.preallocated :
+                os.ftruncate(output, self.bytes_written)
+            os.close(output)
+            os.close(source)
+        if self.write_error is not None :
+            raise self.write_error
+
+        return(self.statistics())
+
+    def statistics(self) :
+        duration = 0
+        if self.start_time is not None :
+            stop_time = self.stop_time
+            if stop_time is None :
+                stop_time = time.monotonic()
+            duration = stop_time - self.start_time
+        throughput = 0
+        if duration > 0 :
+            throughput = self.bytes_written / MEGABYTE / duration
+
+        return({
+            'bytes read' : self.bytes_read,
+            'bytes written' : self.bytes_written,
+            'duration' : round(duration, 2),
+            'throughput' : round(throughput, 2),
+            'high water' : self.ring.high_water,
+            'high water ratio' : round(
+                self.ring.high_water / self.ring.size, 3
+            ),
+            'ring overflows' : self.ring_overflows,
+            'dropped bytes' : self.dropped_bytes,
+            'dvr overflows' : self.dvr_overflows,
+            'longest write' : round(self.longest_write, 3),
+            'syncs' : self.syncs,
+            'preallocated' : self.preallocated
+        })
+
+#-------------------------------------------------------------------------------
+# One line summary of the statistics
+#
+def summary(statistics) :
+    return(
+        "%.1f MB in %g sec (%.2f MB/s), buffer high-water %d%%, " % (
+            statistics['bytes written'] / MEGABYTE, statistics['duration'],
+            statistics['throughput'], 100 * statistics['high water ratio']
+        ) +
+        "%d buffer and %d DVR overflows, longest write %.3f sec" % (
+            statistics['ring overflows'], statistics['dvr overflows'],
+            statistics['longest write']
+        )
+    )
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='record a transport stream with buffered writes'
+    )
+    parser.add_argument(
+        'source', default='/dev/dvb/adapter0/dvr0', nargs='?',
+        help = 'the DVR device, a transport stream file or a pipe'
+    )
+    parser.add_argument(
+        '-o', '--output', default='recording.ts',
+        help = 'the recorded file'
+    )
+    parser.add_argument(
+        '-t', '--time', default=None,
+        help = 'the recording duration in seconds'
+    )
+    parser.add_argument(
+        '-r', '--rate', default=None,
+        help = 'the expected rate in bytes per second, for preallocation'
+    )
+    parser.add_argument(
+        '-b', '--buffer', default=RING_SIZE // MEGABYTE,
+        help = 'the ring buffer size in MB'
+    )
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
+    )
+    parser_arguments = parser.parse_args(arguments)
+    verbose = parser_arguments.verbose
+    duration = parser_arguments.time
+    if duration is not None :
+        duration = float(duration)
+    byte_rate = parser_arguments.rate
+    if byte_rate is not None :
+        byte_rate = float(byte_rate)
+                                               # whole blocks in the ring buffer
+    ring_size = float(parser_arguments.buffer) * MEGABYTE
+    ring_size = max(int(ring_size // WRITE_SIZE), 2) * WRITE_SIZE
+                                                           # stop on termination
+    recorder = TsRecorder(ring_size)
+    signal.signal(signal.SIGTERM, lambda number, frame : recorder.stop())
+    signal.signal(signal.SIGINT, lambda number, frame : recorder.stop())
+                                                                        # record
+    statistics = recorder.run(
+        parser_arguments.source, parser_arguments.output, duration, byte_rate
+    )
+                                      # the summary ends the error output in all
+    print(summary(statistics), file=sys.stderr)
+    if verbose :
+        for (name, value) in statistics.items() :
+            print(INDENT + "%-16s : %s" % (name, value))
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,477 @@
+#!/usr/bin/python3
+#
+# Transport stream splitter
+#
+# Splits the transport stream of a whole multiplex, as read from a tuner DVR
+# device or from a recorded file, into one transport stream file per
+# service. The PIDs of every service are found from the PAT and the PMTs,
+# and every output file gets its own PAT listing only its service.
+#
+# The packets are routed through memoryviews of the read buffer, and the
+# runs of consecutive packets going to the same outputs are written at once.
+# Every output can be given its own start and stop times, the splitter
+# ending when all outputs are closed.
+#
+# The last packets read before the start of the outputs are kept in a ring
+# buffer, so that a splitter started ahead of time writes the packets of its
+# services from just before the start. The replay begins at the first random
+# access point of the video signalled in the adaptation fields, so with a
+# decodable picture, or with all the buffered packets for a service without
+# video or without signalled access points.
+#
+import argparse
+import os
+import sys
+import errno
+import select
+import struct
+import time
+from collections import deque
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'epg'
+))
+import eit
+
+# ------------------------------------------------------------------------------
+# constants
+#
+TS_PACKET_SIZE = eit.TS_PACKET_SIZE
+TS_SYNC_BYTE = eit.TS_SYNC_BYTE
+READ_PACKETS = 348
+PAT_PID = 0x00
+NULL_PID = 0x1FFF
+SHARED_PIDS = (eit.SDT_PID, eit.EIT_PID, 0x14)
+PAT_TABLE_ID = 0x00
+PMT_TABLE_ID = 0x02
+VIDEO_STREAM_TYPES = (0x01, 0x02, 0x10, 0x1B, 0x24)
+DEVICE_TIMEOUT = 1
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Programme numbers and PMT PIDs of a PAT section
+#
+def parse_pat(section) :
+    if section[0] != PAT_TABLE_ID :
+        return((None, None, {}))
+    transport_stream_id = struct.unpack_from('>H', section, 3)[0]
+    version = (section[5] >> 1) & 0x1F
+    programmes = {}
+    for offset in range(8, len(section) - 4, 4) :
+        (programme_number, pid) = struct.unpack_from('>HH', section, offset)
+        if programme_number != 0 :
+            programmes[programme_number] = pid & 0x1FFF
+
+    return((transport_stream_id, version, programmes))
+
+#-------------------------------------------------------------------------------
+# Programme number, elementary stream PIDs and video PIDs of a PMT section
+#
+def parse_pmt(section) :
+    if section[0] != PMT_TABLE_ID :
+        return((None, set(), set()))
+    programme_number = struct.unpack_from('>H', section, 3)[0]
+    (pcr_pid, programme_info_length) = struct.unpack_from('>HH', section, 8)
+    pids = set()
+    video_pids = set()
+    if pcr_pid & 0x1FFF != NULL_PID :
+        pids.add(pcr_pid & 0x1FFF)
+    offset = 12 + (programme_info_length & 0x0FFF)
+    while offset + 5 <= len(section) - 4 :
+        stream_type = section[offset]
+        (pid, info_length) = struct.unpack_from('>HH', section, offset + 1)
+        pids.add(pid & 0x1FFF)
+        if stream_type in VIDEO_STREAM_TYPES :
+            video_pids.add(pid & 0x1FFF)
+        offset += 5 + (info_length & 0x0FFF)
+
+    return((programme_number, pids, video_pids))
+
+#-------------------------------------------------------------------------------
+# Check the random access indicator of a packet's adaptation field
+#
+def is_random_access(packet) :
+    if not packet[3] & 0x20 or packet[4] == 0 :
+        return(False)
+
+    return(bool(packet[5] & 0x40))
+
+#-------------------------------------------------------------------------------
+# PAT section listing a single service
+#
+def build_pat(transport_stream_id, version, service_id, pmt_pid) :
+    body = struct.pack(
+        '>HBBBHH', transport_stream_id, 0xC1 | (version << 1), 0, 0,
+        service_id, 0xE000 | pmt_pid
+    )
+    section = struct.pack('>BH', PAT_TABLE_ID, 0xB000 | (len(body) + 4))
+    section += body
+
+    return(section + struct.pack('>I', eit.crc32_mpeg(section)))
+
+#-------------------------------------------------------------------------------
+# Transport stream packet carrying a section
+#
+def section_packet(pid, continuity, section) :
+    header = bytes([
+        TS_SYNC_BYTE, 0x40 | (pid >> 8), pid & 0xFF, 0x10 | continuity, 0
+    ])
+    packet = header + section
+
+    return(packet + b'\xFF' * (TS_PACKET_SIZE - len(packet)))
+
+# ==============================================================================
+# Splitter
+#
+
+#-------------------------------------------------------------------------------
+# Output of a service
+#
+class ServiceOutput :
+
+    def __init__(self, service_id, file_spec, start=None, stop=None) :
+        self.service_id = service_id
+        self.file_spec = file_spec
+        self.start = start
+        self.stop = stop
+        self.file = None
+        self.closed = False
+        self.pmt_pid = None
+        self.pids = set()
+        self.video_pids = set()
+        self.pat = None
+        self.pat_continuity = 0
+        self.packets = 0
+
+    def open(self) :
+        self.file = open(self.file_spec, 'wb')
+
+    def close(self) :
+        if self.file is not None :
+            self.file.close()
+            self.file = None
+        self.closed = True
+
+    def write(self, packets) :
+        self.file.write(packets)
+        self.packets += len(packets) // TS_PACKET_SIZE
+
+    def write_pat(self) :
+        if self.pat is None :
+            return
+        self.file.write(section_packet(PAT_PID, self.pat_continuity, self.pat))
+        self.pat_continuity = (self.pat_continuity + 1) & 0x0F
+        self.packets += 1
+
+#-------------------------------------------------------------------------------
+# Multiplex splitter
+#
+class TsSplitter :
+
+    def __init__(self, preroll=0) :
+        self.outputs = []
+        self.preroll = preroll
+        self.ring = deque()
+        self.ring_size = 0
+        self.routes = {}
+        self.pat_assembler = eit.SectionAssembler(PAT_PID)
+        self.pmt_assemblers = {}
+        self.programmes = {}
+        self.transport_stream = (0, 0)
+        self.remainder = b''
+        self.packets = 0
+        self.sync_losses = 0
+
+    def add_service(self, service_id, file_spec, start=None, stop=None) :
+        output = ServiceOutput(service_id, file_spec, start, stop)
+        self.outputs.append(output)
+
+        return(output)
+
+    def _update_routes(self) :
+        routes = {}
+        for output in self.outputs :
+            if output.file is None or output.pmt_pid is None :
+                continue
+            for pid in {output.pmt_pid} | output.pids | set(SHARED_PIDS) :
+                routes.setdefault(pid, []).append(output)
+                                              # same targets share the same list
+        shared = {}
+        for (pid, targets) in routes.items() :
+            routes[pid] = shared.setdefault(tuple(targets), targets)
+        self.routes = routes
+
+    def _update_pat(self, section) :
+        (transport_stream_id, version, programmes) = parse_pat(section)
+        if transport_stream_id is None :
+            return
+        self.transport_stream = (transport_stream_id, version)
+        if programmes == self.programmes :
+            return
+        self.programmes = programmes
+        self.pmt_assemblers = dict(
+            (pid, eit.SectionAssembler(pid)) for pid in programmes.values()
+        )
+        for output in self.outputs :
+            output.pmt_pid = programmes.get(output.service_id)
+            output.pat = None
+            if output.pmt_pid is not None :
+                output.pat = build_pat(
+                    transport_stream_id, version,
+                    output.service_id, output.pmt_pid
+                )
+        self._update_routes()
+
+    def _update_pmt(self, section) :
+        (programme_number, pids, video_pids) = parse_pmt(section)
+        changed = False
+        for output in self.outputs :
+            if output.service_id != programme_number :
+                continue
+            output.video_pids = video_pids
+            if output.pids != pids :
+                output.pids = pids
+                changed = True
+        if changed :
+            self._update_routes()
+
+    def schedule(self, now) :
+                                                # open and close outputs on time
+        changed = False
+        for output in self.outputs :
+            if output.closed :
+                continue
+            if output.stop is not None and now >= output.stop :
+                output.close()
+                changed = True
+            elif output.file is None :
+                if output.start is None or now >= output.start :
+                    output.open()
+                    output.write_pat()
+                    self._replay(output)
+                    changed = True
+        if changed :
+            self._update_routes()
+                                         # no more ring buffer once all are open
+        if self.ring and all(
+            output.file is not None or output.closed
+                for output in self.outputs
+        ) :
+            self.ring.clear()
+            self.ring_size = 0
+
+        return(not all(output.closed for output in self.outputs))
+
+    def _buffer(self, packets) :
+        if self.preroll <= 0 :
+            return
+        if all(
+            output.file is not None or output.closed
+                for output in self.outputs
+        ) :
+            return
+        self.ring.append(bytes(packets))
+        self.ring_size += len(packets)
+        while self.ring_size - len(self.ring[0]) >= self.preroll :
+            self.ring_size -= len(self.ring.popleft())
+
+    def _ring_packets(self) :
+                                  # index in the ring, offset and PID of packets
+        for (index, packets) in enumerate(self.ring) :
+            offset = 0
+            while offset + TS_PACKET_SIZE <= len(packets) :
+                if packets[offset] != TS_SYNC_BYTE :
+                    offset += 1
+                    continue
+                pid = ((packets[offset + 1] & 0x1F) << 8) | packets[offset + 2]
+                yield((index, offset, pid))
+                offset += TS_PACKET_SIZE
+
+    def _replay(self, output) :
+                                     # write the buffered packets of the service
+        if output.pmt_pid is None :
+            return
+        pids = {output.pmt_pid} | output.pids | set(SHARED_PIDS)
+                                     # from the first random access of the video
+        start = (0, 0)
+        for (index, offset, pid) in self._ring_packets() :
+            if pid in output.video_pids and is_random_access(
+                self.ring[index][offset:offset + TS_PACKET_SIZE]
+            ) :
+                start = (index, offset)
+                break
+        for (index, offset, pid) in self._ring_packets() :
+            if pid in pids and (
+                (index, offset) >= start or pid == output.pmt_pid
+            ) :
+                output.write(self.ring[index][offset:offset + TS_PACKET_SIZE])
+
+    def _resynchronise(self, view, offset) :
+        self.sync_losses += 1
+        end = len(view) - TS_PACKET_SIZE
+        while offset < end :
+            if view[offset] == TS_SYNC_BYTE and \
+                view[offset + TS_PACKET_SIZE] == TS_SYNC_BYTE :
+                return(offset)
+            offset += 1
+
+        return(None)
+
+    def feed(self, data) :
+        if self.remainder :
+            data = self.remainder + data
+        view = memoryview(data)
+        end = len(view) - TS_PACKET_SIZE
+        offset = 0
+        run_start = 0
+        run_targets = None
+        while offset <= end :
+            if view[offset] != TS_SYNC_BYTE :
+                if run_targets is not None :
+                    for output in run_targets :
+                        output.write(view[run_start:offset])
+                    run_targets = None
+                synchronised = self._resynchronise(view, offset)
+                if synchronised is None :
+                                         # keep the last bytes for the next read
+                    offset = end
+                    break
+                offset = synchronised
+                continue
+            pid = ((view[offset + 1] & 0x1F) << 8) | view[offset + 2]
+            targets = self.routes.get(pid)
+                                            # extend the run of the same targets
+            if targets is not run_targets or pid == PAT_PID :
+                if run_targets is not None :
+                    for output in run_targets :
+                        output.write(view[run_start:offset])
+                run_start = offset
+                run_targets = targets
+                                                     # programme specific tables
+            if pid == PAT_PID :
+                packet = view[offset:offset + TS_PACKET_SIZE]
+                for section in self.pat_assembler.feed(packet) :
+                    self._update_pat(section)
+                for output in self.outputs :
+                    if output.file is not None :
+                        output.write_pat()
+                run_targets = None
+            elif pid in self.pmt_assemblers :
+                routes = self.routes
+                packet = view[offset:offset + TS_PACKET_SIZE]
+                for section in self.pmt_assemblers[pid].feed(packet) :
+                    self._update_pmt(section)
+                                         # end the run on a change of the routes
+                if self.routes is not routes :
+                    offset += TS_PACKET_SIZE
+                    self.packets += 1
+                    if run_targets is not None :
+                        for output in run_targets :
+                            output.write(view[run_start:offset])
+                    run_targets = None
+                    continue
+            offset += TS_PACKET_SIZE
+            self.packets += 1
+        if run_targets is not None :
+            for output in run_targets :
+                output.write(view[run_start:offset])
+        self._buffer(view[:offset])
+        self.remainder = bytes(view[offset:])
+        view.release()
+
+    def run(self, source_spec, keep_going=None, clock=time.time) :
+        is_device = source_spec.startswith('/dev/')
+        flags = os.O_RDONLY
+        if is_device :
+            flags |= os.O_NONBLOCK
+        source = os.open(source_spec, flags)
+        read_size = READ_PACKETS * TS_PACKET_SIZE
+        try :
+            while self.schedule(clock()) :
+                if keep_going is not None and not keep_going() :
+                    break
+                                                  # wait for data from the tuner
+                if is_device :
+                    (readable, writable, errors) = select.select(
+                        [source], [], [], DEVICE_TIMEOUT
+                    )
+                    if not readable :
+                        continue
+                try :
+                    data = os.read(source, read_size)
+                except BlockingIOError :
+                    continue
+                except OSError as error :
+                                                 # the DVR buffer has overflowed
+                    if error.errno == errno.EOVERFLOW :
+                        continue
+                    raise
+                if not data :
+                    break
+                self.feed(data)
+        finally :
+            os.close(source)
+            for output in self.outputs :
+                output.close()
+
+        return(self.statistics())
+
+    def statistics(self) :
+        return({
+            'packets' : self.packets,
+            'sync losses' : self.sync_losses,
+            'outputs' : dict(
+                (output.file_spec, output.packets) for output in self.outputs
+            )
+        })
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+                                                        # command line arguments
+    parser = argparse.ArgumentParser(
+        description='split a multiplex transport stream by service'
+    )
+    parser.add_argument(
+        'source', default='/dev/dvb/adapter0/dvr0', nargs='?',
+        help = 'the DVR device or a transport stream file'
+    )
+    parser.add_argument(
+        '-s', '--service', action='append', default=[],
+        help = 'SERVICE_ID:FILE[:START[:STOP]], with epoch start and stop'
+    )
+    parser.add_argument(
+        '-p', '--preroll', default=0,
+        help = 'the size of the data written ahead of the start, in bytes'
+    )
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose console output'
+    )
+    parser_arguments = parser.parse_args(arguments)
+    verbose = parser_arguments.verbose
+                                                                  # add services
+    splitter = TsSplitter(int(parser_arguments.preroll))
+    for service in parser_arguments.service :
+        fields = service.split(':')
+        times = [float(field) if field else None for field in fields[2:4]]
+        times += (2 - len(times)) * [None]
+        splitter.add_service(int(fields[0], 0), fields[1], *times)
+    if not splitter.outputs :
+        parser.error('no service to record')
+                                                                         # split
+    statistics = splitter.run(parser_arguments.source)
+    if verbose :
+        print("%d packets read, %d sync losses" % (
+            statistics['packets'], statistics['sync losses']
+        ))
+        for (file_spec, packets) in statistics['outputs'].items() :
+            print(INDENT + "%s : %d packets" % (file_spec, packets))
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+#
+# Recording allocation on tuners
+#
+# The recordings of every tuner are kept sorted by start time, so that the
+# recordings overlapping a candidate are found by bisection. A tuner can
+# record several overlapping programmes of the same multiplex. Candidates
+# are placed by decreasing priority, and the rejected ones are reported with
+# the recordings they conflict with.
+#
+# The airings of a same episode are grouped, and only one of them is
+# recorded. Episodes with few airings are placed first, and an episode
+# which finds no free slot can move conflicting episodes to another of
+# their airings.
+#
+import bisect
+
+# ------------------------------------------------------------------------------
+# constants
+#
+MULTIPLEX_PARAMETERS = (
+    'DELIVERY_SYSTEM', 'FREQUENCY', 'POLARIZATION', 'SAT_NUMBER',
+    'SYMBOL_RATE', 'STREAM_ID', 'BANDWIDTH_HZ', 'MODULATION'
+)
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Read the parameters of every channel from a DVB channels file
+#
+def read_channels(channels_file_spec) :
+    channels = {}
+    channel_name = ''
+    parameters = {}
+    try :
+        channels_file = open(channels_file_spec, 'r')
+    except OSError :
+        return(channels)
+    for line in list(channels_file) + ['['] :
+        if line.startswith('[') :
+            if channel_name :
+                channels[channel_name] = parameters
+            channel_name = line[1:line.find(']')]
+            parameters = {}
+        elif '=' in line :
+            (key, value) = line.split('=', 1)
+            parameters[key.strip()] = value.strip()
+    channels_file.close()
+
+    return(channels)
+
+#-------------------------------------------------------------------------------
+# Multiplex of a channel
+#
+def multiplex_of(parameters) :
+    return(tuple(parameters.get(name, '') for name in MULTIPLEX_PARAMETERS))
+
+#-------------------------------------------------------------------------------
+# Read the multiplex of every channel from a DVB channels file
+#
+def read_multiplexes(channels_file_spec) :
+    multiplexes = {}
+    channels = read_channels(channels_file_spec)
+    for (channel_name, parameters) in channels.items() :
+        multiplexes[channel_name.replace(' ', '_')] = multiplex_of(parameters)
+
+    return(multiplexes)
+
+#-------------------------------------------------------------------------------
+# Check if two time intervals overlap
+#
+def overlaps(first, second) :
+    return(first['start'] < second['stop'] and second['start'] < first['stop'])
+
+# ==============================================================================
+# Allocation
+#
+
+#-------------------------------------------------------------------------------
+# Tuner with its recordings sorted by start time
+#
+class Tuner :
+
+    def __init__(self, index) :
+        self.index = index
+        self.starts = []
+        self.recordings = []
+        self.longest = 0
+
+    def overlapping(self, recording) :
+                                # only recordings starting less than the longest
+                                 # recording before the candidate can overlap it
+        first = bisect.bisect_left(
+            self.starts, recording['start_epoch'] - self.longest
+        )
+        last = bisect.bisect_left(self.starts, recording['stop_epoch'])
+
+        return([
+            occupied for occupied in self.recordings[first:last]
+                if overlaps(occupied, recording)
+        ])
+
+    def conflicting(self, recording) :
+        return([
+            occupied for occupied in self.overlapping(recording)
+                if recording['multiplex'] is None
+                    or occupied['multiplex'] != recording['multiplex']
+        ])
+
+    def add(self, recording) :
+        position = bisect.bisect_right(self.starts, recording['start_epoch'])
+        self.starts.insert(position, recording['start_epoch'])
+        self.recordings.insert(position, recording)
+        self.longest = max(
+            self.longest, recording['stop_epoch'] - recording['start_epoch']
+        )
+        recording['tuner'] = self.index
+
+    def remove(self, recording) :
+        position = self.recordings.index(recording)
+        del self.starts[position]
+        del self.recordings[position]
+
+#-------------------------------------------------------------------------------
+# Find a tuner for a recording
+#
+# Returns the chosen tuner, preferring one already tuned to the multiplex,
+# or None and the conflicting recordings.
+#
+def find_tuner(tuners, recording) :
+    chosen = None
+    chosen_shares = False
+    conflicts = []
+    for tuner in tuners :
+        occupied = tuner.overlapping(recording)
+        conflicting = tuner.conflicting(recording)
+        if conflicting :
+            conflicts += conflicting
+            continue
+        if chosen is None or (occupied and not chosen_shares) :
+            chosen = tuner
+            chosen_shares = bool(occupied)
+
+    return((chosen, conflicts))
+
+#-------------------------------------------------------------------------------
+# Place an episode by moving conflicting episodes to other airings
+#
+def place_by_moving(tuners, episode, episodes) :
+    for airing in episode['airings'] :
+        for tuner in tuners :
+                                                # conflicting episodes must move
+            conflicting = tuner.conflicting(airing)
+            movable = all(
+                len(episodes[item['identity']]['airings']) > 1 and
+                    item['priority'] <= airing['priority']
+                for item in conflicting
+            )
+            if not conflicting or not movable :
+                continue
+            for item in conflicting :
+                tuner.remove(item)
+            tuner.add(airing)
+                                                    # move them to other airings
+            moved = []
+            for item in conflicting :
+                for alternative in episodes[item['identity']]['airings'] :
+                    if alternative is item :
+                        continue
+                    (alternative_tuner, conflicts) = find_tuner(
+                        tuners, alternative
+                    )
+                    if alternative_tuner is not None :
+                        alternative_tuner.add(alternative)
+                        moved.append((item, alternative))
+                        break
+                else :
+                    break
+            if len(moved) == len(conflicting) :
+                return(airing, moved)
+                                                                          # undo
+            for (item, alternative) in moved :
+                tuners[alternative['tuner']].remove(alternative)
+            tuner.remove(airing)
+            for item in conflicting :
+                tuner.add(item)
+
+    return((None, []))
+
+#-------------------------------------------------------------------------------
+# Allocate recordings to tuners
+#
+# Recordings are dicts with 'start' and 'stop' datetimes, 'channel',
+# 'title', 'multiplex', 'priority' and 'identity', the multiplex being None
+# for recordings which can't share a tuner and the identity None for
+# recordings which are not grouped with other airings. Returns the accepted
+# recordings sorted by start time, each with its 'tuner' index, and the
+# rejected episodes, each with its 'reason'.
+#
+def allocate(recordings, tuners_count=1) :
+    tuners = [Tuner(index) for index in range(tuners_count)]
+                                                      # group airings by episode
+    episodes = {}
+    airings_seen = set()
+    for (order, recording) in enumerate(recordings) :
+        recording['start_epoch'] = recording['start'].timestamp()
+        recording['stop_epoch'] = recording['stop'].timestamp()
+        airing_key = (recording['channel'], recording['start_epoch'])
+        if airing_key in airings_seen :
+            continue
+        airings_seen.add(airing_key)
+        if recording.get('identity') is None :
+            recording['identity'] = ('airing',) + airing_key
+        episode = episodes.setdefault(recording['identity'], {
+            'order' : order, 'priority' : recording['priority'],
+            'airings' : []
+        })
+        episode['priority'] = max(episode['priority'], recording['priority'])
+        episode['airings'].append(recording)
+    for episode in episodes.values() :
+        episode['airings'].sort(key=lambda item : item['start_epoch'])
+                       # higher priority first, then episodes with fewer airings
+    ordered = sorted(
+        episodes.values(),
+        key=lambda item : (
+            -item['priority'], len(item['airings']), item['order']
+        )
+    )
+    rejected = []
+    for episode in ordered :
+                                                       # first airing which fits
+        all_conflicts = []
+        placed = False
+        for airing in episode['airings'] :
+            (tuner, conflicts) = find_tuner(tuners, airing)
+            if tuner is not None :
+                tuner.add(airing)
+                placed = True
+                break
+            all_conflicts += conflicts
+                                                     # move conflicting episodes
+        if not placed :
+            (airing, moved) = place_by_moving(tuners, episode, episodes)
+            placed = airing is not None
+        if not placed :
+            recording = episode['airings'][0]
+            recording['reason'] = "conflicts with %s" % ', '.join(sorted(set(
+                "\"%s\" on %s (tuner %d)" % (
+                    item['title'], item['channel'], item['tuner']
+                ) for item in all_conflicts
+            )))
+            if len(episode['airings']) > 1 :
+                recording['reason'] += " on all %d airings" % (
+                    len(episode['airings'])
+                )
+            rejected.append(recording)
+                                                            # sort by start time
+    accepted = []
+    for tuner in tuners :
+        accepted += tuner.recordings
+    accepted.sort(key=lambda item : (item['start_epoch'], item['channel']))
+    rejected.sort(key=lambda item : (item['start_epoch'], item['channel']))
+
+    return((accepted, rejected))
@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+#
+# Tuner scheduling
+#
+# The recordings loop owns all the tuner adapters. A recording is a hard
+# reservation of its adapter, and the EPG of the multiplexes is grabbed in
+# the idle windows left between the recordings, with a grab timeout ending
+# before the next reservation. A grab still running when a recording starts
+# is stopped, so that the two never share an adapter.
+#
+# A multiplex is grabbed again once its last grab, stamped by epg-grab, is
+# older than the grab interval, the oldest one first. An adapter kept tuned
+# between two recordings only grabs its own multiplex, without retuning.
+#
+# The time every adapter spends recording, grabbing and idle is accounted
+# for the utilisation report.
+#
+import os
+import sys
+import time
+import errno
+import signal
+import tunerAllocator
+
+# ------------------------------------------------------------------------------
+# constants
+#
+EPG_GRAB_SCRIPT = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'epg', 'epg-grab.py'
+)
+GRAB_STAMP_FILE_NAME = '.%s.grabbed'
+FRONTEND_DEVICE = '/dev/dvb/adapter%d/frontend0'
+FREE_TIMEOUT = 5
+FREE_CHECK_PERIOD = 0.1
+GRAB_MARGIN = 30
+MINIMAL_GRAB = 60
+STATES = ('recording', 'grabbing', 'idle')
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Group channels by multiplex
+#
+def group_by_multiplex(channels_file_spec, channel_names) :
+    channel_multiplexes = tunerAllocator.read_multiplexes(channels_file_spec)
+    multiplexes = {}
+    for channel_name in channel_names :
+        channel_name = channel_name.replace(' ', '_')
+        if channel_name not in channel_multiplexes :
+            print("channel \"%s\" not found in %s" % (
+                channel_name, channels_file_spec
+            ))
+            continue
+        multiplexes.setdefault(
+            channel_multiplexes[channel_name], []
+        ).append(channel_name)
+
+    return(multiplexes)
+
+#-------------------------------------------------------------------------------
+# Time of the last grab of a multiplex, from its oldest channel grab stamp
+#
+# The EPG files which haven't changed are not rewritten, so their time is
+# only used for the guides grabbed before the stamps were written.
+#
+def last_grab_time(epg_directory, channel_names) :
+    grab_time = time.time()
+    for channel_name in channel_names :
+        try :
+            grab_time = min(grab_time, os.path.getmtime(os.sep.join([
+                epg_directory, GRAB_STAMP_FILE_NAME % channel_name
+            ])))
+            continue
+        except OSError :
+            pass
+        try :
+            grab_time = min(grab_time, os.path.getmtime(
+                os.sep.join([epg_directory, channel_name + '.xml'])
+            ))
+        except OSError :
+            return(0)
+
+    return(grab_time)
+
+#-------------------------------------------------------------------------------
+# Check if a process has the frontend of an adapter open for tuning
+#
+def frontend_is_busy(index) :
+    try :
+        descriptor = os.open(
+            FRONTEND_DEVICE % index, os.O_RDWR | os.O_NONBLOCK
+        )
+    except OSError as error :
+        return(error.errno == errno.EBUSY)
+    os.close(descriptor)
+
+    return(False)
+
+#-------------------------------------------------------------------------------
+# Duration as hours and minutes
+#
+def duration_string(seconds) :
+    minutes = int(seconds) // 60
+
+    return("%d h %02d min" % (minutes // 60, minutes % 60))
+
+# ==============================================================================
+# Scheduling
+#
+
+#-------------------------------------------------------------------------------
+# Adapter with its state durations
+#
+class Adapter :
+
+    def __init__(self, index) :
+        self.index = index
+        self.state = 'idle'
+        self.since = time.monotonic()
+        self.durations = dict.fromkeys(STATES, 0)
+        self.grab = None
+        self.multiplex = None
+        self.grabs = 0
+        self.tuned_grabs = 0
+
+    def set_state(self, state) :
+        now = time.monotonic()
+        self.durations[self.state] += now - self.since
+        self.since = now
+        self.state = state
+
+    def state_durations(self) :
+        durations = dict(self.durations)
+        durations[self.state] += time.monotonic() - self.since
+
+        return(durations)
+
+#-------------------------------------------------------------------------------
+# Adapters shared by the recordings and the EPG grabs
+#
+class TunerScheduler :
+
+    def __init__(
+        self, adapters, channels_file_spec, epg_directory, channel_names,
+        interval, timeout, supervisor, log_file_spec=os.devnull, verbose=False
+    ) :
+        self.adapters = {adapter : Adapter(adapter) for adapter in adapters}
+        self.channels_file_spec = channels_file_spec
+        self.epg_directory = epg_directory
+        self.interval = interval
+        self.timeout = timeout
+        self.supervisor = supervisor
+        self.log_file_spec = log_file_spec
+        self.log_file = None
+        self.verbose = verbose
+        self.started = time.monotonic()
+        self.completed = 0
+        self.multiplexes = {}
+        self.grabbed = {}
+        if channel_names :
+            self.multiplexes = group_by_multiplex(
+                channels_file_spec, channel_names
+            )
+        for (multiplex, multiplex_channels) in self.multiplexes.items() :
+            self.grabbed[multiplex] = last_grab_time(
+                epg_directory, multiplex_channels
+            )
+
+    def _grabbing(self) :
+        return(set(
+            adapter.multiplex for adapter in self.adapters.values()
+                if adapter.grab is not None
+        ))
+
+    def due(self) :
+                                               # oldest first, not being grabbed
+        now = time.time()
+        grabbing = self._grabbing()
+
+        return(sorted(
+            [
+                multiplex for (multiplex, grab_time) in self.grabbed.items()
+                    if now - grab_time >= self.interval
+                        and multiplex not in grabbing
+            ],
+            key=lambda multiplex : self.grabbed[multiplex]
+        ))
+
+    def next_due(self) :
+        grabbing = self._grabbing()
+        waits = [
+            grab_time + self.interval - time.time()
+                for (multiplex, grab_time) in self.grabbed.items()
+                    if multiplex not in grabbing
+        ]
+        if not waits :
+            return(None)
+
+        return(max(min(waits), 0))
+
+    def is_busy(self) :
+        return(bool(self._grabbing()))
+
+    def _finish(self, adapter) :
+        grab = adapter.grab
+                                      # an interrupted grab is due again at once
+        if not grab.stopped :
+            self.grabbed[adapter.multiplex] = time.time()
+            if grab.returncode == 0 :
+                self.completed += 1
+        adapter.grab = None
+        adapter.multiplex = None
+        adapter.set_state('idle')
+
+    def _start(self, adapter, multiplex, timeout, tuned) :
+        multiplex_channels = self.multiplexes[multiplex]
+        if self.log_file is None :
+            self.log_file = open(self.log_file_spec, 'a')
+        command = [sys.executable, EPG_GRAB_SCRIPT] + multiplex_channels + [
+            '-n', '-a', str(adapter.index), '-t', "%d" % timeout,
+            '-d', self.epg_directory, '-c', self.channels_file_spec,
+            '-l', os.devnull
+        ]
+        if tuned :
+            command.append('-T')
+        if self.verbose :
+            print(INDENT + "grabbing EPG of %s on adapter %d for %d sec" % (
+                ', '.join(multiplex_channels), adapter.index, timeout
+            ))
+        adapter.grab = self.supervisor.start(
+            'EPG grab', command, stdout=self.log_file
+        )
+        adapter.multiplex = multiplex
+        adapter.grabs += 1
+        if tuned :
+            adapter.tuned_grabs += 1
+        adapter.set_state('grabbing')
+
+    def stop_grab(self, index) :
+        adapter = self.adapters[index]
+        if adapter.grab is None :
+            return
+        if adapter.grab.is_running() :
+            if self.verbose :
+                print(INDENT + "stopping EPG grab on adapter %d" % index)
+            adapter.grab.stop(signal.SIGINT)
+        self._finish(adapter)
+
+    def reserve(self, index, tuned=False) :
+        self.stop_grab(index)
+        self.adapters[index].set_state('recording')
+                          # a tuner kept on by the recordings holds the frontend
+        if tuned :
+            return(True)
+        deadline = time.monotonic() + FREE_TIMEOUT
+        while frontend_is_busy(index) :
+            if time.monotonic() > deadline :
+                print(INDENT + "adapter %d is still busy" % index)
+                return(False)
+            time.sleep(FREE_CHECK_PERIOD)
+
+        return(True)
+
+    def release(self, index) :
+        self.adapters[index].set_state('idle')
+
+    def step(self, windows, tuned=None) :
+                                     # windows: seconds to the next reservation,
+                             # for the adapters which have one, tuned: multiplex
+                                 # of the adapters kept tuned between recordings
+        if tuned is None :
+            tuned = {}
+        for adapter in self.adapters.values() :
+            if adapter.grab is not None and not adapter.grab.is_running() :
+                self._finish(adapter)
+        due = self.due()
+        for (index, adapter) in sorted(self.adapters.items()) :
+            if not due :
+                break
+            if adapter.state != 'idle' :
+                continue
+            timeout = self.timeout
+            if windows.get(index) is not None :
+                timeout = min(timeout, windows[index] - GRAB_MARGIN)
+            if timeout < MINIMAL_GRAB :
+                continue
+                                               # keep a tuned adapter on its own
+                                       # multiplex, which the others leave to it
+            if index in tuned :
+                if tuned[index] not in due :
+                    continue
+                multiplex = tuned[index]
+            else :
+                candidates = [
+                    multiplex for multiplex in due
+                        if multiplex not in tuned.values()
+                ]
+                if not candidates :
+                    continue
+                multiplex = candidates[0]
+            due.remove(multiplex)
+            self._start(adapter, multiplex, timeout, index in tuned)
+
+    def stop(self) :
+        for index in self.adapters :
+            self.stop_grab(index)
+        if self.log_file is not None :
+            self.log_file.close()
+            self.log_file = None
+
+    def report(self) :
+        lines = ["tuner utilisation over %s" % duration_string(
+            time.monotonic() - self.started
+        )]
+        for (index, adapter) in sorted(self.adapters.items()) :
+            durations = adapter.state_durations()
+            total = max(sum(durations.values()), 1e-9)
+            lines.append(
+                INDENT + "adapter %d : " % index +
+                ', '.join(
+                    "%.1f%% %s" % (100*durations[state]/total, state)
+                        for state in STATES
+                ) +
+                ", %d EPG grabs, %d without retuning" % (
+                    adapter.grabs, adapter.tuned_grabs
+                )
+            )
+
+        return(lines)
@@ -0,0 +1,102 @@
+#
+# TV box commands
+#
+# The EPG and recording scripts are loaded as modules and run through their
+# main function, so that a single interpreter can run them one after the
+# other, without starting Python and importing the libraries again.
+#
+# The time taken by the import of each script is kept, so that the startup
+# cost can be told apart from the work of the command.
+#
+import os
+import sys
+import time
+import importlib.util
+
+# ------------------------------------------------------------------------------
+# constants
+#
+BASE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+EPG_DIRECTORY = os.path.join(BASE_DIRECTORY, 'epg')
+RECORDING_DIRECTORY = os.path.join(BASE_DIRECTORY, 'recording')
+COMMANDS = {
+    'grab'       : (EPG_DIRECTORY, 'epg-grab.py', 'grab the EPG'),
+    'display'    : (EPG_DIRECTORY, 'epg-display.py', 'display the EPG'),
+    'index'      : (EPG_DIRECTORY, 'epgIndex.py', 'index the EPG files'),
+    'search'     : (EPG_DIRECTORY, 'epgSearch.py', 'search the programmes'),
+    'eit'        : (EPG_DIRECTORY, 'eit.py', 'decode the EIT of a stream'),
+    'api'        : (EPG_DIRECTORY, 'epgService.py', 'serve the EPG as JSON'),
+    'schedule'   : (
+        RECORDING_DIRECTORY, 'buildSchedule.py', 'build the schedule'
+    ),
+    'record'     : (
+        RECORDING_DIRECTORY, 'recordProgrammes.py', 'record the schedule'
+    ),
+    'serve'      : (
+        RECORDING_DIRECTORY, 'streamServer.py', 'serve the recordings'
+    ),
+    'split'      : (
+        RECORDING_DIRECTORY, 'tsSplitter.py', 'split a multiplex stream'
+    ),
+    'recorder'   : (
+        RECORDING_DIRECTORY, 'tsRecorder.py', 'record a stream to a file'
+    ),
+    'retention'  : (
+        RECORDING_DIRECTORY, 'recordingsRetention.py',
+        'free space for the recordings'
+    ),
+    'postprocess': (
+        RECORDING_DIRECTORY, 'postProcessing.py', 'run the post-processing'
+    ),
+}
+
+for directory in (EPG_DIRECTORY, RECORDING_DIRECTORY) :
+    if directory not in sys.path :
+        sys.path.append(directory)
+
+import_times = {}
+
+# ==============================================================================
+# Functions
+#
+
+#-------------------------------------------------------------------------------
+# Module of a command, imported once
+#
+def load(command) :
+    (directory, file_name, description) = COMMANDS[command]
+    module_name = os.path.splitext(file_name)[0]
+    if module_name in sys.modules :
+        return(sys.modules[module_name])
+    start = time.perf_counter()
+                                     # hyphenated file names are not identifiers
+    specification = importlib.util.spec_from_file_location(
+        module_name, os.path.join(directory, file_name)
+    )
+    module = importlib.util.module_from_spec(specification)
+    sys.modules[module_name] = module
+    try :
+        specification.loader.exec_module(module)
+    except BaseException :
+        del sys.modules[module_name]
+        raise
+    import_times[command] = time.perf_counter() - start
+
+    return(module)
+
+#-------------------------------------------------------------------------------
+# Run a command with its arguments, returning the exit code
+#
+def run(command, arguments) :
+    module = load(command)
+    try :
+        module.main(arguments)
+    except SystemExit as exit :
+        if exit.code is None :
+            return(0)
+        if isinstance(exit.code, int) :
+            return(exit.code)
+        print(exit.code, file=sys.stderr)
+        return(1)
+
+    return(0)
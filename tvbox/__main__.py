@@ -0,0 +1,160 @@
+#
+# TV box command line
+#
+# Runs one of the TV box commands with its own arguments:
+#   python3 -m tvbox grab Arte TF1 -l /dev/null
+# The commands which are worth keeping resident are sent to the daemon when
+# it is running, and run in this process otherwise. The daemon is started
+# with "python3 -m tvbox daemon".
+#
+import argparse
+import os
+import sys
+import json
+import time
+import socket
+start_time = time.perf_counter()
+import tvbox
+import tvbox.daemon
+
+# ------------------------------------------------------------------------------
+# constants
+#
+DAEMON_COMMANDS = (
+    'grab', 'display', 'schedule', 'index', 'search', 'record'
+)
+
+INDENT = '  '
+
+# ------------------------------------------------------------------------------
+# command line arguments
+#
+def parse_arguments(arguments=None) :
+    commands = '\n'.join(
+        INDENT + "%-12s %s" % (command, description[2])
+            for (command, description) in tvbox.COMMANDS.items()
+    )
+    controls = '\n'.join([
+        INDENT + "%-12s %s" % ('daemon', 'run the resident daemon'),
+        INDENT + "%-12s %s" % ('status', 'show the daemon statistics'),
+        INDENT + "%-12s %s" % ('stop', 'stop the daemon recordings'),
+        INDENT + "%-12s %s" % ('shutdown', 'stop the daemon'),
+    ])
+    parser = argparse.ArgumentParser(
+        prog='tvbox',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='run a TV box command',
+        epilog="commands:\n%s\n\ndaemon control:\n%s" % (commands, controls)
+    )
+                                                                 # daemon socket
+    parser.add_argument(
+        '-s', '--socket', default=tvbox.daemon.socket_file_spec(),
+        help = 'daemon socket file'
+    )
+                                                                # run in-process
+    parser.add_argument(
+        '-L', '--local', action='store_true', dest='local',
+        help = 'run the command in this process'
+    )
+                                                                # report timings
+    parser.add_argument(
+        '-t', '--timing', action='store_true', dest='timing',
+        help = 'report the import and run times'
+    )
+                                                                       # verbose
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', dest='verbose',
+        help = 'verbose daemon console output'
+    )
+                                                         # command and arguments
+    parser.add_argument('command')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER)
+
+    return(parser.parse_args(arguments))
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Send a command to the daemon, returning the exit code and daemon run time
+#
+def forward(socket_spec, command, arguments) :
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_spec)
+    request = {'command': command, 'arguments': arguments, 'cwd': os.getcwd()}
+    connection.sendall((json.dumps(request) + '\n').encode())
+    replies = connection.makefile('r')
+    code = 1
+    seconds = 0
+    for line in replies :
+        reply = json.loads(line)
+        if 'output' in reply :
+            stream = sys.stderr if reply['stream'] == 'stderr' else sys.stdout
+            stream.write(reply['output'])
+            stream.flush()
+        else :
+            code = reply['code']
+            seconds = reply['seconds']
+    replies.close()
+    connection.close()
+
+    return((code, seconds))
+
+# ==============================================================================
+# main script
+#
+def main(arguments=None) :
+    parser_arguments = parse_arguments(arguments)
+    command = parser_arguments.command
+    command_arguments = parser_arguments.arguments
+    socket_spec = parser_arguments.socket
+    start_up = time.perf_counter() - start_time
+                                                                # run the daemon
+    if command == 'daemon' :
+        tvbox.daemon.run(socket_spec, DAEMON_COMMANDS, parser_arguments.verbose)
+        return(0)
+                                                            # send to the daemon
+    to_daemon = command in DAEMON_COMMANDS + tvbox.daemon.CONTROL_COMMANDS
+    if to_daemon and not parser_arguments.local :
+        if os.path.exists(socket_spec) :
+            start = time.perf_counter()
+            try :
+                (code, seconds) = forward(
+                    socket_spec, command, command_arguments
+                )
+            except ConnectionRefusedError :
+                print("no daemon on \"%s\"" % socket_spec, file=sys.stderr)
+                return(1)
+            if parser_arguments.timing :
+                print(
+                    "%s: %.1f ms start, %.1f ms in daemon, %.1f ms round trip"
+                        % (
+                            command, 1000*start_up, 1000*seconds,
+                            1000*(time.perf_counter() - start)
+                        ),
+                    file=sys.stderr
+                )
+            return(code)
+    if command in tvbox.daemon.CONTROL_COMMANDS :
+        print("no daemon on \"%s\"" % socket_spec, file=sys.stderr)
+        return(1)
+    if command not in tvbox.COMMANDS :
+        print("unknown command \"%s\"" % command, file=sys.stderr)
+        return(2)
+                                                           # run in this process
+    tvbox.load(command)
+    start = time.perf_counter()
+    code = tvbox.run(command, command_arguments)
+    if parser_arguments.timing :
+        print(
+            "%s: %.1f ms start, %.1f ms import, %.1f ms run" % (
+                command, 1000*start_up, 1000*tvbox.import_times.get(command, 0),
+                1000*(time.perf_counter() - start)
+            ),
+            file=sys.stderr
+        )
+    return(code)
+
+if __name__ == '__main__' :
+    sys.exit(main())
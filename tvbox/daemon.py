@@ -0,0 +1,381 @@
+#
+# TV box daemon
+#
+# A single resident process runs the commands sent on a Unix socket, so that
+# the scripts and their libraries are imported once, and the channel files
+# parsed by the scripts are kept in the loaded modules.
+#
+# A request is a JSON line with the command, its arguments and the working
+# directory of the client. The output of the command is sent back as JSON
+# lines while it runs, followed by a last line with the exit code and the
+# time taken. The commands answered at once run one at a time, in the
+# working directory of their client. The recordings loop runs in a thread
+# of its own, with its output going to the log. As the working directory
+# changes with the other commands, its relative path arguments are made
+# absolute against the directory of its client. While it grabs the EPG
+# itself, the grab command is refused.
+#
+# The threads started by a command write to the output of the command.
+#
+import os
+import sys
+import json
+import time
+import signal
+import tempfile
+import threading
+import traceback
+import socketserver
+import tvbox
+
+# ------------------------------------------------------------------------------
+# constants
+#
+SOCKET_FILE_NAME = 'tvbox.sock'
+BACKGROUND_COMMANDS = ('record',)
+PATH_OPTIONS = {
+    'record' : (
+        '-e', '--epg', '-d', '--dir', '-c', '--channels', '-q', '--queue',
+        '-r', '--rules'
+    ),
+}
+FILE_NAME_OPTIONS = {
+    'record' : ('-l', '--schedule', '-f', '--file'),
+}
+TUNER_COMMANDS = ('grab',)
+CONTROL_COMMANDS = ('status', 'stop', 'shutdown')
+
+INDENT = '  '
+
+# ==============================================================================
+# Internal functions
+#
+
+#-------------------------------------------------------------------------------
+# Default socket file spec
+#
+def socket_file_spec() :
+    directory = os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir())
+    return(os.sep.join([directory, SOCKET_FILE_NAME]))
+
+#-------------------------------------------------------------------------------
+# Absolute path, a bare file name being left to its command
+#
+def absolute_path(value, directory, file_name=False) :
+    if value == '' or os.path.isabs(value) :
+        return(value)
+    if file_name and os.sep not in value :
+        return(value)
+
+    return(os.path.normpath(os.path.join(directory, value)))
+
+#-------------------------------------------------------------------------------
+# Arguments with the paths made absolute against a working directory
+#
+def absolute_arguments(command, arguments, directory) :
+    path_options = PATH_OPTIONS.get(command, ())
+    file_name_options = FILE_NAME_OPTIONS.get(command, ())
+    options = path_options + file_name_options
+    absolute = []
+    option = None
+    for argument in arguments :
+                                                  # value of the previous option
+        if option is not None :
+            absolute.append(absolute_path(
+                argument, directory, option in file_name_options
+            ))
+            option = None
+            continue
+                                       # "--option=value", "-ovalue", "-o value"
+        (name, equal, value) = argument.partition('=')
+        if argument.startswith('--') and equal and name in options :
+            argument = name + '=' + absolute_path(
+                value, directory, name in file_name_options
+            )
+        elif argument[:2] in options and len(argument) > 2 \
+            and not argument.startswith('--') :
+            argument = argument[:2] + absolute_path(
+                argument[2:], directory, argument[:2] in file_name_options
+            )
+        elif argument in options :
+            option = argument
+        absolute.append(argument)
+
+    return(absolute)
+
+# ==============================================================================
+# Output
+#
+
+#-------------------------------------------------------------------------------
+# Output stream sent to a client
+#
+class ClientOutput :
+
+    def __init__(self, connection, stream) :
+        self.connection = connection
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, text) :
+        if text :
+            message = json.dumps({'output': text, 'stream': self.stream})
+            with self.lock :
+                try :
+                    self.connection.sendall((message + '\n').encode())
+                except OSError :
+                    pass
+        return(len(text))
+
+    def flush(self) :
+        pass
+
+#-------------------------------------------------------------------------------
+# Standard stream replacement, writing to the output of the current thread
+#
+class OutputRouter :
+
+    def __init__(self, default) :
+        self.default = default
+        self.targets = {}
+        self.foreground = None
+
+    def target(self) :
+                                 # threads started outside the commands, such as
+                                     # the pools kept by a module, have no entry
+        target = self.targets.get(threading.get_ident())
+        if target is None :
+            target = self.foreground
+        if target is None :
+            target = self.default
+        return(target)
+
+    def write(self, text) :
+        return(self.target().write(text))
+
+    def flush(self) :
+        self.target().flush()
+
+    def isatty(self) :
+        return(False)
+
+# ==============================================================================
+# Daemon
+#
+
+#-------------------------------------------------------------------------------
+# Request handler
+#
+class RequestHandler(socketserver.StreamRequestHandler) :
+
+    def handle(self) :
+        try :
+            request = json.loads(self.rfile.readline())
+            command = request['command']
+            arguments = list(request.get('arguments', []))
+            directory = request.get('cwd', '/')
+        except (ValueError, KeyError, TypeError) :
+            return
+        stdout = ClientOutput(self.connection, 'stdout')
+        stderr = ClientOutput(self.connection, 'stderr')
+        start = time.perf_counter()
+        code = self.server.daemon.execute(
+            command, arguments, directory, stdout, stderr
+        )
+        reply = {'code': code, 'seconds': time.perf_counter() - start}
+        try :
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+        except OSError :
+            pass
+
+#-------------------------------------------------------------------------------
+# Unix socket server
+#
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer) :
+    daemon_threads = True
+
+#-------------------------------------------------------------------------------
+# Resident command runner
+#
+class Daemon :
+
+    def __init__(self, socket_spec, verbose=False) :
+        self.socket_spec = socket_spec
+        self.verbose = verbose
+        self.started = time.time()
+        self.statistics = {}
+        self.foreground_lock = threading.Lock()
+        self.background = {}
+        self.stdout = OutputRouter(sys.stdout)
+        self.stderr = OutputRouter(sys.stderr)
+        self.server = None
+
+    def _inherit_output(self) :
+                           # the threads started by a thread write to its output
+        start = threading.Thread.start
+        routers = (self.stdout, self.stderr)
+        def start_inheriting(thread) :
+            parent = threading.get_ident()
+            targets = [router.targets.get(parent) for router in routers]
+            run = thread.run
+            def run_inheriting() :
+                ident = threading.get_ident()
+                for (router, target) in zip(routers, targets) :
+                    if target is not None :
+                        router.targets[ident] = target
+                try :
+                    run()
+                finally :
+                    for router in routers :
+                        router.targets.pop(ident, None)
+            thread.run = run_inheriting
+            start(thread)
+        threading.Thread.start = start_inheriting
+
+        return(start)
+
+    def _account(self, command, seconds) :
+        (count, total, last) = self.statistics.get(command, (0, 0, 0))
+        self.statistics[command] = (count + 1, total + seconds, seconds)
+
+    def _run(self, command, arguments) :
+        start = time.perf_counter()
+        try :
+            code = tvbox.run(command, arguments)
+        except Exception :
+            traceback.print_exc()
+            code = 1
+        self._account(command, time.perf_counter() - start)
+        return(code)
+
+    def _run_background(self, command, arguments) :
+        thread = threading.get_ident()
+        self.stdout.targets[thread] = self.stdout.default
+        self.stderr.targets[thread] = self.stderr.default
+        code = self._run(command, arguments)
+        if self.verbose :
+            print("%s ended with code %d" % (command, code))
+        del self.stdout.targets[thread]
+        del self.stderr.targets[thread]
+        del self.background[command]
+
+    def status(self) :
+        lines = ["up for %d sec" % (time.time() - self.started)]
+        for command in sorted(self.statistics) :
+            (count, total, last) = self.statistics[command]
+            import_time = tvbox.import_times.get(command, 0)
+            lines.append(
+                INDENT + "%-12s %4d runs, %8.1f ms mean, %8.1f ms last, "
+                    % (command, count, 1000*total/count, 1000*last) +
+                "%6.1f ms import" % (1000*import_time)
+            )
+        for command in sorted(self.background) :
+            lines.append(INDENT + "%s running" % command)
+        return('\n'.join(lines) + '\n')
+
+    def stop_background(self) :
+        if 'record' in self.background :
+            tvbox.load('record').stop()
+        for thread in list(self.background.values()) :
+            thread.join()
+
+    def shutdown(self) :
+        if self.server is not None :
+                                 # the server loop cannot be stopped from itself
+            threading.Thread(target=self.server.shutdown).start()
+
+    def execute(self, command, arguments, directory, stdout, stderr) :
+        thread = threading.get_ident()
+        self.stdout.targets[thread] = stdout
+        self.stderr.targets[thread] = stderr
+        try :
+            if command == 'status' :
+                stdout.write(self.status())
+                return(0)
+            if command == 'stop' :
+                self.stop_background()
+                return(0)
+            if command == 'shutdown' :
+                self.shutdown()
+                return(0)
+            if command not in tvbox.COMMANDS :
+                stderr.write("unknown command \"%s\"\n" % command)
+                return(2)
+                          # the recordings loop owns the tuners and grabs itself
+            if command in TUNER_COMMANDS and 'record' in self.background \
+                and tvbox.load('record').grab_channels :
+                stderr.write(
+                    "the tuners are used by record, which grabs the EPG " +
+                    "given with -g\n"
+                )
+                return(1)
+                                      # the background commands write to the log
+            if command in BACKGROUND_COMMANDS :
+                if command in self.background :
+                    stderr.write("%s is already running\n" % command)
+                    return(1)
+                arguments = absolute_arguments(command, arguments, directory)
+                background = threading.Thread(
+                    target=self._run_background, args=(command, arguments),
+                    name=command
+                )
+                self.background[command] = background
+                background.start()
+                stdout.write("%s started\n" % command)
+                return(0)
+                         # the other commands run one at a time, in the client's
+                                                             # working directory
+            with self.foreground_lock :
+                os.chdir(directory)
+                self.stdout.foreground = stdout
+                self.stderr.foreground = stderr
+                try :
+                    return(self._run(command, arguments))
+                finally :
+                    self.stdout.foreground = None
+                    self.stderr.foreground = None
+        finally :
+            del self.stdout.targets[thread]
+            del self.stderr.targets[thread]
+
+    def serve(self) :
+        if os.path.exists(self.socket_spec) :
+            os.remove(self.socket_spec)
+        self.server = Server(self.socket_spec, RequestHandler)
+        self.server.daemon = self
+        (sys.stdout, sys.stderr) = (self.stdout, self.stderr)
+        start = self._inherit_output()
+        try :
+            self.server.serve_forever()
+        finally :
+            threading.Thread.start = start
+            sys.stdout = self.stdout.default
+            sys.stderr = self.stderr.default
+            self.server.server_close()
+            os.remove(self.socket_spec)
+            self.stop_background()
+
+# ==============================================================================
+# Functions
+#
+
+#-------------------------------------------------------------------------------
+# Run the daemon until it is shut down
+#
+def run(socket_spec=None, preload=(), verbose=False) :
+    if socket_spec is None :
+        socket_spec = socket_file_spec()
+    daemon = Daemon(socket_spec, verbose)
+    for command in preload :
+        tvbox.load(command)
+        if verbose :
+            print(INDENT + "%-12s imported in %.1f ms" % (
+                command, 1000*tvbox.import_times.get(command, 0)
+            ))
+    signal.signal(signal.SIGTERM, lambda number, frame : daemon.shutdown())
+    signal.signal(signal.SIGINT, lambda number, frame : daemon.shutdown())
+    if verbose :
+        print("serving on \"%s\"" % socket_spec)
+    daemon.serve()
+    if verbose :
+        print("daemon stopped")